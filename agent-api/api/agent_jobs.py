@@ -0,0 +1,150 @@
+"""
+Agent runs as jobs on the durable queue (job_queue.py).
+
+With AGENT_QUEUE_URL set, the API tier keeps everything around an agent
+turn: storing messages, scrapes and ingest, the prompt, the reply and the
+feed. Only the Claude CLI run goes to the queue. Worker nodes
+(`python -m api.worker`) lease runs and execute them with the same
+call_claude_cli, and adding workers adds capacity. Without AGENT_QUEUE_URL,
+runs stay in-process as before.
+
+A run carries what call_claude_cli needs, plus the request deadline as an
+absolute time:
+- The job expires if no worker starts it while a useful run still fits.
+- The worker caps the run at what is left of the deadline.
+- The API cancels the job if the deadline passes first. The worker's next
+  heartbeat sees this and kills the run.
+
+Errors come back as {"kind": ...} and are raised again on the API side as
+the exception the in-process path would have raised. A RuntimeError still
+triggers the fresh-session fallback: a CLI session lives on the worker
+that created it, so resuming it on another worker fails and the turn falls
+back to a fresh session. Give workers a shared ~/.claude to avoid that.
+Only runs that never started (the worker's agent breaker was open) are
+retried on the same worker or another. A run whose worker died is retried
+until it has been attempted AGENT_JOB_MAX_ATTEMPTS times.
+
+Workers on other hosts need AGENT_QUEUE_URL=supabase://, which keeps the
+queue in the project's agent_jobs table. A sqlite:// queue is one local
+file, so the API and every worker must share a machine:
+    AGENT_QUEUE_URL=supabase:// python -m api.worker                    # on each worker host
+    AGENT_QUEUE_URL=sqlite:///tmp/agent-jobs.db uvicorn api.main:app --port 3500
+    AGENT_QUEUE_URL=sqlite:///tmp/agent-jobs.db python -m api.worker   # once per worker
+"""
+import os
+import time
+import asyncio
+import logging
+
+try:
+    from api import breakers, job_queue, run_limits
+    from api.deadline import DeadlineExceeded
+except ImportError:
+    import breakers
+    import job_queue
+    import run_limits
+    from deadline import DeadlineExceeded
+
+logger = logging.getLogger("onboarding-agent.agent_jobs")
+
+AGENT_QUEUE_URL = os.environ.get("AGENT_QUEUE_URL", "")
+AGENT_QUEUE_NAME = "agent_runs"
+AGENT_JOB_MAX_ATTEMPTS = int(os.environ.get("AGENT_JOB_MAX_ATTEMPTS", "2"))
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "30"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "0.25"))
+
+ENABLED = bool(AGENT_QUEUE_URL)
+
+_backend: job_queue.QueueBackend | None = None
+
+
+def backend() -> job_queue.QueueBackend:
+    global _backend
+    if _backend is None:
+        _backend = job_queue.open_backend(AGENT_QUEUE_URL)
+    return _backend
+
+
+async def run(
+    prompt: str,
+    org_id: str,
+    resume_session: str | None,
+    resources: dict,
+    run_by: float,
+    finish_by: float,
+) -> tuple[str, str, dict]:
+    """
+    Queue a CLI run and wait for its result (call_claude_cli's return value).
+    `run_by` is the latest epoch time a run may start, `finish_by` when it
+    must be done. `resources` is filled from the worker's accounting.
+    """
+    queue = backend()
+    job_id = await asyncio.to_thread(queue.enqueue, AGENT_QUEUE_NAME, {
+        "prompt": prompt,
+        "org_id": org_id,
+        "resume_session": resume_session,
+        "finish_by": finish_by,
+    }, AGENT_JOB_MAX_ATTEMPTS, run_by)
+    logger.info(f"Queued agent run {job_id} for org {org_id}")
+
+    try:
+        while True:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            job = await asyncio.to_thread(queue.get, job_id)
+            if job is None:
+                raise LookupError(f"Agent job {job_id} disappeared from the queue")
+            if job.finished:
+                break
+            now = time.time()
+            if job.status == "queued" and now > run_by:
+                raise DeadlineExceeded("agent_queue")
+            if now > finish_by:
+                raise asyncio.TimeoutError()
+    except BaseException:
+        # Gave up (deadline, cancelled turn) — stop the run wherever it is
+        await asyncio.shield(asyncio.to_thread(queue.cancel, job_id))
+        raise
+
+    if job.status == "expired":
+        raise DeadlineExceeded("agent_queue")
+    if job.status == "cancelled":
+        raise asyncio.CancelledError()
+    resources.update((job.result or job.error or {}).get("resources") or {})
+    if job.status == "done":
+        return job.result["reply"], job.result["stderr"], job.result["meta"]
+    raise _error(job.error or {})
+
+
+def error_for(exc: BaseException, resources: dict) -> tuple[dict, bool]:
+    """Encode a worker-side exception from call_claude_cli as (error, retryable)."""
+    if isinstance(exc, breakers.CircuitOpen):
+        return {"kind": "unavailable"}, True
+    if isinstance(exc, asyncio.TimeoutError):
+        error = {"kind": "timeout"}
+    elif isinstance(exc, run_limits.RunLimitExceeded):
+        error = {"kind": "killed", "reason": exc.reason}
+    elif isinstance(exc, RuntimeError):
+        error = {"kind": "cli_failed", "message": str(exc)}
+    else:
+        error = {"kind": "error", "message": repr(exc)}
+    return {**error, "resources": resources}, False
+
+
+def _error(error: dict) -> BaseException:
+    """The API-side exception for a failed run."""
+    kind = error.get("kind")
+    if kind == "unavailable":
+        return breakers.CircuitOpen("agent")
+    if kind == "timeout":
+        return asyncio.TimeoutError()
+    if kind == "killed":
+        return run_limits.RunLimitExceeded(error.get("reason", "unknown"))
+    if kind == "cli_failed":
+        return RuntimeError(error.get("message", "Claude CLI failed"))
+    return Exception(f"Agent job failed: {error}")
+
+
+async def stats() -> dict:
+    if not ENABLED:
+        return {"enabled": False}
+    return {"enabled": True, **await asyncio.to_thread(backend().stats, AGENT_QUEUE_NAME)}
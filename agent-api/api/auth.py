@@ -2,14 +2,30 @@
 Supabase auth verification for the onboarding agent API.
 Uses Supabase's auth.get_user() to verify tokens (supports ES256 + HS256).
 Extracts user_id, org_id, email from the verified user + profile lookup.
+Verified tokens are cached briefly so polling endpoints skip the auth round trip;
+the org membership is re-checked on every cache hit.
 """
 import os
+import json
+import time
+import base64
+import asyncio
+import hashlib
 import logging
+import secrets
+from collections import OrderedDict
 from dataclasses import dataclass
 
 from fastapi import Request, HTTPException
 from supabase import create_client, Client
 
+try:
+    from api import breakers
+    from api.deadline import Deadline, DeadlineExceeded
+except ImportError:
+    import breakers
+    from deadline import Deadline, DeadlineExceeded
+
 logger = logging.getLogger("onboarding-agent.auth")
 
 SUPABASE_URL = os.environ["SUPABASE_URL"]
@@ -17,6 +33,30 @@ SUPABASE_SERVICE_KEY = os.environ["SUPABASE_SERVICE_KEY"]
 
 _supabase: Client | None = None
 
+# ── Verified-token cache ──
+# Keyed by a hash of the access token; entries never outlive the token's own exp.
+# A hit skips auth.get_user() but still re-reads the user's profile, so a user
+# moved to another org (or whose profile was removed) loses the old org at
+# once. Logout and bans are only seen by get_user(): a revoked token keeps
+# working for up to AUTH_CACHE_TTL seconds. Set it to 0 to verify every call.
+AUTH_CACHE_TTL = float(os.environ.get("AUTH_CACHE_TTL", "30"))
+AUTH_CACHE_MAX = int(os.environ.get("AUTH_CACHE_MAX", "1024"))
+_token_cache: "OrderedDict[str, tuple[float, UserContext]]" = OrderedDict()
+
+# profiles.role values allowed to manage the org's catalog (see require_org_staff)
+ORG_STAFF_ROLES = ("admin", "staff", "super_admin")
+
+# Cap on the get_user + profile round trip, further clipped to the request deadline
+AUTH_TIMEOUT = float(os.environ.get("AUTH_TIMEOUT", "10"))
+
+# ── Feed stream tickets ──
+# EventSource can't send an Authorization header, and a token in the query
+# string ends up in the nginx and uvicorn access logs. The client trades its
+# token for a single-use ticket (POST /api/feed/ticket) and opens
+# /api/feed?ticket=... within STREAM_TICKET_TTL seconds.
+STREAM_TICKET_TTL = float(os.environ.get("STREAM_TICKET_TTL", "30"))
+_stream_tickets: "dict[str, tuple[float, UserContext]]" = {}
+
 
 def get_supabase() -> Client:
     global _supabase
@@ -34,22 +74,191 @@ class UserContext:
     access_token: str
 
 
+def token_expiry(token: str) -> float | None:
+    """Read the (unverified) exp claim from a JWT. Only used to bound cache lifetime."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return float(exp) if exp else None
+    except Exception:
+        return None
+
+
+def _cache_get(key: str) -> UserContext | None:
+    entry = _token_cache.get(key)
+    if entry is None:
+        return None
+    expires_at, ctx = entry
+    if time.time() >= expires_at:
+        _token_cache.pop(key, None)
+        return None
+    return ctx
+
+
+def _cache_put(key: str, token: str, ctx: UserContext) -> None:
+    if AUTH_CACHE_TTL <= 0:
+        return
+    expires_at = time.time() + AUTH_CACHE_TTL
+    exp = token_expiry(token)
+    if exp is not None:
+        expires_at = min(expires_at, exp)
+    _token_cache[key] = (expires_at, ctx)
+    _token_cache.move_to_end(key)
+    while len(_token_cache) > AUTH_CACHE_MAX:
+        _token_cache.popitem(last=False)
+
+
 async def verify_supabase_jwt(request: Request) -> UserContext:
     """
     Dependency that verifies the Supabase access token via auth.get_user(),
     then looks up the user's profile to get org_id and full_name.
+    Successful verifications are cached for AUTH_CACHE_TTL seconds, with the
+    org membership re-checked on each hit. The lookup counts against the
+    request deadline, if the app set one.
     """
     auth_header = request.headers.get("Authorization", "")
     if not auth_header.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
 
-    token = auth_header[7:]
+    return await _verify_token(auth_header[7:], getattr(request.state, "deadline", None))
+
+
+async def require_super_admin(request: Request) -> UserContext:
+    """Dependency for admin endpoints: a verified user with the super_admin role in user_roles."""
+    user = await verify_supabase_jwt(request)
+
+    def _is_super_admin() -> bool:
+        with breakers.supabase_rest.guard():
+            result = get_supabase().table("user_roles") \
+                .select("role") \
+                .eq("user_id", user.user_id) \
+                .eq("role", "super_admin") \
+                .limit(1) \
+                .execute()
+        return bool(result.data)
+
+    try:
+        allowed = await asyncio.to_thread(_is_super_admin)
+    except breakers.CircuitOpen:
+        raise HTTPException(status_code=503, detail="Authentication is temporarily unavailable")
+    if not allowed:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user
+
+
+async def require_org_staff(request: Request) -> UserContext:
+    """Dependency for org management endpoints: a verified user whose profile role is admin or staff."""
+    user = await verify_supabase_jwt(request)
+
+    def _is_staff() -> bool:
+        with breakers.supabase_rest.guard():
+            result = get_supabase().table("profiles") \
+                .select("role") \
+                .eq("user_id", user.user_id) \
+                .eq("org_id", user.org_id) \
+                .in_("role", list(ORG_STAFF_ROLES)) \
+                .limit(1) \
+                .execute()
+        return bool(result.data)
+
+    try:
+        allowed = await asyncio.to_thread(_is_staff)
+    except breakers.CircuitOpen:
+        raise HTTPException(status_code=503, detail="Authentication is temporarily unavailable")
+    if not allowed:
+        raise HTTPException(status_code=403, detail="Admin or staff access required")
+    return user
+
+
+def issue_stream_ticket(user: UserContext) -> str:
+    """Issue a single-use ticket that authenticates one /api/feed connection as `user`."""
+    now = time.time()
+    for ticket, (expires_at, _) in list(_stream_tickets.items()):
+        if expires_at <= now:
+            del _stream_tickets[ticket]
+    ticket = secrets.token_urlsafe(32)
+    _stream_tickets[ticket] = (now + STREAM_TICKET_TTL, user)
+    return ticket
+
+
+async def verify_stream_token(request: Request) -> UserContext:
+    """
+    Like verify_supabase_jwt, but also accepts ?ticket= (see issue_stream_ticket)
+    for EventSource clients, which cannot set an Authorization header.
+    """
+    auth_header = request.headers.get("Authorization", "")
+    if auth_header.startswith("Bearer "):
+        return await _verify_token(auth_header[7:], getattr(request.state, "deadline", None))
+
+    ticket = request.query_params.get("ticket", "")
+    entry = _stream_tickets.pop(ticket, None) if ticket else None
+    if entry is None or time.time() >= entry[0]:
+        raise HTTPException(status_code=401, detail="Missing, expired or already used stream ticket")
+    return entry[1]
+
+
+async def _verify_token(token: str, deadline: Deadline | None = None) -> UserContext:
+    cache_key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        try:
+            member = await (deadline or Deadline()).run(
+                "auth", asyncio.to_thread(_still_member, cached), cap=AUTH_TIMEOUT,
+            )
+        except (DeadlineExceeded, asyncio.TimeoutError):
+            logger.warning("Org membership re-check timed out")
+            raise HTTPException(status_code=504, detail="Authentication timed out")
+        if member:
+            return cached
+        _token_cache.pop(cache_key, None)
+        if member is False:
+            logger.info(f"User {cached.user_id} is no longer in org {cached.org_id} — re-verifying")
 
+    # The Supabase calls block — run them off the event loop, within budget
+    try:
+        ctx = await (deadline or Deadline()).run(
+            "auth", asyncio.to_thread(_lookup_user, token), cap=AUTH_TIMEOUT,
+        )
+    except (DeadlineExceeded, asyncio.TimeoutError):
+        logger.warning("Token verification timed out")
+        raise HTTPException(status_code=504, detail="Authentication timed out")
+    _cache_put(cache_key, token, ctx)
+    return ctx
+
+
+def _still_member(ctx: UserContext) -> bool | None:
+    """
+    Whether the cached user's profile still belongs to the cached org. None
+    if the lookup failed, in which case the caller verifies from scratch.
+    """
+    try:
+        with breakers.supabase_rest.guard():
+            result = get_supabase().table("profiles") \
+                .select("org_id") \
+                .eq("user_id", ctx.user_id) \
+                .limit(1) \
+                .execute()
+    except breakers.CircuitOpen:
+        # Supabase is down: keep the verification we have until it expires
+        return True
+    except Exception as e:
+        logger.warning(f"Org membership re-check failed: {e}")
+        return None
+    return bool(result.data) and result.data[0].get("org_id") == ctx.org_id
+
+
+def _lookup_user(token: str) -> UserContext:
     # Verify token via Supabase Auth API (works with both HS256 and ES256)
     sb = get_supabase()
     try:
-        user_response = sb.auth.get_user(token)
+        with breakers.auth.guard():
+            user_response = sb.auth.get_user(token)
     except Exception as e:
+        if isinstance(e, breakers.CircuitOpen) or breakers.is_outage(e):
+            # Supabase Auth is down, not the token — don't send the user back to login
+            logger.warning(f"Token verification unavailable: {e}")
+            raise HTTPException(status_code=503, detail="Authentication is temporarily unavailable")
         logger.warning(f"Token verification failed: {e}")
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
@@ -61,7 +270,11 @@ async def verify_supabase_jwt(request: Request) -> UserContext:
     email = user.email or ""
 
     # Look up profile for org_id and full_name
-    result = sb.table("profiles").select("org_id, full_name").eq("user_id", user_id).single().execute()
+    try:
+        with breakers.supabase_rest.guard():
+            result = sb.table("profiles").select("org_id, full_name").eq("user_id", user_id).single().execute()
+    except breakers.CircuitOpen:
+        raise HTTPException(status_code=503, detail="Authentication is temporarily unavailable")
 
     if not result.data:
         raise HTTPException(status_code=403, detail="Profile not found")
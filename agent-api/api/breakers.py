@@ -0,0 +1,219 @@
+"""
+Circuit breakers for the API's backends.
+
+When Supabase or scrape-brand degrades, every call otherwise waits out its
+full timeout and chats pile up behind it. Each backend gets a breaker:
+- supabase_rest: table queries and RPCs
+- auth: token verification
+- edge_functions: scrape-brand
+- agent: the Claude CLI
+
+A breaker trips open when at least BREAKER_MIN_CALLS calls in the last
+BREAKER_WINDOW seconds ended with a failure rate of BREAKER_FAILURE_RATE
+or more. Calls then fail fast with CircuitOpen, and callers fall back (a
+cached state block, skipping the scrape, and so on). After
+BREAKER_OPEN_SECONDS one probe call is let through (half-open). Its
+outcome closes the breaker or re-opens it.
+
+Only outage-like errors count as failures: transport errors, timeouts and
+5xx responses. An error the backend answered with (a bad query, an invalid
+token) means it is up. For the agent, a run that timed out or could not
+resume its session is not a failure either (see is_agent_outage).
+Breakers are shared between the event loop and worker threads, so their
+state is lock-protected.
+"""
+import os
+import re
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+import httpx
+
+logger = logging.getLogger("onboarding-agent.breakers")
+
+BREAKER_FAILURE_RATE = float(os.environ.get("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_MIN_CALLS = int(os.environ.get("BREAKER_MIN_CALLS", "5"))
+BREAKER_WINDOW = float(os.environ.get("BREAKER_WINDOW", "30"))
+BREAKER_OPEN_SECONDS = float(os.environ.get("BREAKER_OPEN_SECONDS", "30"))
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a backend whose breaker is open."""
+
+    def __init__(self, name: str):
+        super().__init__(f"{name} circuit is open")
+        self.name = name
+
+
+def is_outage(exc: BaseException) -> bool:
+    """True for errors that say the backend is down or overloaded, not that the call was bad."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    if isinstance(exc, (httpx.TransportError, TimeoutError, OSError)):
+        return True
+    # supabase-py errors carry the HTTP status: the auth client's as `status`
+    # (0 for network errors), postgrest's as `code` when the body wasn't JSON
+    for attr in ("status", "code"):
+        value = getattr(exc, attr, None)
+        if type(value) is int and (value == 0 or value >= 500):
+            return True
+    return False
+
+
+# Claude CLI failure text that means the API side is down or overloaded
+_AGENT_OUTAGE_TEXT = re.compile(
+    r"\bapi error:?\s*5\d\d\b|\b(status|code)[\s:=]*5\d\d\b"
+    r"|\b(overloaded(_error)?|api_error|internal server error|service unavailable|bad gateway|gateway timeout)\b"
+    r"|\b(econnrefused|econnreset|etimedout|enotfound|eai_again)\b",
+    re.I,
+)
+
+
+def is_agent_outage(exc: BaseException) -> bool:
+    """
+    True when an agent run failed because the backend is down: the CLI could
+    not be spawned, or it reported an API-side 5xx, overload or network error.
+    A run that hit its own deadline or resource limit, or a failed --resume,
+    says nothing about the backend.
+    """
+    if isinstance(exc, TimeoutError):  # a subclass of OSError
+        return False
+    if isinstance(exc, OSError):
+        return True
+    if isinstance(exc, RuntimeError):
+        return bool(_AGENT_OUTAGE_TEXT.search(str(exc)))
+    return False
+
+
+class Breaker:
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = BREAKER_FAILURE_RATE,
+        min_calls: int = BREAKER_MIN_CALLS,
+        window: float = BREAKER_WINDOW,
+        open_seconds: float = BREAKER_OPEN_SECONDS,
+        is_failure: Callable[[BaseException], bool] = is_outage,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.is_failure = is_failure
+        self.state = "closed"
+        self._outcomes: deque[tuple[float, bool]] = deque()  # (monotonic time, ok)
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.trips = 0
+        self.rejected = 0
+
+    def is_open(self) -> bool:
+        """True while calls would be rejected outright (open and still cooling down)."""
+        return self.state == "open" and time.monotonic() - self._opened_at < self.open_seconds
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """
+        Wrap one call to the backend. Raises CircuitOpen on entry if the
+        breaker is open, or half-open with its probe already in flight.
+        """
+        probe = self._admit()
+        try:
+            yield
+        except Exception as e:
+            self._record(not self.is_failure(e), probe)
+            raise
+        except BaseException:
+            # Cancelled — no verdict on the backend, but free the probe slot
+            if probe:
+                with self._lock:
+                    self._probing = False
+            raise
+        else:
+            self._record(True, probe)
+
+    def _admit(self) -> bool:
+        """Let a call through (returning whether it is the half-open probe) or raise CircuitOpen."""
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self.rejected += 1
+                    raise CircuitOpen(self.name)
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open":
+                if self._probing:
+                    self.rejected += 1
+                    raise CircuitOpen(self.name)
+                self._probing = True
+                return True
+            return False
+
+    def _record(self, ok: bool, probe: bool) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if probe:
+                self._probing = False
+                if ok:
+                    self.state = "closed"
+                    self._outcomes.clear()
+                    logger.info(f"Circuit {self.name} closed — probe succeeded")
+                else:
+                    self._trip(now)
+                return
+            if self.state != "closed":
+                return  # a call admitted before the breaker tripped
+            self._outcomes.append((now, ok))
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                self._outcomes.popleft()
+            calls = len(self._outcomes)
+            failures = sum(1 for _, good in self._outcomes if not good)
+            if calls >= self.min_calls and failures / calls >= self.failure_rate:
+                self._trip(now)
+
+    def _trip(self, now: float) -> None:
+        self.state = "open"
+        self._opened_at = now
+        self._outcomes.clear()
+        self.trips += 1
+        logger.warning(f"Circuit {self.name} opened — failing fast for {self.open_seconds:.0f}s")
+
+    def status(self) -> dict:
+        with self._lock:
+            calls = len(self._outcomes)
+            failures = sum(1 for _, good in self._outcomes if not good)
+            retry_in = self._opened_at + self.open_seconds - time.monotonic()
+            return {
+                "state": self.state,
+                "recent_calls": calls,
+                "recent_failure_rate": round(failures / calls, 3) if calls else 0.0,
+                "retry_in_seconds": round(retry_in, 1) if self.state == "open" and retry_in > 0 else 0.0,
+                "trips": self.trips,
+                "rejected": self.rejected,
+            }
+
+
+supabase_rest = Breaker("supabase_rest")
+auth = Breaker("auth")
+edge_functions = Breaker("edge_functions")
+# Agent runs are few and slow — trip on fewer of them and back off longer
+agent = Breaker(
+    "agent",
+    min_calls=int(os.environ.get("AGENT_BREAKER_MIN_CALLS", "3")),
+    window=float(os.environ.get("AGENT_BREAKER_WINDOW", "300")),
+    open_seconds=float(os.environ.get("AGENT_BREAKER_OPEN_SECONDS", "60")),
+    is_failure=is_agent_outage,
+)
+
+_all = (supabase_rest, auth, edge_functions, agent)
+
+
+def states() -> dict:
+    """Breaker states for /api/health."""
+    return {b.name: b.status() for b in _all}
@@ -0,0 +1,119 @@
+"""
+Capture mode: record the full inputs of each dispatched turn for replay.
+
+When CAPTURE_DIR is set, dispatch_message records every turn (or a
+CAPTURE_SAMPLE_RATE fraction of them) as one JSON line in
+CAPTURE_DIR/turns-YYYYMMDD.jsonl. A record holds:
+- the merchant message and attachments
+- the org snapshot and conversation history the turn saw
+- the scrape payload and attachment-ingest results, with their durations
+- the prompt sections
+- the agent's reply, tool log, CLI metadata and timing
+- per-stage timings
+When several queued messages are answered in one turn, the first message's
+record carries the turn and the others are finished with status
+"coalesced" and a coalesced_into link to it. bench/replay.py feeds these
+records back through dispatch_message.
+
+Records contain merchant data (messages, contacts in snapshots, prompts) —
+keep CAPTURE_DIR on the droplet and off backups that leave it.
+"""
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import logging
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger("onboarding-agent.capture")
+
+CAPTURE_DIR = os.environ.get("CAPTURE_DIR", "")
+CAPTURE_SAMPLE_RATE = float(os.environ.get("CAPTURE_SAMPLE_RATE", "1.0"))
+
+_write_lock = threading.Lock()
+_pending_writes: set[asyncio.Future] = set()
+
+
+class Turn:
+    """Accumulates one turn's inputs and stage timings; a no-op when capture is off."""
+
+    def __init__(self, org_id: str, user_id: str, email: str, full_name: str,
+                 message: str, attachments: list[dict] | None):
+        self.enabled = bool(CAPTURE_DIR) and random.random() < CAPTURE_SAMPLE_RATE
+        self._start = self._last = time.perf_counter()
+        self.data: dict = {}
+        if self.enabled:
+            self.data = {
+                "id": str(uuid.uuid4()),
+                "captured_at": datetime.now(timezone.utc).isoformat(),
+                "started_at": time.time(),
+                "org_id": org_id,
+                "user_id": user_id,
+                "email": email,
+                "full_name": full_name,
+                "message": message,
+                "attachments": attachments,
+                "stages": {},
+            }
+
+    def stage(self, name: str) -> float:
+        """Close the stage that ended now, timed from the previous mark; returns its ms."""
+        now = time.perf_counter()
+        ms = round((now - self._last) * 1000, 1)
+        if self.enabled:
+            self.data["stages"][name] = ms
+        self._last = now
+        return ms
+
+    def add(self, key: str, value) -> None:
+        if self.enabled:
+            self.data[key] = value
+
+    def finish(self, status: str) -> None:
+        """Write the record (in a worker thread) — never raises into the turn."""
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.data["status"] = status
+        self.data["total_ms"] = round((time.perf_counter() - self._start) * 1000, 1)
+        try:
+            line = json.dumps(self.data, default=str)
+        except Exception:
+            logger.warning("Failed to serialize captured turn — skipping")
+            return
+        path = os.path.join(CAPTURE_DIR, f"turns-{datetime.now(timezone.utc):%Y%m%d}.jsonl")
+        try:
+            write = asyncio.get_running_loop().run_in_executor(None, _append, path, line)
+        except RuntimeError:
+            _append(path, line)
+            return
+        _pending_writes.add(write)
+        write.add_done_callback(_pending_writes.discard)
+
+
+async def flush(timeout: float = 10.0) -> None:
+    """Wait for captured turns still being written (before the process exits)."""
+    if _pending_writes:
+        await asyncio.wait(list(_pending_writes), timeout=timeout)
+
+
+def _append(path: str, line: str) -> None:
+    try:
+        with _write_lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except OSError:
+        logger.warning(f"Failed to write captured turn to {path} — continuing")
+
+
+def load(paths: list[str]) -> list[dict]:
+    """Read captured turns from JSONL files, ordered by start time."""
+    turns = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            turns.extend(json.loads(line) for line in f if line.strip())
+    return sorted(turns, key=lambda t: t["started_at"])
@@ -0,0 +1,85 @@
+"""
+Per-request deadline budget.
+
+Each chat request gets a deadline when it arrives. By default it is
+REQUEST_DEADLINE seconds (110s, inside nginx's 120s proxy_read_timeout).
+A client may ask for a shorter one with the X-Request-Timeout header, in
+seconds. The deadline is passed through auth, state fetch, scrape, ingest,
+history and the agent run. Each stage gets a budget: its own cap, clipped
+to the time left. If too little time is left, the stage is skipped or
+degraded, so no request-scoped work runs past the point the client stops
+waiting.
+"""
+import os
+import time
+import asyncio
+from typing import Awaitable, TypeVar
+
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", "110"))
+MIN_REQUEST_DEADLINE = 5.0
+DEADLINE_HEADER = "X-Request-Timeout"
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage runs out of request budget."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Request deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    def __init__(self, seconds: float = REQUEST_DEADLINE):
+        self.seconds = seconds
+        self.at = time.monotonic() + seconds
+
+    @classmethod
+    def from_headers(cls, headers) -> "Deadline":
+        """Server default, shortened (never extended) by a valid X-Request-Timeout header."""
+        seconds = REQUEST_DEADLINE
+        try:
+            requested = float(headers.get(DEADLINE_HEADER, ""))
+        except ValueError:
+            requested = None
+        if requested and requested > 0:
+            seconds = max(MIN_REQUEST_DEADLINE, min(requested, REQUEST_DEADLINE))
+        return cls(seconds)
+
+    def remaining(self) -> float:
+        return max(0.0, self.at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def budget(self, cap: float | None = None, reserve: float = 0.0) -> float:
+        """Seconds a stage may take: its cap, clipped to what is left after `reserve`."""
+        left = max(0.0, self.remaining() - reserve)
+        return left if cap is None else min(cap, left)
+
+    def allows(self, seconds: float, reserve: float = 0.0) -> bool:
+        """True if at least `seconds` remain after holding back `reserve`."""
+        return self.remaining() - reserve >= seconds
+
+    def check(self, stage: str) -> None:
+        if self.expired():
+            raise DeadlineExceeded(stage)
+
+    async def run(self, stage: str, aw: Awaitable[T], cap: float | None = None, reserve: float = 0.0) -> T:
+        """
+        Await `aw` within the stage budget. Raises DeadlineExceeded if the
+        request budget ran out; a plain TimeoutError if the stage's own cap
+        did.
+        """
+        budget = self.budget(cap, reserve)
+        if budget <= 0:
+            if asyncio.iscoroutine(aw):
+                aw.close()
+            raise DeadlineExceeded(stage)
+        try:
+            return await asyncio.wait_for(aw, budget)
+        except asyncio.TimeoutError:
+            if cap is None or budget < cap:
+                raise DeadlineExceeded(stage) from None
+            raise
@@ -8,14 +8,40 @@ import os
 import re
 import uuid
 import json
+import base64
+import hashlib
 import logging
 import asyncio
 import time
 from collections import defaultdict
+from dataclasses import dataclass
 
 import httpx
 from supabase import create_client, Client
 
+try:
+    from api import agent_jobs, breakers, capture, fastpath, feed, mcp_pool, metrics, run_limits, schema_digest, scrape_worker, sessions, sql_cache, uploads, warm_agents
+except ImportError:
+    import agent_jobs
+    import breakers
+    import capture
+    import fastpath
+    import feed
+    import mcp_pool
+    import metrics
+    import run_limits
+    import schema_digest
+    import scrape_worker
+    import sessions
+    import sql_cache
+    import uploads
+    import warm_agents
+
+try:
+    from api.deadline import Deadline, DeadlineExceeded
+except ImportError:
+    from deadline import Deadline, DeadlineExceeded
+
 logger = logging.getLogger("onboarding-agent.dispatch")
 
 SUPABASE_URL = os.environ["SUPABASE_URL"]
@@ -24,12 +50,29 @@ CLAUDE_CMD = os.environ.get("CLAUDE_CMD", "claude")
 CLAUDE_MD_PATH = os.environ.get("CLAUDE_MD_PATH", "/opt/peptide-agent/CLAUDE.md")
 
 _supabase: Client | None = None
+_persona_cache: tuple[float, str, str] | None = None  # (CLAUDE.md mtime, schema digest, persona)
 
 # Limit concurrent Claude CLI processes to prevent OOM on the droplet.
 # 8GB RAM, ~1GB per process → max 4 concurrent, rest queue up.
 MAX_CONCURRENT_AGENTS = int(os.environ.get("MAX_CONCURRENT_AGENTS", "4"))
+AGENT_TIMEOUT = float(os.environ.get("AGENT_TIMEOUT", "300"))  # 5 min — MCP server boot + tool execution
 _agent_semaphore = asyncio.Semaphore(MAX_CONCURRENT_AGENTS)
 
+# ── Request deadline budget (see deadline.py) ──
+# Stages before the agent hold back enough time for a useful run plus storing
+# the reply; with less than that left the run is skipped rather than cut short.
+AGENT_MIN_BUDGET = float(os.environ.get("AGENT_MIN_BUDGET", "15"))
+FINISH_RESERVE = float(os.environ.get("FINISH_RESERVE", "2"))
+AGENT_RESERVE = AGENT_MIN_BUDGET + FINISH_RESERVE
+SCRAPE_TIMEOUT = float(os.environ.get("SCRAPE_TIMEOUT", "60"))
+SCRAPE_MIN_BUDGET = 10.0
+STATE_FETCH_TIMEOUT = float(os.environ.get("STATE_FETCH_TIMEOUT", "10"))
+PREP_RESERVE = AGENT_RESERVE + STATE_FETCH_TIMEOUT  # held back by scrape and ingest
+STATE_UNAVAILABLE_BLOCK = (
+    "[CURRENT ORG STATE]\nCouldn't be loaded in time for this turn — "
+    "query the database if you need current state."
+)
+
 # ── Rate limiting ──
 RATE_LIMIT_MAX = int(os.environ.get("RATE_LIMIT_MAX", "10"))
 RATE_LIMIT_WINDOW = int(os.environ.get("RATE_LIMIT_WINDOW", "60"))
@@ -42,6 +85,33 @@ URL_PATTERN = re.compile(
 )
 
 
+# ── Org state cache + pre-warming ──
+STATE_CACHE_TTL = float(os.environ.get("STATE_CACHE_TTL", "30"))
+PREWARM_TIMEOUT = float(os.environ.get("PREWARM_TIMEOUT", "90"))
+PREWARM_INTERVAL = float(os.environ.get("PREWARM_INTERVAL", "60"))
+MAX_PREWARM_TASKS = int(os.environ.get("MAX_PREWARM_TASKS", "8"))
+_snapshot_cache: dict[str, tuple[float, dict]] = {}
+_snapshot_inflight: dict[str, asyncio.Task] = {}
+_prewarm_tasks: dict[str, asyncio.Task] = {}
+_last_prewarm: dict[str, float] = {}
+_ready_scrapes: dict[str, str] = {}
+
+# ── Per-org turn serialization ──
+# At most one agent turn runs per org; messages that arrive meanwhile are
+# coalesced into the org's next turn.
+_org_pending: dict[str, list["_PendingMessage"]] = defaultdict(list)
+_org_runners: dict[str, asyncio.Task] = {}
+
+# ── History pagination ──
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 200
+# How long the cached "latest message" marker for an org is trusted before
+# re-querying. dispatch_message refreshes it on every write, so this only
+# bounds staleness for rows written outside this process.
+HISTORY_MARKER_TTL = float(os.environ.get("HISTORY_MARKER_TTL", "30"))
+_history_markers: dict[str, tuple[float, dict | None]] = {}
+
+
 def check_rate_limit(org_id: str) -> bool:
     """Return True if the org is within rate limits, False if exceeded."""
     now = time.time()
@@ -60,6 +130,26 @@ def get_supabase() -> Client:
     return _supabase
 
 
+def load_persona() -> str:
+    """
+    Return the CLAUDE.md system prompt followed by the schema digest, rebuilt
+    only when either changes (a change rotates agent sessions via its hash).
+    """
+    global _persona_cache
+    try:
+        mtime = os.path.getmtime(CLAUDE_MD_PATH)
+    except OSError:
+        return ""
+    digest = schema_digest.get()
+    if _persona_cache is None or _persona_cache[0] != mtime or _persona_cache[1] is not digest:
+        with open(CLAUDE_MD_PATH, "r") as f:
+            persona = f.read()
+        if digest:
+            persona = f"{persona.rstrip()}\n\n{digest}"
+        _persona_cache = (mtime, digest, persona)
+    return _persona_cache[2]
+
+
 def _extract_urls(text: str) -> list[str]:
     """Extract URLs from a message. Returns de-duped list."""
     urls = URL_PATTERN.findall(text)
@@ -88,20 +178,26 @@ async def _scrape_website(url: str, access_token: str) -> dict | None:
     - CSS color extraction
     - GPT-4o structured extraction (brand + peptides)
     - Persistence to tenant_config + scraped_peptides
+
+    Returns None straight away while the edge-function breaker is open.
     """
     edge_url = f"{SUPABASE_URL}/functions/v1/scrape-brand"
 
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            resp = await client.post(
-                edge_url,
-                json={"url": url, "persist": True},
-                headers={
-                    "Authorization": f"Bearer {access_token}",
-                    "apikey": SUPABASE_SERVICE_KEY,
-                    "Content-Type": "application/json",
-                },
-            )
+        with breakers.edge_functions.guard():
+            async with httpx.AsyncClient(timeout=SCRAPE_TIMEOUT) as client:
+                resp = await client.post(
+                    edge_url,
+                    json={"url": url, "persist": True},
+                    headers={
+                        "Authorization": f"Bearer {access_token}",
+                        "apikey": SUPABASE_SERVICE_KEY,
+                        "Content-Type": "application/json",
+                    },
+                )
+            if resp.status_code >= 500:
+                # Counts against the breaker; logged below
+                resp.raise_for_status()
 
         if resp.status_code != 200:
             logger.warning(f"scrape-brand returned {resp.status_code}: {resp.text[:500]}")
@@ -113,6 +209,12 @@ async def _scrape_website(url: str, access_token: str) -> dict | None:
         )
         return data
 
+    except breakers.CircuitOpen:
+        logger.warning(f"scrape-brand circuit open — skipping scrape of {url}")
+        return None
+    except httpx.HTTPStatusError as e:
+        logger.warning(f"scrape-brand returned {e.response.status_code}: {e.response.text[:500]}")
+        return None
     except Exception:
         logger.exception(f"Failed to scrape {url}")
         return None
@@ -158,166 +260,409 @@ def _format_scrape_results(data: dict) -> str:
             lines.append("Status: Brand data has been auto-saved to tenant_config. Peptides saved to scraped_peptides (pending review).")
         lines.append("")
 
-    lines.append("INSTRUCTIONS: Use this scraped data to set up the merchant's CRM. Apply branding, import the peptides to their catalog, and guide them through the rest of setup. If the brand data was auto-persisted, acknowledge that and ask if they want to adjust anything.")
+    lines.append("INSTRUCTIONS: Use this scraped data to set up the merchant's CRM. Apply branding, import the peptides to their catalog in one call with `SELECT * FROM import_scraped_peptides('<ORG_ID>');` (it skips names already in the catalog and returns the imported table), and guide them through the rest of setup. If the brand data was auto-persisted, acknowledge that and ask if they want to adjust anything.")
 
     return "\n".join(lines)
 
 
-def _fetch_org_state(org_id: str) -> str:
+def _fetch_org_snapshot(org_id: str) -> dict:
     """
-    Query the database for a snapshot of what this org has already configured.
-    Returns a plain-text summary block to inject into the prompt so the agent
-    knows the merchant's current state regardless of conversation history length.
-
-    Each query is independent — one table failure won't kill the whole snapshot.
+    Query the database for a structured snapshot of what this org has already
+    configured. A key is left out when its query fails, so one table failure
+    won't kill the whole snapshot. Raises CircuitOpen without querying while
+    the Supabase breaker is open.
     """
+    if breakers.supabase_rest.is_open():
+        raise breakers.CircuitOpen(breakers.supabase_rest.name)
     sb = get_supabase()
-    lines = []
+    snapshot: dict = {}
 
     # Products
     try:
-        products = sb.table("peptides") \
-            .select("name, retail_price") \
-            .eq("org_id", org_id) \
-            .eq("active", True) \
-            .limit(50) \
-            .execute()
-        if products.data:
-            items = [f"  - {p['name']} (${p['retail_price']})" for p in products.data]
-            lines.append(f"Products ({len(products.data)} active):\n" + "\n".join(items))
-        else:
-            lines.append("Products: None configured yet")
+        with breakers.supabase_rest.guard():
+            products = sb.table("peptides") \
+                .select("name, retail_price") \
+                .eq("org_id", org_id) \
+                .eq("active", True) \
+                .limit(50) \
+                .execute()
+        snapshot["products"] = products.data or []
     except Exception:
         logger.debug("Failed to fetch peptides — skipping")
 
     # Scraped peptides (pending review)
     try:
-        scraped = sb.table("scraped_peptides") \
-            .select("name, price, confidence, status") \
-            .eq("org_id", org_id) \
-            .limit(50) \
-            .execute()
-        if scraped.data:
-            pending = [s for s in scraped.data if s.get("status") == "pending"]
-            approved = [s for s in scraped.data if s.get("status") == "approved"]
-            if pending:
-                lines.append(f"Scraped peptides awaiting review: {len(pending)}")
-            if approved:
-                lines.append(f"Scraped peptides approved: {len(approved)}")
+        with breakers.supabase_rest.guard():
+            scraped = sb.table("scraped_peptides") \
+                .select("name, price, confidence, status") \
+                .eq("org_id", org_id) \
+                .limit(50) \
+                .execute()
+        rows = scraped.data or []
+        snapshot["scraped"] = {
+            "total": len(rows),
+            "pending": sum(1 for s in rows if s.get("status") == "pending"),
+            "approved": sum(1 for s in rows if s.get("status") == "approved"),
+        }
     except Exception:
         logger.debug("Failed to fetch scraped_peptides — skipping")
 
-    # Tenant config (branding, payments)
+    # Tenant config (branding, payments, fulfillment)
     try:
-        config = sb.table("tenant_config") \
-            .select("*") \
-            .eq("org_id", org_id) \
-            .limit(1) \
-            .execute()
-        if config.data:
-            c = config.data[0]
-            brand_parts = []
-            if c.get("primary_color"):
-                brand_parts.append(f"color={c['primary_color']}")
-            if c.get("logo_url"):
-                brand_parts.append("logo=set")
-            if c.get("business_name") or c.get("brand_name"):
-                brand_parts.append(f"name={c.get('business_name') or c.get('brand_name')}")
-            if c.get("website_url"):
-                brand_parts.append(f"website={c['website_url']}")
-            lines.append(f"Branding: {', '.join(brand_parts) if brand_parts else 'Not configured'}")
-
-            pay_parts = []
-            if c.get("venmo_handle"):
-                pay_parts.append(f"Venmo ({c['venmo_handle']})")
-            if c.get("zelle_email"):
-                pay_parts.append(f"Zelle ({c['zelle_email']})")
-            if c.get("stripe_connected"):
-                pay_parts.append("Stripe")
-            lines.append(f"Payments: {', '.join(pay_parts) if pay_parts else 'None configured'}")
-
-            # Fulfillment
-            ship_parts = []
-            if c.get("ship_from_name"):
-                ship_parts.append(f"from={c['ship_from_name']}")
-            if c.get("ship_from_city"):
-                ship_parts.append(f"{c['ship_from_city']}, {c.get('ship_from_state', '')}")
-            lines.append(f"Shipping: {', '.join(ship_parts) if ship_parts else 'Not configured'}")
-        else:
-            lines.append("Branding: Not configured")
-            lines.append("Payments: None configured")
-            lines.append("Shipping: Not configured")
+        with breakers.supabase_rest.guard():
+            config = sb.table("tenant_config") \
+                .select("*") \
+                .eq("org_id", org_id) \
+                .limit(1) \
+                .execute()
+        snapshot["config"] = config.data[0] if config.data else {}
     except Exception:
         logger.debug("Failed to fetch tenant_config — skipping")
 
     # Contacts
     try:
-        contacts = sb.table("contacts") \
-            .select("id", count="exact") \
-            .eq("org_id", org_id) \
-            .limit(1) \
-            .execute()
-        count = contacts.count if contacts.count else 0
-        lines.append(f"Contacts: {count} imported")
+        with breakers.supabase_rest.guard():
+            contacts = sb.table("contacts") \
+                .select("id", count="exact") \
+                .eq("org_id", org_id) \
+                .limit(1) \
+                .execute()
+        snapshot["contacts"] = contacts.count if contacts.count else 0
     except Exception:
         logger.debug("Failed to fetch contacts — skipping")
 
     # Feature flags (from org_features)
     try:
-        flags = sb.table("org_features") \
-            .select("feature_key, enabled") \
-            .eq("org_id", org_id) \
-            .eq("enabled", True) \
-            .execute()
-        if flags.data:
-            enabled = [f['feature_key'] for f in flags.data]
-            lines.append(f"Features enabled: {', '.join(enabled)}")
-        else:
-            lines.append("Features: None enabled yet")
+        with breakers.supabase_rest.guard():
+            flags = sb.table("org_features") \
+                .select("feature_key, enabled") \
+                .eq("org_id", org_id) \
+                .eq("enabled", True) \
+                .execute()
+        snapshot["features"] = [f['feature_key'] for f in (flags.data or [])]
     except Exception:
         logger.debug("Failed to fetch org_features — skipping")
 
     # Pricing tiers — try both possible table names
     try:
-        tiers = sb.table("pricing_tiers") \
-            .select("name, discount_percentage") \
-            .eq("org_id", org_id) \
-            .execute()
-        if tiers.data:
-            tier_strs = [f"{t['name']} ({t['discount_percentage']}%)" for t in tiers.data]
-            lines.append(f"Pricing tiers: {', '.join(tier_strs)}")
-        else:
-            lines.append("Pricing tiers: Default (Retail/Partner/VIP)")
+        with breakers.supabase_rest.guard():
+            tiers = sb.table("pricing_tiers") \
+                .select("name, discount_percentage") \
+                .eq("org_id", org_id) \
+                .execute()
+        snapshot["pricing_tiers"] = {
+            "tiers": [(t['name'], t['discount_percentage']) for t in (tiers.data or [])],
+            "default": "Default (Retail/Partner/VIP)",
+        }
     except Exception:
         # Table might be named wholesale_pricing_tiers in some schemas
         try:
-            tiers = sb.table("wholesale_pricing_tiers") \
-                .select("name, discount_pct") \
-                .eq("org_id", org_id) \
-                .execute()
-            if tiers.data:
-                tier_strs = [f"{t['name']} ({t['discount_pct']}%)" for t in tiers.data]
-                lines.append(f"Pricing tiers: {', '.join(tier_strs)}")
-            else:
-                lines.append("Pricing tiers: Default")
+            with breakers.supabase_rest.guard():
+                tiers = sb.table("wholesale_pricing_tiers") \
+                    .select("name, discount_pct") \
+                    .eq("org_id", org_id) \
+                    .execute()
+            snapshot["pricing_tiers"] = {
+                "tiers": [(t['name'], t['discount_pct']) for t in (tiers.data or [])],
+                "default": "Default",
+            }
         except Exception:
             logger.debug("Failed to fetch pricing tiers — skipping")
 
     # Commissions
     try:
-        commissions = sb.table("commissions") \
-            .select("id", count="exact") \
-            .eq("org_id", org_id) \
-            .limit(1) \
-            .execute()
-        comm_count = commissions.count if commissions.count else 0
-        lines.append(f"Commission rules: {comm_count} configured")
+        with breakers.supabase_rest.guard():
+            commissions = sb.table("commissions") \
+                .select("id", count="exact") \
+                .eq("org_id", org_id) \
+                .limit(1) \
+                .execute()
+        snapshot["commissions"] = commissions.count if commissions.count else 0
     except Exception:
         logger.debug("Failed to fetch commissions — skipping")
 
+    if breakers.supabase_rest.is_open():
+        # Tripped part-way through — callers are better off with the last full snapshot
+        raise breakers.CircuitOpen(breakers.supabase_rest.name)
+    return snapshot
+
+
+def _format_org_state(snapshot: dict) -> str:
+    """
+    Render an org snapshot as a plain-text summary block to inject into the
+    prompt so the agent knows the merchant's current state regardless of
+    conversation history length.
+    """
+    lines = []
+
+    if "products" in snapshot:
+        products = snapshot["products"]
+        if products:
+            items = [f"  - {p['name']} (${p['retail_price']})" for p in products]
+            lines.append(f"Products ({len(products)} active):\n" + "\n".join(items))
+        else:
+            lines.append("Products: None configured yet")
+
+    if "scraped" in snapshot:
+        if snapshot["scraped"]["pending"]:
+            lines.append(f"Scraped peptides awaiting review: {snapshot['scraped']['pending']}")
+        if snapshot["scraped"]["approved"]:
+            lines.append(f"Scraped peptides approved: {snapshot['scraped']['approved']}")
+
+    if "config" in snapshot:
+        c = snapshot["config"]
+        if c:
+            brand = _branding_parts(c)
+            lines.append(f"Branding: {', '.join(brand) if brand else 'Not configured'}")
+            pay = _payment_parts(c)
+            lines.append(f"Payments: {', '.join(pay) if pay else 'None configured'}")
+            ship = _shipping_parts(c)
+            lines.append(f"Shipping: {', '.join(ship) if ship else 'Not configured'}")
+        else:
+            lines.append("Branding: Not configured")
+            lines.append("Payments: None configured")
+            lines.append("Shipping: Not configured")
+
+    if "contacts" in snapshot:
+        lines.append(f"Contacts: {snapshot['contacts']} imported")
+
+    if "features" in snapshot:
+        if snapshot["features"]:
+            lines.append(f"Features enabled: {', '.join(snapshot['features'])}")
+        else:
+            lines.append("Features: None enabled yet")
+
+    if "pricing_tiers" in snapshot:
+        tiers = snapshot["pricing_tiers"]
+        if tiers["tiers"]:
+            tier_strs = [f"{name} ({pct}%)" for name, pct in tiers["tiers"]]
+            lines.append(f"Pricing tiers: {', '.join(tier_strs)}")
+        else:
+            lines.append(f"Pricing tiers: {tiers['default']}")
+
+    if "commissions" in snapshot:
+        lines.append(f"Commission rules: {snapshot['commissions']} configured")
+
     return "\n".join(lines)
 
 
+def _branding_parts(c: dict) -> list[str]:
+    parts = []
+    if c.get("primary_color"):
+        parts.append(f"color={c['primary_color']}")
+    if c.get("logo_url"):
+        parts.append("logo=set")
+    if c.get("business_name") or c.get("brand_name"):
+        parts.append(f"name={c.get('business_name') or c.get('brand_name')}")
+    if c.get("website_url"):
+        parts.append(f"website={c['website_url']}")
+    return parts
+
+
+def _payment_parts(c: dict) -> list[str]:
+    parts = []
+    if c.get("venmo_handle"):
+        parts.append(f"Venmo ({c['venmo_handle']})")
+    if c.get("zelle_email"):
+        parts.append(f"Zelle ({c['zelle_email']})")
+    if c.get("stripe_connected"):
+        parts.append("Stripe")
+    return parts
+
+
+def _shipping_parts(c: dict) -> list[str]:
+    parts = []
+    if c.get("ship_from_name"):
+        parts.append(f"from={c['ship_from_name']}")
+    if c.get("ship_from_city"):
+        parts.append(f"{c['ship_from_city']}, {c.get('ship_from_state', '')}")
+    return parts
+
+
+def _fetch_org_state(org_id: str) -> str:
+    """Fetch and render the org state block for the prompt."""
+    return _format_org_state(_fetch_org_snapshot(org_id))
+
+
+async def get_org_snapshot(org_id: str) -> dict:
+    """
+    Return the org snapshot, served from cache for STATE_CACHE_TTL seconds.
+    Concurrent callers (e.g. a pre-warm and the first message) share one fetch,
+    which runs in a worker thread so the blocking queries don't stall the loop.
+    While the Supabase breaker is open the last snapshot is served however
+    old it is; CircuitOpen is raised only if there is none.
+    """
+    cached = _snapshot_cache.get(org_id)
+    if cached and time.time() - cached[0] < STATE_CACHE_TTL:
+        return cached[1]
+
+    task = _snapshot_inflight.get(org_id)
+    if task is None:
+        task = asyncio.create_task(asyncio.to_thread(_fetch_org_snapshot, org_id))
+        _snapshot_inflight[org_id] = task
+
+        def _done(t: asyncio.Task) -> None:
+            _snapshot_inflight.pop(org_id, None)
+            if not t.cancelled() and t.exception() is None:
+                _snapshot_cache[org_id] = (time.time(), t.result())
+
+        task.add_done_callback(_done)
+    try:
+        return await asyncio.shield(task)
+    except breakers.CircuitOpen:
+        if cached is None:
+            raise
+        logger.info(f"Supabase circuit open — serving org {org_id} its last known state")
+        metrics.incr("dispatch.stale_snapshots")
+        return cached[1]
+
+
+def expire_snapshot(org_id: str) -> None:
+    """
+    Expire the cached state snapshot so the next turn re-reads it. It is kept
+    as the fallback for when Supabase is unavailable.
+    """
+    cached = _snapshot_cache.get(org_id)
+    if cached:
+        _snapshot_cache[org_id] = (0.0, cached[1])
+
+
+def invalidate_org_snapshot(org_id: str) -> None:
+    """
+    After a write made outside the agent's SQL tool (import, scrape, upload):
+    expire the snapshot and drop the agent's cached SQL reads for the org.
+    """
+    sql_cache.invalidate_org(org_id)
+    expire_snapshot(org_id)
+
+
+IMPORT_MIN_CONFIDENCE = float(os.environ.get("IMPORT_MIN_CONFIDENCE", "0.5"))
+
+
+async def import_scraped_peptides(org_id: str, min_confidence: float = IMPORT_MIN_CONFIDENCE) -> list[dict]:
+    """
+    Import the org's pending scraped peptides into its catalog in one set-based
+    call (import_scraped_peptides RPC): INSERT ... SELECT, de-duplicated against
+    existing peptide names, then mark the scraped rows imported. Returns one row
+    per scraped peptide: scraped_id, peptide_id, name, retail_price, outcome.
+    """
+    sb = get_supabase()
+
+    def _import() -> list[dict]:
+        with breakers.supabase_rest.guard():
+            return sb.rpc("import_scraped_peptides", {
+                "p_org_id": org_id,
+                "p_min_confidence": min_confidence,
+            }).execute().data or []
+
+    rows = await asyncio.to_thread(_import)
+    if rows:
+        invalidate_org_snapshot(org_id)
+    imported = sum(1 for r in rows if r.get("outcome") == "imported")
+    logger.info(f"Imported {imported} scraped peptides for org {org_id} ({len(rows) - imported} duplicates)")
+    return rows
+
+
+def _store_background_scrape(org_id: str, result: dict) -> None:
+    """Hold a finished background scrape for the org's next turn (scrape-brand already persisted it)."""
+    _ready_scrapes[org_id] = _format_scrape_results(result)
+    invalidate_org_snapshot(org_id)
+
+
+def start_background_scrapes() -> None:
+    scrape_worker.start(_scrape_website, _store_background_scrape, get_org_snapshot)
+
+
+async def _prewarm_agent(org_id: str) -> None:
+    """Reserve a pre-spawned CLI process with the arguments the org's next turn will use."""
+    if agent_jobs.ENABLED:
+        return  # runs happen on worker nodes
+    if warm_agents.is_warm(org_id) or not warm_agents.has_capacity() or _agent_semaphore.locked():
+        return
+    if breakers.agent.is_open():
+        return
+    persona = sessions.persona_hash(load_persona())
+    session = await asyncio.to_thread(sessions.load, get_supabase(), org_id)
+    resume = session.session_id if sessions.rotation_reason(session, persona) is None else None
+    if _agent_semaphore.locked() or warm_agents.is_warm(org_id):
+        return
+    # The warm process holds an agent slot like a running one (see warm_agents)
+    await _agent_semaphore.acquire()
+    try:
+        process, mcp_config = await _spawn_claude_cli(org_id, resume)
+    except BaseException:
+        _agent_semaphore.release()
+        raise
+    warm_agents.add(warm_agents.WarmAgent(
+        org_id=org_id,
+        resume_session=resume,
+        persona_hash=persona,
+        process=process,
+        mcp_config=mcp_config,
+        created_at=time.time(),
+        release_slot=_agent_semaphore.release,
+    ))
+
+
+async def _prewarm(org_id: str, access_token: str) -> None:
+    try:
+        snapshot = await get_org_snapshot(org_id)
+        scrape_worker.notice(org_id, snapshot, access_token)
+        await _prewarm_agent(org_id)
+    except Exception:
+        logger.warning(f"Pre-warm failed for org {org_id} — continuing")
+
+
+def schedule_prewarm(org_id: str, access_token: str) -> bool:
+    """
+    Start warming the org's hot path in the background: cache the state
+    snapshot, reserve a warm agent process and queue any pending website
+    scrape. Bounded by MAX_PREWARM_TASKS and PREWARM_TIMEOUT, at most once
+    per PREWARM_INTERVAL per org. Returns True if a pre-warm was started.
+    """
+    now = time.time()
+    if org_id in _prewarm_tasks or now - _last_prewarm.get(org_id, 0) < PREWARM_INTERVAL:
+        return False
+    if len(_prewarm_tasks) >= MAX_PREWARM_TASKS:
+        return False
+    _last_prewarm[org_id] = now
+
+    task = asyncio.create_task(asyncio.wait_for(_prewarm(org_id, access_token), PREWARM_TIMEOUT))
+    _prewarm_tasks[org_id] = task
+    task.add_done_callback(lambda t: _prewarm_tasks.pop(org_id, None))
+    return True
+
+
+def cancel_prewarm(org_id: str) -> None:
+    """Cancel an in-flight pre-warm and release the org's warm agent."""
+    task = _prewarm_tasks.pop(org_id, None)
+    if task:
+        task.cancel()
+    warm_agents.discard(org_id)
+
+
+def cancel_all_prewarm() -> None:
+    for org_id in list(_prewarm_tasks):
+        cancel_prewarm(org_id)
+    warm_agents.discard_all()
+
+
+# Static prompt prefix — byte-identical for every org and every turn, so the
+# provider can cache it (after the persona) and bill repeats at the cached rate.
+# Nothing org- or turn-specific may go in here.
+STATIC_PROMPT_PREFIX = """[SECURITY — PREPEND TO EVERY SQL WRITE]
+Each execute_sql call is a SEPARATE database session. Session variables do NOT persist between calls.
+You MUST prepend this line to EVERY SQL statement that writes data (INSERT, UPDATE, DELETE),
+with <ORG_ID> replaced by the Org ID from the [ONBOARDING SESSION] section below:
+SELECT set_config('app.agent_org_id', '<ORG_ID>', true);
+Combine it in the SAME execute_sql call as the write. Example:
+  SELECT set_config('app.agent_org_id', '<ORG_ID>', true);
+  INSERT INTO peptides (org_id, name, retail_price, active) VALUES ('<ORG_ID>', 'BPC-157', 49.99, true);
+NEVER run set_config as a separate call — the config will be lost before the write happens.
+Only ever use the Org ID given in [ONBOARDING SESSION]; never read or write another org's rows.
+"""
+
+
 def build_context_prompt(
     org_id: str,
     email: str,
@@ -325,14 +670,19 @@ def build_context_prompt(
     message: str,
     history: list[dict],
     scrape_block: str = "",
+    state_block: str | None = None,
 ) -> str:
     """
-    Build a context-enriched prompt for Claude Code.
-    Includes org state snapshot, scraped website data, conversation history,
-    and the user's message.
+    Build a context-enriched prompt for Claude Code, ordered for prompt caching:
+    1. STATIC_PROMPT_PREFIX — identical across orgs and turns
+    2. [ONBOARDING SESSION] — per-org, stable across that org's turns
+    3. Per-turn suffix — org state snapshot, scraped website data,
+       conversation history and the user's message
+    Pass `state_block` to reuse an already-fetched snapshot.
     """
     # Org state snapshot — always current regardless of history length
-    state_block = _fetch_org_state(org_id)
+    if state_block is None:
+        state_block = _fetch_org_state(org_id)
 
     history_block = ""
     if history:
@@ -343,47 +693,87 @@ def build_context_prompt(
             lines.append(f"{role_label}: {msg['content']}")
         history_block = "\n".join(lines)
 
-    prompt = f"""[SECURITY — PREPEND TO EVERY SQL WRITE]
-Each execute_sql call is a SEPARATE database session. Session variables do NOT persist between calls.
-You MUST prepend this line to EVERY SQL statement that writes data (INSERT, UPDATE, DELETE):
-SELECT set_config('app.agent_org_id', '{org_id}', true);
-Combine it in the SAME execute_sql call as the write. Example:
-  SELECT set_config('app.agent_org_id', '{org_id}', true);
-  INSERT INTO peptides (org_id, name, retail_price, active) VALUES ('{org_id}', 'BPC-157', 49.99, true);
-NEVER run set_config as a separate call — the config will be lost before the write happens.
-
-[ONBOARDING SESSION]
+    session_block = f"""[ONBOARDING SESSION]
 Org ID: {org_id}
 User Email: {email}
 User Name: {full_name}
+"""
 
-[CURRENT ORG STATE]
+    turn_block = f"""[CURRENT ORG STATE]
 {state_block if state_block else "No state data available — query the database to check."}
 
 {scrape_block + chr(10) if scrape_block else ""}{f"Recent conversation:{chr(10)}{history_block}{chr(10)}" if history_block else ""}
 Merchant says: {message}"""
 
-    return prompt
+    return f"{STATIC_PROMPT_PREFIX}\n{session_block}\n{turn_block}"
 
 
-async def call_claude_cli(prompt: str) -> tuple[str, str]:
+def build_delta_prompt(
+    org_id: str,
+    message: str,
+    new_messages: list[dict],
+    state_changes: str,
+    scrape_block: str = "",
+) -> str:
     """
-    Call Claude Code CLI in full agentic mode via subprocess.
-    Uses --print for non-interactive output + --allowedTools to unlock
-    MCP tool access (Supabase, Composio) so the agent can actually
-    read/write the database and trigger integrations.
+    Build the prompt for a resumed session. The session already holds the
+    security rules, full state snapshot and earlier conversation, so only
+    what changed since the agent's last turn is sent.
+    """
+    lines = [
+        f"[SECURITY] Org ID is still {org_id} — keep prepending set_config('app.agent_org_id', '{org_id}', true) to every SQL write.",
+        "",
+        "[ORG STATE CHANGES SINCE YOUR LAST TURN]",
+        state_changes if state_changes else "No changes.",
+        "",
+    ]
+    if scrape_block:
+        lines += [scrape_block, ""]
+    if new_messages:
+        lines.append("Messages since your last turn:")
+        for msg in new_messages:
+            role_label = "Merchant" if msg["role"] == "user" else "Assistant"
+            lines.append(f"{role_label}: {msg['content']}")
+        lines.append("")
+    lines.append(f"Merchant says: {message}")
+    return "\n".join(lines)
 
-    Returns (stdout_text, stderr_text) — stderr contains tool usage logs.
+
+def _parse_cli_output(stdout_text: str) -> tuple[str, dict]:
     """
-    system_prompt = ""
-    if os.path.exists(CLAUDE_MD_PATH):
-        with open(CLAUDE_MD_PATH, "r") as f:
-            system_prompt = f.read()
+    Split --output-format json output into (reply, metadata). Depending on
+    --verbose the CLI prints either the result object or a list of events
+    ending in it; anything unparseable is treated as a plain-text reply.
+    """
+    try:
+        data = json.loads(stdout_text)
+    except ValueError:
+        return stdout_text, {}
+    if isinstance(data, list):
+        data = next((e for e in reversed(data) if isinstance(e, dict) and e.get("type") == "result"), {})
+    if not isinstance(data, dict):
+        return stdout_text, {}
+    if data.get("is_error"):
+        raise RuntimeError(f"Claude CLI failed: {data.get('result') or data.get('subtype')}")
+    meta = {k: v for k, v in data.items() if k != "result"}
+    return (data.get("result") or "").strip(), meta
+
+
+async def _spawn_claude_cli(
+    org_id: str,
+    resume_session: str | None,
+) -> tuple[asyncio.subprocess.Process, mcp_pool.RunConfig | None]:
+    """
+    Start a Claude CLI process for `org_id` that waits for its prompt on stdin.
+    Returns (process, per-run MCP config or None); the caller owns both and
+    must release the config when the process is done.
+    """
+    system_prompt = load_persona()
 
     cmd = [
         CLAUDE_CMD,
         "--print",                   # non-interactive, outputs result to stdout
-        "--output-format", "text",   # plain text output (no JSON wrapper)
+        "--output-format", "json",   # result + session_id + usage as JSON
         "--verbose",                 # log tool usage to stderr for debugging
         # Unlock all MCP tools — full agentic mode
         "--allowedTools",
@@ -399,29 +789,104 @@ async def call_claude_cli(prompt: str) -> tuple[str, str]:
     if system_prompt:
         cmd.extend(["--system-prompt", system_prompt])
 
+    if resume_session:
+        cmd.extend(["--resume", resume_session])
+
+    mcp_config = await mcp_pool.write_run_config(org_id)
+    if mcp_config:
+        cmd.extend(["--mcp-config", mcp_config.path, "--strict-mcp-config"])
+
     # Run from /root so Claude finds its project-scoped MCP config
     env = {**os.environ, "HOME": "/root"}
-    process = await asyncio.create_subprocess_exec(
-        *cmd,
-        stdin=asyncio.subprocess.PIPE,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-        cwd="/root",
-        env=env,
-    )
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd="/root",
+            env=env,
+            **run_limits.spawn_kwargs(),
+        )
+    except BaseException:
+        if mcp_config:
+            mcp_config.release()
+        raise
+    return process, mcp_config
+
+
+async def call_claude_cli(
+    prompt: str,
+    org_id: str = "",
+    resume_session: str | None = None,
+    resources: dict | None = None,
+    timeout: float = AGENT_TIMEOUT,
+) -> tuple[str, str, dict]:
+    """
+    Call Claude Code CLI in full agentic mode via subprocess.
+    Uses --print for non-interactive output + --allowedTools to unlock
+    MCP tool access (Supabase, Composio) so the agent can actually
+    read/write the database and trigger integrations.
 
-    stdout, stderr = await asyncio.wait_for(
-        process.communicate(input=prompt.encode("utf-8")),
-        timeout=300.0,  # 5 min — MCP server boot + tool execution
-    )
+    When the shared MCP pool is running, the run connects to it through a
+    generated per-run MCP config instead of booting its own servers.
+    Pass `resume_session` to continue an earlier CLI session. A process
+    pre-warmed for the org with the same arguments is used if available.
 
-    stderr_text = stderr.decode("utf-8", errors="replace").strip()
+    The run's process group is sampled and killed at its resource limits or
+    after `timeout` seconds (AGENT_TIMEOUT unless the caller's request
+    deadline is sooner; see run_limits). If given, `resources` is filled with
+    the run's peak RSS, CPU time and process count, even when the run fails.
+    Raises CircuitOpen without starting a run while the agent breaker is open.
 
-    if process.returncode != 0:
-        logger.error(f"Claude CLI exited with code {process.returncode}: {stderr_text}")
-        raise RuntimeError(f"Claude CLI failed: {stderr_text}")
+    Returns (reply_text, stderr_text, metadata) — stderr contains tool usage
+    logs; metadata is the CLI's JSON result (session_id, usage, ...).
+    """
+    with breakers.agent.guard():
+        warm = warm_agents.claim(org_id, resume_session, sessions.persona_hash(load_persona()))
+        if warm:
+            process, mcp_config = warm.process, warm.mcp_config
+        else:
+            process, mcp_config = await _spawn_claude_cli(org_id, resume_session)
 
-    return stdout.decode("utf-8", errors="replace").strip(), stderr_text
+        monitor = run_limits.RunMonitor(process, org_id)
+        monitor.start()
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(input=prompt.encode("utf-8")),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            # wait_for only cancels the read — the CLI and its children must be killed too
+            monitor.kill("timeout")
+            raise
+        except asyncio.CancelledError:
+            # Cancelled (e.g. a drain ran out of time) — don't leave the run orphaned
+            logger.warning(f"Agent run for org {org_id} cancelled — killing pid {process.pid}")
+            run_limits.kill_group(process)
+            raise
+        finally:
+            run_stats = await monitor.stop()
+            metrics.record_run_resources(run_stats)
+            if resources is not None:
+                resources.update(run_stats)
+            if not (mcp_config and mcp_config.sql_cached):
+                # Its writes bypassed the SQL cache proxy
+                sql_cache.invalidate_org(org_id)
+            if mcp_config:
+                mcp_config.release()
+
+        if monitor.killed:
+            raise run_limits.RunLimitExceeded(monitor.killed)
+
+        stderr_text = stderr.decode("utf-8", errors="replace").strip()
+
+        if process.returncode != 0:
+            logger.error(f"Claude CLI exited with code {process.returncode}: {stderr_text}")
+            raise RuntimeError(f"Claude CLI failed: {stderr_text}")
+
+        reply, meta = _parse_cli_output(stdout.decode("utf-8", errors="replace").strip())
+        return reply, stderr_text, meta
 
 
 async def dispatch_message(
@@ -432,100 +897,505 @@ async def dispatch_message(
     message: str,
     attachments: list[dict] | None = None,
     access_token: str = "",
+    deadline: Deadline | None = None,
 ) -> dict:
     """
+    Every step after storing the message runs within `deadline` (a fresh
+    REQUEST_DEADLINE if not given): each gets what is left of the budget and
+    is skipped or degraded once it runs short (see _agent_turn).
+
     1. Check rate limit
     2. Store user message in onboarding_messages
-    3. Detect URLs → scrape website if found
-    4. Build context-enriched prompt (with scrape results + file contents)
-    5. Call Claude Code CLI
-    6. Store assistant reply in onboarding_messages
-    7. Write audit log
-    8. Return reply
+    2b. Answer simple read-only status questions on the fast path
+    3. Queue for the org's next agent turn (one run per org at a time;
+       messages sent during a run are answered together by the next one),
+       which then:
+       - detects URLs → scrapes the website if found
+       - ingests uploaded files (bulk-load contacts / products)
+       - builds the context-enriched prompt (scrape results + file summary)
+       - calls Claude Code CLI
+       - stores the assistant reply and writes the audit log
+    4. Return the reply (shared by every message the turn covered), or a
+       "still working" reply if the deadline passes first
     """
     sb = get_supabase()
+    deadline = deadline or Deadline()
 
     # 1. Rate limit check
     if not check_rate_limit(org_id):
         _log_audit(sb, org_id, user_id, message, None, None, 0, "rate_limited")
         raise RateLimitExceeded(f"Rate limit exceeded for org {org_id}")
+    turn = capture.Turn(org_id, user_id, email, full_name, message, attachments)
 
     # 2. Store user message
     user_msg_id = str(uuid.uuid4())
-    sb.table("onboarding_messages").insert({
-        "id": user_msg_id,
-        "org_id": org_id,
-        "user_id": user_id,
-        "role": "user",
-        "content": message,
-    }).execute()
+    with breakers.supabase_rest.guard():
+        inserted = sb.table("onboarding_messages").insert({
+            "id": user_msg_id,
+            "org_id": org_id,
+            "user_id": user_id,
+            "role": "user",
+            "content": message,
+        }).execute()
+    _record_message_write(org_id, inserted)
+    feed.publish_status(org_id, "queued", message_id=user_msg_id)
+    turn.stage("store_message")
 
-    # 3. Detect URLs and scrape if found
-    scrape_block = ""
     urls = _extract_urls(message)
-    if urls and access_token:
+
+    # 2b. Fast path — answer status questions straight from the state snapshot
+    handler = fastpath.classify(message) if not (urls or attachments) else None
+    if handler:
+        start_time = time.time()
+        try:
+            snapshot = await deadline.run("state", get_org_snapshot(org_id), cap=STATE_FETCH_TIMEOUT)
+        except (DeadlineExceeded, asyncio.TimeoutError, breakers.CircuitOpen):
+            logger.warning(f"State for org {org_id} unavailable — skipping the fast path")
+            snapshot = None
+        if snapshot is not None:
+            scrape_worker.notice(org_id, snapshot, access_token)
+            turn.add("snapshot", snapshot)
+        reply = handler.answer(snapshot) if snapshot is not None else None
+        turn.stage("fast_path")
+        if reply:
+            fastpath.record(handler.name)
+            duration_ms = int((time.time() - start_time) * 1000)
+            logger.info(f"Fast path '{handler.name}' answered in {duration_ms}ms")
+            result = _finish_turn(
+                sb, org_id, user_id, user_msg_id, message,
+                reply, f"fast_path:{handler.name}", duration_ms, "fast_path",
+            )
+            turn.stage("finish")
+            turn.finish("fast_path")
+            return result
+    fastpath.record(None)
+
+    # 3. Queue for the org's turn runner
+    pending = _PendingMessage(
+        message_id=user_msg_id,
+        user_id=user_id,
+        email=email,
+        full_name=full_name,
+        message=message,
+        attachments=attachments,
+        access_token=access_token,
+        turn=turn,
+        deadline=deadline,
+        future=asyncio.get_running_loop().create_future(),
+    )
+    _org_pending[org_id].append(pending)
+    if org_id not in _org_runners:
+        _org_runners[org_id] = asyncio.create_task(_run_org_turns(org_id))
+    else:
+        logger.info(f"Org {org_id} has a run in progress — message {user_msg_id} joins its next turn")
+    # Shielded: a client disconnect must not cancel a turn other messages share.
+    # The turn runs within the latest deadline in its batch, so an earlier
+    # message's request can run out first — it then gets a holding reply and
+    # the answer arrives over the message feed.
+    try:
+        return await asyncio.wait_for(asyncio.shield(pending.future), deadline.remaining())
+    except asyncio.TimeoutError:
+        logger.info(f"Deadline passed for message {user_msg_id} while its turn was still running")
+        return {
+            "reply": "I'm still working on that — my answer will appear here shortly.",
+            "message_id": None,
+            "created_at": None,
+        }
+
+
+@dataclass
+class _PendingMessage:
+    """A stored user message waiting for its org's next agent turn."""
+    message_id: str
+    user_id: str
+    email: str
+    full_name: str
+    message: str
+    attachments: list[dict] | None
+    access_token: str
+    turn: capture.Turn
+    deadline: Deadline
+    future: asyncio.Future
+
+
+async def _run_org_turns(org_id: str) -> None:
+    """Run the org's agent turns one at a time, each covering every message queued since the last."""
+    try:
+        while _org_pending.get(org_id):
+            batch = _org_pending.pop(org_id)
+            try:
+                result = await _agent_turn(org_id, batch)
+            except asyncio.CancelledError:
+                _interrupt(batch)
+                raise
+            except Exception as e:
+                logger.exception(f"Agent turn failed for org {org_id}")
+                for p in batch:
+                    if not p.future.done():
+                        p.future.set_exception(e)
+                continue
+            for p in batch:
+                if not p.future.done():
+                    p.future.set_result({**result, "coalesced": len(batch)})
+    finally:
+        _org_runners.pop(org_id, None)
+
+
+INTERRUPTED_REPLY = "I was interrupted by a restart before I could finish — please send that again."
+
+
+def _interrupt(batch: list[_PendingMessage]) -> None:
+    for p in batch:
+        if not p.future.done():
+            p.future.set_result({"reply": INTERRUPTED_REPLY, "message_id": None, "created_at": None})
+        p.turn.finish("interrupted")
+
+
+async def drain_turns(timeout: float) -> int:
+    """
+    Wait up to `timeout` seconds for running agent turns, and the turns
+    queued behind them, to finish. Turns still running after that are
+    cancelled, which kills their CLI runs; their messages get
+    INTERRUPTED_REPLY. Returns the number of orgs whose turns were cancelled.
+    """
+    cancel_all_prewarm()
+    loop = asyncio.get_running_loop()
+    end = loop.time() + timeout
+    while _org_runners and (left := end - loop.time()) > 0:
+        logger.info(f"Drain: waiting on agent turns for {len(_org_runners)} org(s)")
+        await asyncio.wait(list(_org_runners.values()), timeout=left)
+
+    runners = list(_org_runners.values())
+    for task in runners:
+        task.cancel()
+    await asyncio.gather(*runners, return_exceptions=True)
+    for org_id in list(_org_pending):
+        _interrupt(_org_pending.pop(org_id))
+    if runners:
+        logger.warning(f"Drain: cancelled agent turns for {len(runners)} org(s) after {timeout:.0f}s")
+    return len(runners)
+
+
+def _coalesce(batch: list[_PendingMessage]) -> str:
+    """The merchant message(s) a turn answers, as one prompt message."""
+    if len(batch) == 1:
+        return batch[0].message
+    lines = [f"(The merchant sent {len(batch)} messages while you were working — answer them together.)"]
+    lines += [f"{i}. {p.message}" for i, p in enumerate(batch, 1)]
+    return "\n".join(lines)
+
+
+async def _agent_turn(org_id: str, batch: list[_PendingMessage]) -> dict:
+    """
+    Scrape, ingest, build the prompt and run the agent for one batch of an
+    org's messages, within the batch's latest request deadline. Scraping and
+    ingest only start with SCRAPE_MIN_BUDGET to spare beyond PREP_RESERVE
+    (a skipped scrape goes to the background worker instead), the state
+    block degrades to a placeholder, and the agent run is skipped when less
+    than AGENT_MIN_BUDGET would be left.
+    """
+    sb = get_supabase()
+    latest = batch[-1]
+    deadline = max((p.deadline for p in batch), key=lambda d: d.at)
+    user_id, email, full_name, access_token = latest.user_id, latest.email, latest.full_name, latest.access_token
+    user_msg_id = latest.message_id
+    batch_ids = [p.message_id for p in batch]
+    ids_field = {"message_ids": batch_ids} if len(batch) > 1 else {}
+    message = _coalesce(batch)
+    attachments = [a for p in batch for a in (p.attachments or [])] or None
+    urls = _extract_urls(message)
+
+    # The first message's capture record carries the turn. Every record keeps
+    # its own message, so replay resubmits them one by one at their offsets.
+    turn = batch[0].turn
+    turn.stage("org_queue")
+    turn.add("message_ids", batch_ids)
+    if len(batch) > 1:
+        logger.info(f"Coalesced {len(batch)} messages into one turn for org {org_id}")
+        metrics.incr("dispatch.coalesced_messages", len(batch) - 1)
+        for p in batch[1:]:
+            p.turn.stage("org_queue")
+            p.turn.add("coalesced_into", turn.data.get("id"))
+            p.turn.finish("coalesced")
+
+    # Detect URLs and scrape if found (or use a finished background scrape)
+    scrape_block = "" if urls else _ready_scrapes.pop(org_id, "")
+    if urls and access_token and breakers.edge_functions.is_open():
+        scrape_block = (
+            f"[WEBSITE SCRAPE UNAVAILABLE]\nThe scraping service is down right now, so {urls[0]} wasn't scraped. "
+            "Carry on with setup and offer to try the site again in a few minutes."
+        )
+    elif urls and access_token and not deadline.allows(SCRAPE_MIN_BUDGET, reserve=PREP_RESERVE):
+        logger.info(f"No time left to scrape {urls[0]} in this turn — handing it to the background worker")
+        scrape_worker.enqueue(org_id, urls[0], access_token)
+    elif urls and access_token:
+        feed.publish_status(org_id, "scraping", message_id=user_msg_id, url=urls[0], **ids_field)
         # Scrape the first URL found (usually the merchant's website)
-        scrape_result = await _scrape_website(urls[0], access_token)
+        try:
+            scrape_result = await deadline.run(
+                "scrape", _scrape_website(urls[0], access_token), cap=SCRAPE_TIMEOUT, reserve=PREP_RESERVE,
+            )
+        except DeadlineExceeded:
+            logger.warning(f"Scrape of {urls[0]} cut off by the request deadline")
+            scrape_result = None
+        turn.add("scrape", {"url": urls[0], "result": scrape_result, "ms": turn.stage("scrape")})
         if scrape_result:
             scrape_block = _format_scrape_results(scrape_result)
+            invalidate_org_snapshot(org_id)
             logger.info(f"Injected scrape results for {urls[0]}")
 
-    # 4. Get recent history for context
-    history_result = sb.table("onboarding_messages") \
-        .select("role, content") \
-        .eq("org_id", org_id) \
-        .order("created_at", desc=False) \
-        .limit(20) \
-        .execute()
-
-    history = history_result.data or []
+    # Download, parse and bulk-load uploaded files server-side
+    files_block = ""
+    if attachments and not deadline.allows(SCRAPE_MIN_BUDGET, reserve=PREP_RESERVE):
+        files_block = (
+            "\n\n[ATTACHMENTS NOT IMPORTED]\nThere wasn't time to import the attached files in this turn. "
+            "Ask the merchant to send them again."
+        )
+    elif attachments:
+        feed.publish_status(org_id, "importing", message_id=user_msg_id, files=len(attachments), **ids_field)
+        try:
+            ingest_results = await deadline.run(
+                "ingest", uploads.ingest_attachments(sb, org_id, attachments), reserve=PREP_RESERVE,
+            )
+        except DeadlineExceeded:
+            logger.warning(f"Attachment ingest for org {org_id} cut off by the request deadline")
+            invalidate_org_snapshot(org_id)
+            ingest_results = None
+            files_block = (
+                "\n\n[ATTACHMENTS PARTLY IMPORTED]\nThe file import ran out of time part-way through. "
+                "Check what landed before telling the merchant; re-sending the files skips rows already imported."
+            )
+        if ingest_results is not None:
+            turn.add("ingest", {"results": ingest_results, "ms": turn.stage("ingest")})
+            files_block = "\n\n" + uploads.format_ingest_summary(ingest_results)
+            if any(r.get("inserted") for r in ingest_results):
+                invalidate_org_snapshot(org_id)
 
-    # 5. Build prompt and call Claude CLI
-    prompt = build_context_prompt(
-        org_id, email, full_name, message, history[:-1],
+    # Recent history for context (newest 20, oldest first), minus the messages this turn answers
+    try:
+        with breakers.supabase_rest.guard():
+            history_result = sb.table("onboarding_messages") \
+                .select("id, role, content, created_at") \
+                .eq("org_id", org_id) \
+                .order("created_at", desc=True) \
+                .limit(20) \
+                .execute()
+        history = list(reversed(history_result.data or []))
+    except breakers.CircuitOpen:
+        logger.warning(f"Supabase circuit open — running org {org_id}'s turn without history")
+        history = []
+    turn.add("history", history)
+    prior = [m for m in history if m.get("id") not in batch_ids]
+    turn.stage("history")
+
+    # Build prompt — a delta if the org's agent session can be resumed
+    try:
+        snapshot = await deadline.run(
+            "state", get_org_snapshot(org_id), cap=STATE_FETCH_TIMEOUT, reserve=AGENT_RESERVE,
+        )
+    except (DeadlineExceeded, asyncio.TimeoutError, breakers.CircuitOpen):
+        logger.warning(f"State for org {org_id} unavailable — sending the turn without it")
+        snapshot = None
+    if snapshot is not None:
+        scrape_worker.notice(org_id, snapshot, access_token)
+        turn.add("snapshot", snapshot)
+        state_block = _format_org_state(snapshot)
+    else:
+        state_block = STATE_UNAVAILABLE_BLOCK
+    turn.stage("state")
+    if not scrape_block and scrape_worker.status(org_id):
+        scrape_block = (
+            "[WEBSITE SCRAPE IN PROGRESS]\nThe merchant's website is being scraped in the background. "
+            "Results will land in scraped_peptides (status pending) shortly — don't scrape it again."
+        )
+    persona = sessions.persona_hash(load_persona())
+    session = await asyncio.to_thread(sessions.load, sb, org_id)
+    rotation = sessions.rotation_reason(session, persona)
+    if rotation and session is not None:
+        logger.info(f"Rotating agent session for org {org_id}: {rotation}")
+
+    full_prompt = build_context_prompt(
+        org_id, email, full_name, message, prior,
         scrape_block=scrape_block,
+        state_block=state_block,
     )
-
-    # Append file attachment info to prompt if present
-    if attachments:
-        file_lines = []
-        for att in attachments:
-            file_lines.append(f"  - {att['name']} ({att['type']}): {att['url']}")
-        prompt += f"\n\n[UPLOADED FILES]\nThe merchant uploaded these files. Download and process them:\n" + "\n".join(file_lines)
+    if rotation is None:
+        new_messages = [m for m in prior if (m.get("created_at") or "") > session.last_message_at]
+        prompt = build_delta_prompt(
+            org_id, message, new_messages,
+            sessions.state_diff(session.state_block, state_block) if snapshot is not None else state_block,
+            scrape_block=scrape_block,
+        )
+    else:
+        prompt = full_prompt
+
+    # Append the attachment ingest summary to the prompt if present
+    if files_block:
+        prompt += files_block
+        full_prompt += files_block
+    turn.stage("prompt")
+    turn.add("prompt", {
+        "rotation": rotation,
+        "scrape_block": scrape_block,
+        "files_block": files_block,
+        "state_block": state_block,
+        "text": prompt,
+    })
 
     start_time = time.time()
     status = "success"
     tool_log = ""
     reply = ""
+    meta: dict = {}
+    resources: dict = {}
 
     try:
-        async with _agent_semaphore:
-            reply, tool_log = await call_claude_cli(prompt)
+        # Wait for a slot only while a useful run would still fit. With the job
+        # queue on, the slots are the workers' and the queue does the waiting.
+        # A warm process reserved for the org hands its slot to the turn, and
+        # an idle one reserved for another org gives its slot up.
+        slot = None if agent_jobs.ENABLED else _agent_semaphore
+        if slot and not warm_agents.take_slot(org_id):
+            if slot.locked():
+                warm_agents.evict_oldest(org_id)
+            await deadline.run("agent_queue", slot.acquire(), reserve=AGENT_RESERVE)
+        try:
+            feed.publish_status(org_id, "running", message_id=user_msg_id, **ids_field)
+            turn.stage("agent_queue")
+            try:
+                reply, tool_log, meta = await _run_agent(
+                    prompt, org_id, session.session_id if rotation is None else None, resources, deadline,
+                )
+            except RuntimeError:
+                if rotation is not None or not deadline.allows(AGENT_MIN_BUDGET, reserve=FINISH_RESERVE):
+                    raise
+                # Resumed session is gone or broken — start over with full context
+                logger.warning(f"Resuming session failed for org {org_id} — starting fresh")
+                await asyncio.to_thread(sessions.clear, sb, org_id)
+                rotation, prompt = "resume_failed", full_prompt
+                resources.clear()
+                reply, tool_log, meta = await _run_agent(prompt, org_id, None, resources, deadline)
+        finally:
+            if slot:
+                slot.release()
+    except DeadlineExceeded as e:
+        logger.warning(f"Skipping the agent run for org {org_id}: request deadline reached during {e.stage}")
+        reply = "I ran out of time before I could work on that. Please send it again."
+        status = "deadline"
+    except breakers.CircuitOpen:
+        logger.warning(f"Agent circuit open — not running org {org_id}'s turn")
+        reply = "I'm having trouble reaching my AI backend right now. Please try again in a minute."
+        status = "unavailable"
     except asyncio.TimeoutError:
-        logger.error("Claude CLI timeout (300s)")
+        logger.error(f"Claude CLI timeout for org {org_id} ({time.time() - start_time:.0f}s)")
         reply = "I'm still thinking about that — it's taking longer than expected. Please try again in a moment."
         status = "timeout"
+    except run_limits.RunLimitExceeded as e:
+        logger.error(f"Claude CLI run for org {org_id} killed at its {e.reason} limit: {resources}")
+        reply = "That request needed more resources than I'm allowed to use. Could you break it into smaller steps?"
+        status = "killed"
     except Exception as e:
         logger.exception("Claude CLI dispatch failed")
         reply = "I encountered an error connecting to the AI backend. Please try again shortly."
         status = "error"
 
     duration_ms = int((time.time() - start_time) * 1000)
+    turn.add("agent", {
+        "reply": reply, "tool_log": tool_log, "meta": meta, "resources": resources,
+        "status": status, "ms": turn.stage("agent"),
+    })
+    # The agent may have written to any of the org's tables. Only the state
+    # block is refreshed: the SQL cache is invalidated on those writes by its
+    # proxy (or by call_claude_cli for runs that bypassed it), and its reads
+    # should carry over to the session's next turn.
+    expire_snapshot(org_id)
+
+    usage = meta.get("usage")
+    metrics.record_prompt_usage(usage)
+    if status == "success":
+        metrics.record_discovery_calls(tool_log)
+    if usage:
+        logger.info(
+            f"Prompt usage: input={usage.get('input_tokens', 0)} "
+            f"cache_read={usage.get('cache_read_input_tokens', 0)} "
+            f"cache_write={usage.get('cache_creation_input_tokens', 0)}"
+        )
+
+    result = _finish_turn(
+        sb, org_id, user_id, user_msg_id, message,
+        reply, tool_log, duration_ms, status, usage=usage, resources=resources,
+        message_ids=batch_ids if len(batch) > 1 else None,
+    )
+
+    if status == "success" and meta.get("session_id"):
+        resumed = rotation is None
+        await asyncio.to_thread(sessions.save, sb, sessions.AgentSession(
+            org_id=org_id,
+            session_id=meta["session_id"],
+            persona_hash=persona,
+            turns=(session.turns if resumed else 0) + 1,
+            prompt_chars=(session.prompt_chars if resumed else 0) + len(prompt) + len(reply),
+            # Without a snapshot the session keeps the last state it was sent
+            state_block=state_block if snapshot is not None else (session.state_block if resumed else ""),
+            last_message_at=result.get("created_at") or "",
+            started_at=session.started_at if resumed else time.time(),
+        ))
+
+    turn.stage("finish")
+    turn.finish(status)
+    return result
+
 
+async def _run_agent(
+    prompt: str, org_id: str, resume_session: str | None, resources: dict, deadline: Deadline,
+) -> tuple[str, str, dict]:
+    """Run the agent within the deadline — here, or on a worker node when the job queue is on."""
+    timeout = deadline.budget(AGENT_TIMEOUT, reserve=FINISH_RESERVE)
+    if not agent_jobs.ENABLED:
+        return await call_claude_cli(
+            prompt, org_id=org_id, resume_session=resume_session, resources=resources, timeout=timeout,
+        )
+    now = time.time()
+    return await agent_jobs.run(
+        prompt, org_id, resume_session, resources,
+        run_by=now + deadline.remaining() - AGENT_RESERVE,
+        finish_by=now + timeout,
+    )
+
+
+def _finish_turn(
+    sb: Client,
+    org_id: str,
+    user_id: str,
+    user_msg_id: str,
+    message: str,
+    reply: str,
+    tool_log: str,
+    duration_ms: int,
+    status: str,
+    usage: dict | None = None,
+    resources: dict | None = None,
+    message_ids: list[str] | None = None,
+) -> dict:
+    """Store the assistant reply, publish the turn's final status and write the audit log."""
     # 6. Store assistant reply
     assistant_msg_id = str(uuid.uuid4())
-    sb.table("onboarding_messages").insert({
+    inserted = sb.table("onboarding_messages").insert({
         "id": assistant_msg_id,
         "org_id": org_id,
         "user_id": user_id,
         "role": "assistant",
         "content": reply,
     }).execute()
+    _record_message_write(org_id, inserted)
+    ids_field = {"message_ids": message_ids} if message_ids else {}
+    feed.publish_status(org_id, status, message_id=user_msg_id, reply_id=assistant_msg_id, **ids_field)
 
     # 7. Write audit log
-    _log_audit(sb, org_id, user_id, message, reply, tool_log, duration_ms, status)
+    _log_audit(sb, org_id, user_id, message, reply, tool_log, duration_ms, status, usage=usage, resources=resources)
 
-    return {"reply": reply, "message_id": assistant_msg_id}
+    created_at = inserted.data[0].get("created_at") if inserted.data else None
+    return {"reply": reply, "message_id": assistant_msg_id, "created_at": created_at}
 
 
 class RateLimitExceeded(Exception):
@@ -542,10 +1412,12 @@ def _log_audit(
     tool_log: str | None,
     duration_ms: int,
     status: str,
+    usage: dict | None = None,
+    resources: dict | None = None,
 ) -> None:
     """Insert a row into agent_audit_log. Fails silently — audit should never break the main flow."""
     try:
-        sb.table("agent_audit_log").insert({
+        row = {
             "org_id": org_id,
             "user_id": user_id,
             "message_preview": message[:200],
@@ -553,19 +1425,148 @@ def _log_audit(
             "tool_log": (tool_log or "")[:5000],
             "duration_ms": duration_ms,
             "status": status,
-        }).execute()
+        }
+        if usage:
+            row["usage"] = usage
+        if resources:
+            row["resources"] = resources
+        sb.table("agent_audit_log").insert(row).execute()
     except Exception:
         logger.warning("Failed to write audit log — continuing")
 
 
-async def get_conversation_history(org_id: str, user_id: str) -> list[dict]:
-    """Fetch conversation history for a user's org."""
+class InvalidCursor(ValueError):
+    """Raised when a history pagination cursor cannot be decoded."""
+    pass
+
+
+def encode_cursor(row: dict) -> str:
+    """Encode a message's (created_at, id) keyset position as an opaque cursor."""
+    raw = f"{row['created_at']}|{row['id']}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    """Decode a cursor back into (created_at, id). Raises InvalidCursor."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, msg_id = base64.urlsafe_b64decode(padded).decode("utf-8").split("|", 1)
+        uuid.UUID(msg_id)
+    except Exception:
+        raise InvalidCursor("Invalid history cursor")
+    if not created_at:
+        raise InvalidCursor("Invalid history cursor")
+    return created_at, msg_id
+
+
+def _record_message_write(org_id: str, result) -> None:
+    """
+    Handle the row returned by an onboarding_messages insert: make it the org's
+    latest-message marker and push it to the org's feed subscribers.
+    """
+    rows = getattr(result, "data", None) or []
+    if rows and rows[0].get("created_at"):
+        row = rows[0]
+        _history_markers[org_id] = (time.time(), {"id": row["id"], "created_at": row["created_at"]})
+        feed.publish_message(org_id, row, encode_cursor(row))
+    else:
+        _history_markers.pop(org_id, None)
+
+
+async def get_history_marker(org_id: str) -> dict | None:
+    """
+    Return {"id", "created_at"} of the org's newest message, or None if empty.
+    Served from memory while fresh so unchanged polls cost no DB query.
+    """
+    cached = _history_markers.get(org_id)
+    if cached and time.time() - cached[0] < HISTORY_MARKER_TTL:
+        return cached[1]
+
     sb = get_supabase()
     result = sb.table("onboarding_messages") \
-        .select("id, role, content, created_at") \
+        .select("id, created_at") \
         .eq("org_id", org_id) \
-        .order("created_at", desc=False) \
-        .limit(50) \
+        .order("created_at", desc=True) \
+        .order("id", desc=True) \
+        .limit(1) \
+        .execute()
+
+    marker = result.data[0] if result.data else None
+    _history_markers[org_id] = (time.time(), marker)
+    return marker
+
+
+def history_etag(marker: dict | None, **params) -> str:
+    """Build an ETag from the org's latest message plus the requested window."""
+    basis = json.dumps(
+        {"latest": marker and [marker["id"], marker["created_at"]], **params},
+        sort_keys=True,
+    )
+    return '"' + hashlib.sha1(basis.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+async def get_conversation_history(
+    org_id: str,
+    user_id: str,
+    before: str | None = None,
+    after: str | None = None,
+    limit: int = HISTORY_DEFAULT_LIMIT,
+    order: str = "asc",
+) -> dict:
+    """
+    Fetch one keyset-paginated window of conversation history for a user's org.
+
+    - No cursor: the oldest `limit` messages, or the newest when order="desc".
+    - after=<cursor>: messages strictly newer than the cursor (polling).
+    - before=<cursor>: messages strictly older than the cursor (scrollback).
+
+    Messages are returned in `order`. `has_more` says whether more rows exist
+    past this window in the scan direction; `cursors` hold the oldest/newest
+    positions of the window for the next request.
+    """
+    if before and after:
+        raise InvalidCursor("Pass either 'before' or 'after', not both")
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+
+    if after:
+        descending = False
+    elif before:
+        descending = True
+    else:
+        descending = order == "desc"
+
+    sb = get_supabase()
+    query = sb.table("onboarding_messages") \
+        .select("id, role, content, created_at") \
+        .eq("org_id", org_id)
+
+    cursor = before or after
+    if cursor:
+        created_at, msg_id = decode_cursor(cursor)
+        op = "lt" if before else "gt"
+        query = query.or_(
+            f'created_at.{op}."{created_at}",'
+            f'and(created_at.eq."{created_at}",id.{op}.{msg_id})'
+        )
+
+    result = query \
+        .order("created_at", desc=descending) \
+        .order("id", desc=descending) \
+        .limit(limit + 1) \
         .execute()
 
-    return result.data or []
+    rows = result.data or []
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    chronological = list(reversed(rows)) if descending else rows
+    messages = list(reversed(chronological)) if order == "desc" else chronological
+
+    return {
+        "messages": messages,
+        "has_more": has_more,
+        "cursors": {
+            "oldest": encode_cursor(chronological[0]) if chronological else None,
+            "newest": encode_cursor(chronological[-1]) if chronological else None,
+        },
+    }
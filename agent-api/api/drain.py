@@ -0,0 +1,92 @@
+"""
+Graceful drain before the process exits.
+
+Without it, SIGTERM (docker stop, a redeploy) lets uvicorn stop at once. Any
+agent run whose request had already returned a "still working" reply is
+killed mid-turn, and its CLI process is left orphaned. Open feed streams
+also keep uvicorn waiting until docker gives up and SIGKILLs the container.
+
+On the first SIGTERM, drain mode starts:
+1. New work (chats, imports, feed connections) is refused with 503 and
+   Retry-After. nginx already sends new requests to the peer started by
+   deploy.sh.
+2. Open feed streams are ended so their clients reconnect elsewhere.
+3. Running agent turns, and those queued behind them, get up to
+   DRAIN_TIMEOUT seconds to finish. Anything still running after that is
+   cancelled and its CLI process group killed.
+4. Buffered writes (capture records) are flushed.
+Only then does SIGTERM reach uvicorn, which shuts down as usual.
+
+A second SIGTERM skips the wait. Set the container's stop grace period above
+DRAIN_TIMEOUT plus uvicorn's own graceful-shutdown timeout.
+"""
+import os
+import time
+import signal
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+logger = logging.getLogger("onboarding-agent.drain")
+
+DRAIN_TIMEOUT = float(os.environ.get("DRAIN_TIMEOUT", "110"))
+DRAIN_RETRY_AFTER = int(os.environ.get("DRAIN_RETRY_AFTER", "5"))
+
+_draining_since: float | None = None
+_task: asyncio.Task | None = None
+
+
+def is_draining() -> bool:
+    return _draining_since is not None
+
+
+def status() -> dict:
+    return {
+        "draining": is_draining(),
+        "draining_for_seconds": round(time.monotonic() - _draining_since, 1) if _draining_since else 0.0,
+        "timeout_seconds": DRAIN_TIMEOUT,
+    }
+
+
+def install(drain: Callable[[float], Awaitable[None]]) -> None:
+    """
+    Run `drain(DRAIN_TIMEOUT)` on SIGTERM before handing the signal to the
+    server's own handler (call from the app lifespan, after the server has
+    installed its handlers).
+    """
+    loop = asyncio.get_running_loop()
+    server_handler = signal.getsignal(signal.SIGTERM)
+
+    def hand_over() -> None:
+        loop.remove_signal_handler(signal.SIGTERM)
+        signal.signal(signal.SIGTERM, server_handler)
+        if callable(server_handler):
+            server_handler(signal.SIGTERM, None)
+        else:
+            signal.raise_signal(signal.SIGTERM)
+
+    async def run() -> None:
+        started = time.monotonic()
+        try:
+            await drain(DRAIN_TIMEOUT)
+        except asyncio.CancelledError:
+            logger.warning("Drain cut short — shutting down now")
+        except Exception:
+            logger.exception("Drain failed — shutting down anyway")
+        else:
+            logger.info(f"Drained in {time.monotonic() - started:.1f}s — shutting down")
+        hand_over()
+
+    def on_sigterm() -> None:
+        global _draining_since, _task
+        if _task is not None:
+            _task.cancel()
+            return
+        _draining_since = time.monotonic()
+        logger.info(f"SIGTERM — draining (up to {DRAIN_TIMEOUT:.0f}s for running agent turns)")
+        _task = loop.create_task(run())
+
+    try:
+        loop.add_signal_handler(signal.SIGTERM, on_sigterm)
+    except (NotImplementedError, RuntimeError, ValueError):
+        logger.warning("Cannot handle SIGTERM here — shutdown will not drain")
@@ -0,0 +1,305 @@
+"""
+Deterministic fast path for simple, read-only merchant status questions.
+
+Questions like "what products do I have?" or "is shipping set up?" are
+answered straight from the org state snapshot instead of spawning an agent
+run. A handler is chosen only when the message is a single short question
+with no write intent and no request for advice, and exactly one handler's
+pattern matches the whole question — a question with any extra qualifier
+("how many products are out of stock?") goes to the agent. Handlers may also decline
+(return None) when the snapshot is missing the data they need.
+
+bench/fastpath_cases.py lists messages that must (and must not) take the fast
+path; run it after changing the patterns here.
+"""
+import re
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable
+
+logger = logging.getLogger("onboarding-agent.fastpath")
+
+MAX_FAST_PATH_WORDS = 15
+# tenant_config.primary_color column default — set on every org, so not a sign of branding work
+DEFAULT_PRIMARY_COLOR = "#7c3aed"
+
+_QUESTION_START = re.compile(
+    r"^(what|whats|which|how many|how much|is|are|do|does|did|have|has|show|list|where)\b"
+)
+_HELP_OR_REQUEST = re.compile(
+    r"^(how (do|can|should|would)|can you|could you|would you|will you|do you|are you|please|why|should)\b"
+)
+# Asking for an opinion or what is allowed needs the agent, not a status readout
+_ADVICE = re.compile(r"\b(should|shall|ought|think|recommend|suggest|advise|can i|can we|could i|may i)\b")
+# "is shipping set up", "what do I have set up" ask about state, not for a change
+_SET_UP_STATUS = re.compile(r"\b(is|are|was|were|been|have|has|had|got)((?: (?!to\b)\w+){0,3}) set ?up\b")
+# Another sentence after the question ("is stripe connected? if not connect it")
+_MULTI_SENTENCE = re.compile(r"[.?!;]\s+\S")
+_WRITE_INTENT = re.compile(
+    r"\b(add|remove|delete|change|update|set|import|upload|create|make|edit|rename|"
+    r"enable|disable|turn on|turn off|switch|connect|fix)\b"
+)
+
+
+@dataclass
+class FastPathHandler:
+    name: str
+    patterns: list[re.Pattern]
+    answer: Callable[[dict], str | None]
+
+    def matches(self, text: str) -> bool:
+        return any(p.fullmatch(text) for p in self.patterns)
+
+
+_handlers: list[FastPathHandler] = []
+_stats: Counter = Counter()
+
+
+def fast_path(name: str, *patterns: str):
+    """Register a handler for questions matching any of `patterns` in full (normalized, without the "?")."""
+    def decorator(fn: Callable[[dict], str | None]):
+        _handlers.append(FastPathHandler(name, [re.compile(p) for p in patterns], fn))
+        return fn
+    return decorator
+
+
+def _normalize(message: str) -> str:
+    text = message.lower().replace("’", "'").replace("what's", "whats")
+    text = re.sub(r"[^\w\s'?-]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def classify(message: str) -> FastPathHandler | None:
+    """Return the single handler confidently matching `message`, or None."""
+    text = _normalize(message)
+    if not text or len(text.split()) > MAX_FAST_PATH_WORDS:
+        return None
+    if _MULTI_SENTENCE.search(message.strip()):
+        return None
+    if _HELP_OR_REQUEST.search(text) or _ADVICE.search(text):
+        return None
+    if _WRITE_INTENT.search(_SET_UP_STATUS.sub(r"\1\2", text)):
+        return None
+    if not (text.endswith("?") or _QUESTION_START.search(text)):
+        return None
+
+    question = text.rstrip("? ")
+    matched = [h for h in _handlers if h.matches(question)]
+    return matched[0] if len(matched) == 1 else None
+
+
+def record(handler_name: str | None) -> None:
+    """Count a fast-path hit (handler name) or miss (None)."""
+    if handler_name:
+        _stats["hits"] += 1
+        _stats[f"handler:{handler_name}"] += 1
+    else:
+        _stats["misses"] += 1
+
+
+def stats() -> dict:
+    hits, misses = _stats["hits"], _stats["misses"]
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / total, 3) if total else 0.0,
+        "by_handler": {
+            k.split(":", 1)[1]: v for k, v in _stats.items() if k.startswith("handler:")
+        },
+    }
+
+
+# ── Handlers ──
+
+@fast_path(
+    "products",
+    r"(what|which|list|show)( me)?( all)?( of)? (my|our) (active )?(products|catalog|peptides)",
+    r"(whats|what is|what are) (in )?(my|our) (active )?(products|catalog|peptides)",
+    r"(what|which) (active )?(products|peptides) (do|did) (i|we) have",
+    r"how many (active )?(products|peptides)( (do|did) (i|we) have| are there)?",
+)
+def _answer_products(snapshot: dict) -> str | None:
+    if "products" not in snapshot:
+        return None
+    products = snapshot["products"]
+    pending = snapshot.get("scraped", {}).get("pending", 0)
+    if not products:
+        reply = "You don't have any active products yet."
+        if pending:
+            reply += f" There are {pending} scraped peptides from your website waiting to be imported — want me to bring them in?"
+        else:
+            reply += " Share your website URL and I'll pull your catalog automatically, or tell me what you sell."
+        return reply
+
+    if len(products) >= 50:
+        lines = [f"Here are the first {len(products)} of your active products:"]
+    else:
+        lines = [f"You have {len(products)} active product{'s' if len(products) != 1 else ''}:"]
+    lines += [f"- {p['name']} — ${p['retail_price']}" for p in products]
+    if pending:
+        lines.append(f"\n{pending} more scraped peptides are still awaiting review.")
+    return "\n".join(lines)
+
+
+@fast_path(
+    "payments",
+    r"(what|which) (payments|payment methods|payment options) (do|did) (i|we) (have|accept)( set ?up| configured| enabled)?",
+    r"(what|which) (payments|payment methods|payment options) are (set ?up|configured|enabled)",
+    r"(is|are) (venmo|zelle)( and (venmo|zelle))? (set ?up|configured|connected|enabled)( yet)?",
+)
+def _answer_payments(snapshot: dict) -> str | None:
+    if "config" not in snapshot:
+        return None
+    c = snapshot["config"]
+    methods = []
+    if c.get("venmo_handle"):
+        methods.append(f"Venmo ({c['venmo_handle']})")
+    if c.get("zelle_email"):
+        methods.append(f"Zelle ({c['zelle_email']})")
+    if not methods:
+        return "No payment methods are set up yet. I can add Venmo or Zelle — which do you use?"
+    return "You're accepting: " + ", ".join(methods) + "."
+
+
+@fast_path(
+    "contacts",
+    r"how many (contacts|customers|clients)( (do|did) (i|we) have| are there)?",
+    r"how many (contacts|customers|clients) (have|has) (i|we|you) (imported|added|uploaded)",
+    r"how many (contacts|customers|clients) (have been|were) (imported|added|uploaded)",
+)
+def _answer_contacts(snapshot: dict) -> str | None:
+    if "contacts" not in snapshot:
+        return None
+    count = snapshot["contacts"]
+    if not count:
+        return "No contacts imported yet. Upload a CSV or spreadsheet of your customers and I'll import them."
+    return f"You have {count} contact{'s' if count != 1 else ''} imported."
+
+
+@fast_path(
+    "branding",
+    r"(whats|what is|what are|show me) (my|our) (branding|brand|brand colors?|logo|colors?)",
+    r"is (my|the) logo (uploaded|added)( yet)?",
+)
+def _answer_branding(snapshot: dict) -> str | None:
+    if "config" not in snapshot:
+        return None
+    c = snapshot["config"]
+    parts = []
+    name = c.get("business_name") or c.get("brand_name")
+    if name:
+        parts.append(f"name: {name}")
+    if c.get("primary_color"):
+        parts.append(f"primary color: {c['primary_color']}")
+    if c.get("secondary_color"):
+        parts.append(f"secondary color: {c['secondary_color']}")
+    parts.append("logo: set" if c.get("logo_url") else "logo: not uploaded yet")
+    if c.get("website_url"):
+        parts.append(f"website: {c['website_url']}")
+    return "Your branding — " + "; ".join(parts) + "."
+
+
+@fast_path(
+    "shipping",
+    r"(where|what) (do|does) (i|we|my orders|orders) ship from",
+    r"(where is|wheres) (my )?shipping set ?up from",
+    r"(is|has) (my )?shipping (been )?(set ?up|configured)( yet)?",
+    r"(whats|what is) (my|our) (ship from|ship-from|shipping|shipping from) address",
+)
+def _answer_shipping(snapshot: dict) -> str | None:
+    if "config" not in snapshot:
+        return None
+    c = snapshot["config"]
+    if not (c.get("ship_from_name") or c.get("ship_from_city")):
+        return "Shipping isn't configured yet. What address do you ship orders from?"
+    where = ", ".join(p for p in (c.get("ship_from_city"), c.get("ship_from_state")) if p)
+    who = c.get("ship_from_name")
+    return "Orders ship from " + " — ".join(p for p in (who, where) if p) + "."
+
+
+@fast_path(
+    "features",
+    r"(which|what) features (are|do (i|we) have)( turned on| enabled| on| active)?",
+)
+def _answer_features(snapshot: dict) -> str | None:
+    if "features" not in snapshot:
+        return None
+    if not snapshot["features"]:
+        return "No optional features are enabled yet."
+    return "Enabled features: " + ", ".join(snapshot["features"]) + "."
+
+
+@fast_path(
+    "pricing_tiers",
+    r"(whats|what is|what are|show me) (my|our) (pricing|discount|wholesale) tiers?",
+    r"(what|which) (pricing|discount|wholesale) tiers? (do|did) (i|we) have",
+)
+def _answer_pricing_tiers(snapshot: dict) -> str | None:
+    if "pricing_tiers" not in snapshot:
+        return None
+    tiers = snapshot["pricing_tiers"]
+    if not tiers["tiers"]:
+        return f"You're on the default pricing tiers: {tiers['default'].removeprefix('Default').strip(' ()') or 'standard retail pricing'}."
+    return "Your pricing tiers: " + ", ".join(f"{n} ({p}% off)" for n, p in tiers["tiers"]) + "."
+
+
+@fast_path(
+    "commissions",
+    r"how many commission (rules|structures)( (do|did) (i|we) have| are there)?( configured| set ?up)?",
+)
+def _answer_commissions(snapshot: dict) -> str | None:
+    if "commissions" not in snapshot:
+        return None
+    count = snapshot["commissions"]
+    return f"You have {count} commission rule{'s' if count != 1 else ''} configured."
+
+
+@fast_path(
+    "scraped",
+    r"how many (scraped|pending) (peptides|products)( are)?( there| awaiting review| pending)?",
+    r"(what|which) (scraped|pending) (peptides|products) are (there|awaiting review|pending)",
+    r"(what|whats|what is|how many)( peptides| products)? (is |are )?(still )?awaiting review",
+)
+def _answer_scraped(snapshot: dict) -> str | None:
+    if "scraped" not in snapshot:
+        return None
+    s = snapshot["scraped"]
+    if not s["total"]:
+        return "Nothing has been scraped from your website yet."
+    return (
+        f"{s['pending']} scraped peptides are awaiting review and {s['approved']} are approved "
+        f"({s['total']} scraped in total)."
+    )
+
+
+@fast_path(
+    "setup_status",
+    r"(whats|what is) (my|our|the) (setup|onboarding) (status|progress)",
+    r"(whats|what is) left( to do)?",
+    r"where (am i|are we) at",
+)
+def _answer_setup_status(snapshot: dict) -> str | None:
+    required = ("products", "config", "contacts")
+    if any(k not in snapshot for k in required):
+        return None
+    c = snapshot["config"]
+    checks = [
+        ("Products", bool(snapshot["products"])),
+        ("Branding", bool(
+            c.get("logo_url") or c.get("scraped_brand_data")
+            or (c.get("primary_color") or DEFAULT_PRIMARY_COLOR) != DEFAULT_PRIMARY_COLOR
+        )),
+        ("Payments", bool(c.get("venmo_handle") or c.get("zelle_email"))),
+        ("Shipping", bool(c.get("ship_from_name") or c.get("ship_from_city"))),
+        ("Contacts", bool(snapshot["contacts"])),
+    ]
+    done = [name for name, ok in checks if ok]
+    left = [name for name, ok in checks if not ok]
+    if not left:
+        return "Everything core is set up: " + ", ".join(done) + ". Anything you'd like to fine-tune?"
+    reply = f"Still to do: {', '.join(left)}."
+    if done:
+        reply = f"Done: {', '.join(done)}. " + reply
+    return reply
@@ -0,0 +1,158 @@
+"""
+In-process pub/sub for the onboarding chat feed.
+dispatch_message publishes new onboarding_messages rows and agent status
+changes here; /api/feed streams them to each of the org's connected tabs
+as Server-Sent Events. Idle subscribers cost a heartbeat, never a DB query.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger("onboarding-agent.feed")
+
+FEED_HEARTBEAT_SECONDS = float(os.environ.get("FEED_HEARTBEAT_SECONDS", "15"))
+# Events buffered per connection before it is told to resync from /api/history
+FEED_QUEUE_MAX = int(os.environ.get("FEED_QUEUE_MAX", "100"))
+FEED_MAX_PER_ORG = int(os.environ.get("FEED_MAX_PER_ORG", "20"))
+# How soon clients reconnect after their stream is closed for a restart
+FEED_RECONNECT_MS = int(os.environ.get("FEED_RECONNECT_MS", "1000"))
+# A live stream waits on its subscription at least every heartbeat. One not
+# polled for this long belongs to a stream that is gone (e.g. its generator
+# was abandoned without running its finally) and no longer counts toward
+# FEED_MAX_PER_ORG.
+FEED_STALE_SECONDS = float(os.environ.get("FEED_STALE_SECONDS", str(4 * FEED_HEARTBEAT_SECONDS)))
+
+
+class FeedFull(Exception):
+    """Raised when an org already has FEED_MAX_PER_ORG open feed connections."""
+    pass
+
+
+class Subscription:
+    """One connected client. Holds a bounded queue of pending events."""
+
+    def __init__(self, org_id: str):
+        self.org_id = org_id
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=FEED_QUEUE_MAX)
+        self.overflowed = False
+        self.last_polled = time.monotonic()
+
+    def offer(self, event: dict) -> None:
+        """Enqueue without blocking. On overflow, drop the backlog and ask for a resync."""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"event": "resync", "data": {"reason": "overflow"}})
+            self.overflowed = True
+
+    def close(self) -> None:
+        """Replace anything pending with a close event; the stream ends after sending it."""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait({"event": "close"})
+        self.overflowed = True
+
+    async def next_event(self, timeout: float) -> dict | None:
+        """Wait up to `timeout` seconds for the next event; None means send a heartbeat."""
+        self.last_polled = time.monotonic()
+        try:
+            event = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        if event.get("event") == "resync":
+            self.overflowed = False
+        return event
+
+
+_subscribers: dict[str, set[Subscription]] = defaultdict(set)
+
+
+def _prune(org_id: str) -> None:
+    """Drop the org's subscriptions whose stream stopped polling (see FEED_STALE_SECONDS)."""
+    subs = _subscribers.get(org_id)
+    if not subs:
+        return
+    cutoff = time.monotonic() - FEED_STALE_SECONDS
+    for sub in [s for s in subs if s.last_polled < cutoff]:
+        logger.info(f"Dropping a stale feed subscription for org {org_id}")
+        sub.close()  # should its stream ever resume, it tells the client to reconnect
+        unsubscribe(sub)
+
+
+def has_room(org_id: str) -> bool:
+    _prune(org_id)
+    return len(_subscribers.get(org_id, ())) < FEED_MAX_PER_ORG
+
+
+def subscribe(org_id: str) -> Subscription:
+    _prune(org_id)
+    if len(_subscribers[org_id]) >= FEED_MAX_PER_ORG:
+        raise FeedFull(f"Too many feed connections for org {org_id}")
+    sub = Subscription(org_id)
+    _subscribers[org_id].add(sub)
+    return sub
+
+
+def unsubscribe(sub: Subscription) -> None:
+    subs = _subscribers.get(sub.org_id)
+    if subs is None:
+        return
+    subs.discard(sub)
+    if not subs:
+        _subscribers.pop(sub.org_id, None)
+
+
+def publish(org_id: str, event: str, data: dict, event_id: str | None = None) -> None:
+    """Fan an event out to every subscriber of the org. Never blocks or raises."""
+    subs = _subscribers.get(org_id)
+    if not subs:
+        return
+    payload = {"event": event, "data": data}
+    if event_id:
+        payload["id"] = event_id
+    for sub in list(subs):
+        sub.offer(payload)
+
+
+def publish_message(org_id: str, row: dict, cursor: str) -> None:
+    """Publish a newly written onboarding_messages row."""
+    publish(org_id, "message", {
+        "id": row.get("id"),
+        "role": row.get("role"),
+        "content": row.get("content"),
+        "created_at": row.get("created_at"),
+    }, event_id=cursor)
+
+
+def publish_status(org_id: str, state: str, **fields) -> None:
+    """Publish an agent/job status change (queued, running, completed, error, ...)."""
+    publish(org_id, "status", {"state": state, **fields})
+
+
+def format_sse(event: dict) -> str:
+    """Serialize an event dict as an SSE frame."""
+    lines = []
+    if event.get("id"):
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['event']}")
+    lines.append(f"data: {json.dumps(event['data'], separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+def close_all() -> int:
+    """End every open feed stream (its client reconnects); returns how many were open."""
+    subs = [sub for org_subs in _subscribers.values() for sub in org_subs]
+    for sub in subs:
+        sub.close()
+    return len(subs)
+
+
+def connection_count() -> int:
+    return sum(len(s) for s in _subscribers.values())
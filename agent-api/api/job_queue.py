@@ -0,0 +1,325 @@
+"""
+Durable job queue with leases, shared by the API tier and worker nodes.
+
+A producer enqueues a JSON payload and polls for its result. A worker leases
+the oldest ready job for a few seconds at a time, keeps the lease alive with
+heartbeats while it works, and then completes or fails it:
+- A lease that expires (the worker died or hung) puts the job back in the
+  queue, until it has been attempted max_attempts times.
+- A failure marked retryable goes back in the queue the same way. Any other
+  failure is final.
+- A job that has not started by its not_after time expires instead of
+  running late.
+- A producer that gives up cancels the job. The worker's next heartbeat
+  sees this and stops the work.
+
+Backends implement QueueBackend and register in BACKENDS under a URL scheme:
+- SupabaseBackend ("supabase://") keeps the queue in the project's agent_jobs
+  table, so worker nodes on any host can share it. Use this to add capacity
+  with more machines.
+- SQLiteBackend ("sqlite:///abs/path/jobs.db") keeps it in a local file. The
+  API and every worker must run on the same machine.
+Backends are synchronous; async callers go through asyncio.to_thread.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+logger = logging.getLogger("onboarding-agent.job_queue")
+
+FINISHED = ("done", "failed", "expired", "cancelled")
+
+
+@dataclass
+class Job:
+    id: str
+    queue: str
+    payload: dict
+    status: str                 # queued | leased | done | failed | expired | cancelled
+    attempts: int
+    max_attempts: int
+    not_after: float | None     # epoch seconds; a job not started by then expires
+    lease_owner: str | None
+    lease_expires_at: float | None
+    result: dict | None
+    error: dict | None
+    created_at: float
+    updated_at: float
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+
+class QueueBackend:
+    """The operations every queue backend provides. Times are epoch seconds."""
+
+    def enqueue(self, queue: str, payload: dict, max_attempts: int = 1, not_after: float | None = None) -> str:
+        raise NotImplementedError
+
+    def lease(self, queue: str, owner: str, lease_seconds: float) -> Job | None:
+        """Claim the oldest ready job, first requeueing expired leases and expiring stale jobs."""
+        raise NotImplementedError
+
+    def heartbeat(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """Extend the lease. False means it was lost (expired, or the job was cancelled): stop working."""
+        raise NotImplementedError
+
+    def complete(self, job_id: str, owner: str, result: dict) -> bool:
+        raise NotImplementedError
+
+    def fail(self, job_id: str, owner: str, error: dict, retry: bool = False) -> bool:
+        raise NotImplementedError
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job that has not finished. Returns False if it already had."""
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Job | None:
+        raise NotImplementedError
+
+    def purge(self, older_than: float) -> int:
+        """Delete finished jobs last updated before `older_than`."""
+        raise NotImplementedError
+
+    def stats(self, queue: str) -> dict:
+        raise NotImplementedError
+
+
+class SQLiteBackend(QueueBackend):
+    """
+    Queue in a local SQLite file (WAL mode). Leasing runs in an IMMEDIATE
+    transaction, so concurrent workers never claim the same job. Every
+    process must see the same file, so use this only for workers on one
+    machine.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                queue TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 1,
+                not_after REAL,
+                lease_owner TEXT,
+                lease_expires_at REAL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (queue, status, created_at);
+        """)
+
+    def _write(self, sql: str, params: tuple) -> int:
+        with self._lock:
+            return self._db.execute(sql, params).rowcount
+
+    def enqueue(self, queue: str, payload: dict, max_attempts: int = 1, not_after: float | None = None) -> str:
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        self._write(
+            "INSERT INTO jobs (id, queue, payload, status, max_attempts, not_after, created_at, updated_at) "
+            "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+            (job_id, queue, json.dumps(payload), max_attempts, not_after, now, now),
+        )
+        return job_id
+
+    def lease(self, queue: str, owner: str, lease_seconds: float) -> Job | None:
+        now = time.time()
+        with self._lock:
+            db = self._db
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                requeued = db.execute(
+                    "UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END, "
+                    "error = CASE WHEN attempts < max_attempts THEN error ELSE ? END, "
+                    "lease_owner = NULL, lease_expires_at = NULL, updated_at = ? "
+                    "WHERE queue = ? AND status = 'leased' AND lease_expires_at < ?",
+                    (json.dumps({"kind": "lease_expired"}), now, queue, now),
+                ).rowcount
+                if requeued:
+                    logger.warning(f"Job queue {queue}: {requeued} lease(s) expired")
+                db.execute(
+                    "UPDATE jobs SET status = 'expired', updated_at = ? "
+                    "WHERE queue = ? AND status = 'queued' AND not_after < ?",
+                    (now, queue, now),
+                )
+                row = db.execute(
+                    "SELECT id FROM jobs WHERE queue = ? AND status = 'queued' ORDER BY created_at LIMIT 1",
+                    (queue,),
+                ).fetchone()
+                if row is not None:
+                    db.execute(
+                        "UPDATE jobs SET status = 'leased', attempts = attempts + 1, lease_owner = ?, "
+                        "lease_expires_at = ?, updated_at = ? WHERE id = ?",
+                        (owner, now + lease_seconds, now, row["id"]),
+                    )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return self.get(row["id"]) if row is not None else None
+
+    def heartbeat(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        now = time.time()
+        return self._write(
+            "UPDATE jobs SET lease_expires_at = ?, updated_at = ? "
+            "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            (now + lease_seconds, now, job_id, owner),
+        ) == 1
+
+    def complete(self, job_id: str, owner: str, result: dict) -> bool:
+        return self._write(
+            "UPDATE jobs SET status = 'done', result = ?, lease_expires_at = NULL, updated_at = ? "
+            "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            (json.dumps(result), time.time(), job_id, owner),
+        ) == 1
+
+    def fail(self, job_id: str, owner: str, error: dict, retry: bool = False) -> bool:
+        return self._write(
+            "UPDATE jobs SET status = CASE WHEN ? AND attempts < max_attempts THEN 'queued' ELSE 'failed' END, "
+            "error = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ? "
+            "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            (retry, json.dumps(error), time.time(), job_id, owner),
+        ) == 1
+
+    def cancel(self, job_id: str) -> bool:
+        return self._write(
+            "UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ? AND status IN ('queued', 'leased')",
+            (time.time(), job_id),
+        ) == 1
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for key in ("payload", "result", "error"):
+            job[key] = json.loads(job[key]) if job[key] is not None else None
+        return Job(**job)
+
+    def purge(self, older_than: float) -> int:
+        return self._write(
+            f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED))}) AND updated_at < ?",
+            (*FINISHED, older_than),
+        )
+
+    def stats(self, queue: str) -> dict:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT status, COUNT(*) AS n, MIN(created_at) AS oldest FROM jobs WHERE queue = ? GROUP BY status",
+                (queue,),
+            ).fetchall()
+            workers = self._db.execute(
+                "SELECT COUNT(DISTINCT lease_owner) FROM jobs WHERE queue = ? AND status = 'leased'", (queue,),
+            ).fetchone()[0]
+        counts = {r["status"]: r["n"] for r in rows}
+        oldest = next((r["oldest"] for r in rows if r["status"] == "queued"), None)
+        return {
+            **{s: counts.get(s, 0) for s in ("queued", "leased", *FINISHED)},
+            "busy_workers": workers,
+            "oldest_queued_seconds": round(time.time() - oldest, 1) if oldest else 0.0,
+        }
+
+
+class SupabaseBackend(QueueBackend):
+    """
+    Queue in the agent_jobs table (supabase/migrations/20261019_agent_jobs.sql),
+    reached over PostgREST with the service key. Every state change is an
+    agent_job_* function: leasing claims a row with FOR UPDATE SKIP LOCKED, so
+    concurrent workers never claim the same job, and lease times come from
+    the database clock, so hosts with drifting clocks agree on expiry.
+    """
+
+    def __init__(self, url: str, key: str):
+        from supabase import create_client
+        self._sb = create_client(url, key)
+
+    def _rpc(self, fn: str, params: dict):
+        return self._sb.rpc(fn, params).execute().data
+
+    @staticmethod
+    def _job(row: dict) -> Job:
+        return Job(**{f: row.get(f) for f in Job.__dataclass_fields__})
+
+    def enqueue(self, queue: str, payload: dict, max_attempts: int = 1, not_after: float | None = None) -> str:
+        result = self._sb.table("agent_jobs").insert({
+            "queue": queue,
+            "payload": payload,
+            "max_attempts": max_attempts,
+            "not_after": not_after,
+        }).execute()
+        return result.data[0]["id"]
+
+    def lease(self, queue: str, owner: str, lease_seconds: float) -> Job | None:
+        rows = self._rpc("agent_job_lease", {"p_queue": queue, "p_owner": owner, "p_lease_seconds": lease_seconds})
+        return self._job(rows[0]) if rows else None
+
+    def heartbeat(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        return bool(self._rpc(
+            "agent_job_heartbeat", {"p_id": job_id, "p_owner": owner, "p_lease_seconds": lease_seconds},
+        ))
+
+    def complete(self, job_id: str, owner: str, result: dict) -> bool:
+        return bool(self._rpc("agent_job_complete", {"p_id": job_id, "p_owner": owner, "p_result": result}))
+
+    def fail(self, job_id: str, owner: str, error: dict, retry: bool = False) -> bool:
+        return bool(self._rpc(
+            "agent_job_fail", {"p_id": job_id, "p_owner": owner, "p_error": error, "p_retry": retry},
+        ))
+
+    def cancel(self, job_id: str) -> bool:
+        return bool(self._rpc("agent_job_cancel", {"p_id": job_id}))
+
+    def get(self, job_id: str) -> Job | None:
+        result = self._sb.table("agent_jobs").select("*").eq("id", job_id).limit(1).execute()
+        return self._job(result.data[0]) if result.data else None
+
+    def purge(self, older_than: float) -> int:
+        return self._rpc("agent_job_purge", {"p_older_than": older_than}) or 0
+
+    def stats(self, queue: str) -> dict:
+        data = self._rpc("agent_job_stats", {"p_queue": queue}) or {}
+        counts = data.get("counts") or {}
+        return {
+            **{s: counts.get(s, 0) for s in ("queued", "leased", *FINISHED)},
+            "busy_workers": data.get("busy_workers", 0),
+            "oldest_queued_seconds": round(float(data.get("oldest_queued_seconds") or 0), 1),
+        }
+
+
+BACKENDS: dict[str, type[QueueBackend]] = {"sqlite": SQLiteBackend, "supabase": SupabaseBackend}
+
+
+def open_backend(url: str) -> QueueBackend:
+    """
+    Open the backend a queue URL names: supabase:// (the project in
+    SUPABASE_URL, with SUPABASE_SERVICE_KEY) or
+    sqlite:///var/lib/peptide-agent/jobs.db.
+    """
+    parts = urlsplit(url)
+    backend = BACKENDS.get(parts.scheme)
+    if backend is None:
+        raise ValueError(f"Unknown job queue backend '{parts.scheme}' in {url!r}")
+    if backend is SQLiteBackend:
+        return SQLiteBackend("/" + parts.path.lstrip("/"))
+    if backend is SupabaseBackend:
+        return SupabaseBackend(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_KEY"])
+    return backend(url)
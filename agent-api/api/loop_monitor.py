@@ -0,0 +1,102 @@
+"""
+Event-loop lag monitor.
+
+A task on the loop sleeps LOOP_LAG_INTERVAL seconds at a time and records
+how late it wakes up in the loop.lag_ms histogram in metrics. Any blocking
+call on the loop (a sync Supabase query, a big JSON parse) shows up there
+as lag.
+
+A watchdog thread watches the task's heartbeat. If the loop has not ticked
+for LOOP_STALL_THRESHOLD seconds past its interval, the watchdog logs the
+loop thread's current stack, which is the code doing the blocking. It logs
+once per stall.
+
+Cost: one timer wake-up per interval on the loop, and one thread wake-up
+per half threshold.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+
+try:
+    from api import metrics
+except ImportError:
+    import metrics
+
+logger = logging.getLogger("onboarding-agent.loop_monitor")
+
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", "0.25"))
+LOOP_STALL_THRESHOLD = float(os.environ.get("LOOP_STALL_THRESHOLD", "0.5"))
+LAG_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+STALL_STACK_DEPTH = 30
+
+_task: asyncio.Task | None = None
+_watchdog: threading.Thread | None = None
+_stop = threading.Event()
+_heartbeat = 0.0
+_loop_thread_id: int | None = None
+_stalls = 0
+
+
+def start() -> None:
+    """Start the lag task and stall watchdog (call from the app lifespan)."""
+    global _task, _watchdog, _heartbeat, _loop_thread_id
+    if _task is not None or LOOP_LAG_INTERVAL <= 0:
+        return
+    _loop_thread_id = threading.get_ident()
+    _heartbeat = time.monotonic()
+    _stop.clear()
+    _task = asyncio.create_task(_tick())
+    _watchdog = threading.Thread(target=_watch, name="loop-watchdog", daemon=True)
+    _watchdog.start()
+    logger.info(f"Loop monitor started (interval {LOOP_LAG_INTERVAL}s, stall threshold {LOOP_STALL_THRESHOLD}s)")
+
+
+async def stop() -> None:
+    global _task, _watchdog
+    _stop.set()
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
+    if _watchdog is not None:
+        _watchdog.join(timeout=1)
+        _watchdog = None
+
+
+def stats() -> dict:
+    return {
+        "interval_seconds": LOOP_LAG_INTERVAL,
+        "stall_threshold_seconds": LOOP_STALL_THRESHOLD,
+        "stalls": _stalls,
+    }
+
+
+async def _tick() -> None:
+    global _heartbeat
+    while True:
+        before = time.monotonic()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        now = time.monotonic()
+        _heartbeat = now
+        metrics.histogram("loop.lag_ms", max(0.0, now - before - LOOP_LAG_INTERVAL) * 1000, LAG_BUCKETS_MS)
+
+
+def _watch() -> None:
+    """Log the loop thread's stack once for every stall longer than the threshold."""
+    global _stalls
+    reported = 0.0  # heartbeat of the stall already logged
+    while not _stop.wait(LOOP_STALL_THRESHOLD / 2):
+        beat = _heartbeat
+        stalled_for = time.monotonic() - beat - LOOP_LAG_INTERVAL
+        if stalled_for < LOOP_STALL_THRESHOLD or beat == reported:
+            continue
+        reported = beat
+        _stalls += 1
+        frame = sys._current_frames().get(_loop_thread_id)
+        stack = "".join(traceback.format_stack(frame, limit=STALL_STACK_DEPTH)) if frame else "(unavailable)\n"
+        logger.warning(f"Event loop blocked for {stalled_for * 1000:.0f}ms+ — loop thread stack:\n{stack.rstrip()}")
@@ -5,17 +5,44 @@ FastAPI backend that bridges the frontend chat to Claude Code via AgentAPI.
 import os
 import logging
 from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Literal
 
-from fastapi import FastAPI, Request, HTTPException, Depends
+import httpx
+from fastapi import FastAPI, Request, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
 try:
-    from api.auth import verify_supabase_jwt, UserContext
-    from api.dispatch import dispatch_message, get_conversation_history, RateLimitExceeded
+    from api import agent_jobs, breakers, capture, drain, fastpath, feed, loop_monitor, mcp_pool, metrics, profiler, scrape_worker, sql_cache, warm_agents
+    from api.auth import verify_supabase_jwt, verify_stream_token, issue_stream_ticket, require_org_staff, require_super_admin, UserContext, STREAM_TICKET_TTL
+    from api.deadline import Deadline, DeadlineExceeded
+    from api.dispatch import (
+        dispatch_message, get_conversation_history, get_history_marker, history_etag,
+        encode_cursor, schedule_prewarm, cancel_all_prewarm, drain_turns, start_background_scrapes, import_scraped_peptides, RateLimitExceeded, InvalidCursor, HISTORY_DEFAULT_LIMIT, HISTORY_MAX_LIMIT,
+    )
 except ImportError:
-    from auth import verify_supabase_jwt, UserContext
-    from dispatch import dispatch_message, get_conversation_history, RateLimitExceeded
+    import agent_jobs
+    import breakers
+    import capture
+    import drain
+    import fastpath
+    import feed
+    import loop_monitor
+    import mcp_pool
+    import metrics
+    import profiler
+    import scrape_worker
+    import sql_cache
+    import warm_agents
+    from auth import verify_supabase_jwt, verify_stream_token, issue_stream_ticket, require_org_staff, require_super_admin, UserContext, STREAM_TICKET_TTL
+    from deadline import Deadline, DeadlineExceeded
+    from dispatch import (
+        dispatch_message, get_conversation_history, get_history_marker, history_etag,
+        encode_cursor, schedule_prewarm, cancel_all_prewarm, drain_turns, start_background_scrapes, import_scraped_peptides, RateLimitExceeded, InvalidCursor, HISTORY_DEFAULT_LIMIT, HISTORY_MAX_LIMIT,
+    )
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("onboarding-agent")
@@ -30,8 +57,37 @@ ALLOWED_ORIGINS = [
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Onboarding Agent API starting...")
+    loop_monitor.start()
+    await mcp_pool.start_pool()
+    sql_cache.start()
+    start_background_scrapes()
+    drain.install(_drain)
     yield
     logger.info("Onboarding Agent API shutting down.")
+    cancel_all_prewarm()
+    await scrape_worker.stop()
+    await mcp_pool.stop_pool()
+    await sql_cache.close()
+    await loop_monitor.stop()
+
+
+async def _drain(timeout: float) -> None:
+    """Stop taking new work, let running agent turns finish, then flush (see drain.py)."""
+    closed = feed.close_all()
+    logger.info(f"Drain: closed {closed} feed stream(s)")
+    await drain_turns(timeout)
+    await scrape_worker.stop()
+    await capture.flush()
+
+
+def accepting_work() -> None:
+    """Refuse new work while the process drains for a restart."""
+    if drain.is_draining():
+        raise HTTPException(
+            status_code=503,
+            detail="The assistant is restarting. Please try again in a moment.",
+            headers={"Retry-After": str(drain.DRAIN_RETRY_AFTER)},
+        )
 
 
 app = FastAPI(
@@ -46,9 +102,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Last-Modified"],
 )
 
 
+@app.middleware("http")
+async def request_deadline(request: Request, call_next):
+    """Start the request's deadline budget on arrival (see deadline.py)."""
+    request.state.deadline = Deadline.from_headers(request.headers)
+    return await call_next(request)
+
+
 class Attachment(BaseModel):
     url: str
     name: str
@@ -65,13 +129,33 @@ class ChatResponse(BaseModel):
     message_id: str | None = None
 
 
+class ImportScrapedRequest(BaseModel):
+    min_confidence: float | None = None
+
+
 @app.get("/api/health")
 async def health():
-    return {"status": "ok", "service": "onboarding-agent"}
+    body = {
+        "status": "draining" if drain.is_draining() else "ok",
+        "service": "onboarding-agent",
+        "feed_connections": feed.connection_count(),
+        "mcp_pool": await mcp_pool.pool_status(),
+        "sql_cache": sql_cache.stats(),
+        "fast_path": fastpath.stats(),
+        "warm_agents": warm_agents.count(),
+        "agent_queue": await agent_jobs.stats(),
+        "background_scrapes": scrape_worker.stats(),
+        "circuit_breakers": breakers.states(),
+        "event_loop": loop_monitor.stats(),
+        "drain": drain.status(),
+        "metrics": metrics.snapshot(),
+    }
+    # 503 while draining, so deploy checks and load balancers stop routing here
+    return JSONResponse(body, status_code=503 if drain.is_draining() else 200)
 
 
-@app.post("/api/chat", response_model=ChatResponse)
-async def chat(req: ChatRequest, user: UserContext = Depends(verify_supabase_jwt)):
+@app.post("/api/chat", response_model=ChatResponse, dependencies=[Depends(accepting_work)])
+async def chat(req: ChatRequest, request: Request, user: UserContext = Depends(verify_supabase_jwt)):
     if not req.message.strip():
         raise HTTPException(status_code=400, detail="Message cannot be empty")
 
@@ -85,21 +169,223 @@ async def chat(req: ChatRequest, user: UserContext = Depends(verify_supabase_jwt
             message=req.message.strip(),
             attachments=attachments,
             access_token=user.access_token,
+            deadline=request.state.deadline,
         )
         return ChatResponse(reply=result["reply"], message_id=result.get("message_id"))
     except RateLimitExceeded:
         raise HTTPException(status_code=429, detail="Too many requests. Please wait a moment and try again.")
+    except DeadlineExceeded as e:
+        logger.warning(f"Chat request for org {user.org_id} ran out of time during {e.stage}")
+        raise HTTPException(status_code=504, detail="The request timed out. Please try again.")
+    except breakers.CircuitOpen as e:
+        logger.warning(f"Chat request for org {user.org_id} rejected: {e}")
+        raise HTTPException(status_code=503, detail="Chat is temporarily unavailable. Please try again shortly.")
     except Exception as e:
         logger.exception("Chat dispatch error")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/chat/warm", dependencies=[Depends(accepting_work)])
+async def chat_warm(user: UserContext = Depends(verify_supabase_jwt)):
+    """Warm the org's chat path ahead of the first message (state, agent process, pending scrape)."""
+    return {"scheduled": schedule_prewarm(user.org_id, user.access_token)}
+
+
+@app.post("/api/peptides/import-scraped", dependencies=[Depends(accepting_work)])
+async def import_scraped(req: ImportScrapedRequest | None = None, user: UserContext = Depends(require_org_staff)):
+    """Import the org's pending scraped peptides in one set-based call and return what was imported."""
+    kwargs = {}
+    if req and req.min_confidence is not None:
+        if not 0 <= req.min_confidence <= 1:
+            raise HTTPException(status_code=400, detail="min_confidence must be between 0 and 1")
+        kwargs["min_confidence"] = req.min_confidence
+    try:
+        rows = await import_scraped_peptides(user.org_id, **kwargs)
+    except breakers.CircuitOpen:
+        raise HTTPException(status_code=503, detail="The database is temporarily unavailable. Please try again shortly.")
+    except Exception as e:
+        logger.exception("Scraped peptide import error")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "imported": [r for r in rows if r.get("outcome") == "imported"],
+        "duplicates": [r for r in rows if r.get("outcome") == "duplicate"],
+    }
+
+
+def _not_modified(request: Request, etag: str, last_modified: datetime | None) -> bool:
+    """Evaluate If-None-Match / If-Modified-Since (If-None-Match wins when present)."""
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since and last_modified:
+        try:
+            return last_modified.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
 @app.get("/api/history")
-async def history(user: UserContext = Depends(verify_supabase_jwt)):
-    """Return conversation history for the current user's org."""
+async def history(
+    request: Request,
+    before: str | None = None,
+    after: str | None = None,
+    limit: int = Query(HISTORY_DEFAULT_LIMIT, ge=1, le=HISTORY_MAX_LIMIT),
+    order: Literal["asc", "desc"] = "asc",
+    user: UserContext = Depends(verify_supabase_jwt),
+):
+    """
+    Return a keyset-paginated window of conversation history for the user's org.
+    Responses carry an ETag/Last-Modified derived from the org's newest message,
+    so unchanged polls get a bodiless 304.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Pass either 'before' or 'after', not both")
+
     try:
-        messages = await get_conversation_history(user.org_id, user.user_id)
-        return {"messages": messages}
+        marker = await get_history_marker(user.org_id)
+        etag = history_etag(marker, before=before, after=after, limit=limit, order=order)
+        last_modified = (
+            datetime.fromisoformat(marker["created_at"]).astimezone(timezone.utc) if marker else None
+        )
+
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if last_modified:
+            headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+
+        if _not_modified(request, etag, last_modified):
+            return Response(status_code=304, headers=headers)
+
+        page = await get_conversation_history(
+            user.org_id, user.user_id,
+            before=before, after=after, limit=limit, order=order,
+        )
+        return JSONResponse(page, headers=headers)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.exception("History fetch error")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/admin/profile")
+async def admin_profile(
+    seconds: float = Query(10, gt=0, le=profiler.PROFILE_MAX_SECONDS),
+    threads: Literal["loop", "all"] = "loop",
+    user: UserContext = Depends(require_super_admin),
+):
+    """
+    Sample the live process for `seconds` and return folded stacks
+    (flamegraph.pl / speedscope input). `threads=all` includes worker threads.
+    """
+    try:
+        folded = await profiler.profile(seconds, all_threads=threads == "all")
+    except profiler.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Response(
+        folded,
+        media_type="text/plain",
+        headers={"Content-Disposition": 'attachment; filename="agent-api.folded"'},
+    )
+
+
+@app.get("/mcp/{name}/sse")
+async def mcp_proxy_stream(name: str, request: Request, slot: int = Query(0)):
+    """Agent-facing SSE endpoint of the SQL read-through cache (see sql_cache.py)."""
+    upstream = mcp_pool.upstream_url(name, slot)
+    if upstream is None or not sql_cache.proxied(name) or not sql_cache.authorized(request.headers):
+        raise HTTPException(status_code=404, detail="Not found")
+    try:
+        stream = await sql_cache.open_stream(name, upstream, request.headers.get("X-Agent-Org-Id", ""))
+    except httpx.HTTPError as e:
+        logger.warning(f"SQL cache proxy: {name} gateway unreachable: {e}")
+        raise HTTPException(status_code=502, detail=f"{name} MCP gateway unavailable")
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/mcp/{name}/message")
+async def mcp_proxy_message(name: str, request: Request, session_id: str = Query(alias="sessionId")):
+    if not sql_cache.proxied(name) or not sql_cache.authorized(request.headers):
+        raise HTTPException(status_code=404, detail="Not found")
+    try:
+        status, body, content_type = await sql_cache.post_message(
+            session_id, await request.body(), request.headers.get("content-type", ""),
+        )
+    except httpx.HTTPError as e:
+        logger.warning(f"SQL cache proxy: {name} gateway unreachable: {e}")
+        raise HTTPException(status_code=502, detail=f"{name} MCP gateway unavailable")
+    return Response(body, status_code=status, media_type=content_type)
+
+
+@app.post("/api/feed/ticket", dependencies=[Depends(accepting_work)])
+async def feed_ticket(user: UserContext = Depends(verify_supabase_jwt)):
+    """Issue a single-use ticket for opening /api/feed?ticket=... from an EventSource."""
+    return {"ticket": issue_stream_ticket(user), "expires_in": STREAM_TICKET_TTL}
+
+
+@app.get("/api/feed", dependencies=[Depends(accepting_work)])
+async def message_feed(request: Request, user: UserContext = Depends(verify_stream_token)):
+    """
+    Server-Sent Events stream of new onboarding messages and agent status
+    changes for the user's org. Reconnecting clients send Last-Event-ID (a
+    history cursor) and receive whatever they missed before going live.
+    """
+    if not feed.has_room(user.org_id):
+        raise HTTPException(status_code=429, detail="Too many open chat tabs for this organization.")
+
+    resume_from = request.headers.get("Last-Event-ID") or request.query_params.get("after")
+
+    async def stream():
+        # Subscribed here, not in the handler, so the subscription always has
+        # this finally to release it; a generator abandoned without running it
+        # stops polling and is pruned by the feed (FEED_STALE_SECONDS). Subscribe
+        # before backfilling so nothing written in between is lost; a row may
+        # arrive twice, and clients de-dupe on message id.
+        try:
+            sub = feed.subscribe(user.org_id)
+        except feed.FeedFull:
+            # Another tab took the last place since the check above
+            yield f"retry: {int(feed.FEED_HEARTBEAT_SECONDS * 1000)}\n\n"
+            return
+        try:
+            yield f"retry: {int(feed.FEED_HEARTBEAT_SECONDS * 1000)}\n\n"
+            if resume_from:
+                try:
+                    page = await get_conversation_history(
+                        user.org_id, user.user_id, after=resume_from, limit=HISTORY_MAX_LIMIT,
+                    )
+                    for row in page["messages"]:
+                        yield feed.format_sse({
+                            "event": "message", "data": row, "id": encode_cursor(row),
+                        })
+                    if page["has_more"]:
+                        yield feed.format_sse({"event": "resync", "data": {"reason": "backlog"}})
+                except InvalidCursor:
+                    yield feed.format_sse({"event": "resync", "data": {"reason": "bad_cursor"}})
+
+            while True:
+                event = await sub.next_event(feed.FEED_HEARTBEAT_SECONDS)
+                if event is None:
+                    if await request.is_disconnected():
+                        break
+                    yield ": heartbeat\n\n"
+                    continue
+                if event["event"] == "close":
+                    yield f"retry: {feed.FEED_RECONNECT_MS}\n\n"
+                    break
+                yield feed.format_sse(event)
+        finally:
+            feed.unsubscribe(sub)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
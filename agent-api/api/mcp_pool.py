@@ -0,0 +1,239 @@
+"""
+Shared, long-running MCP servers for agent runs.
+
+Instead of every Claude CLI process booting its own Supabase and Composio
+MCP servers from /root/.mcp.json, the stdio servers defined there are started
+at API startup behind SSE gateways (supergateway), supervised, and restarted
+if they exit. Each agent run gets a generated MCP config pointing at them.
+
+A supergateway --stdio bridge multiplexes all of its SSE sessions onto one
+stdio JSON-RPC stream, so two runs sharing a gateway could receive each
+other's tool results when their request ids clash. The pool therefore holds
+MCP_POOL_SLOTS slots, one per agent slot, each with its own gateway per
+server. A run (or a warm process waiting for one) leases a whole slot and
+is its only client until it releases it. If no slot is free, the run boots
+its own servers as before.
+
+Servers listed in SQL_CACHE_SERVERS are reached through the read-through
+cache proxy in sql_cache.py rather than their gateway directly. The
+X-Agent-Org-Id header on the run config only attributes those requests to
+an org; isolation comes from the slot lease.
+"""
+import os
+import json
+import shlex
+import asyncio
+import logging
+import tempfile
+from dataclasses import dataclass
+
+try:
+    from api import sql_cache
+except ImportError:
+    import sql_cache
+
+logger = logging.getLogger("onboarding-agent.mcp_pool")
+
+MCP_POOL_ENABLED = os.environ.get("MCP_POOL_ENABLED", "0") == "1"
+MCP_CONFIG_PATH = os.environ.get("MCP_CONFIG_PATH", "/root/.mcp.json")
+MCP_GATEWAY_CMD = os.environ.get("MCP_GATEWAY_CMD", "npx -y supergateway")
+MCP_POOL_HOST = "127.0.0.1"
+MCP_POOL_BASE_PORT = int(os.environ.get("MCP_POOL_BASE_PORT", "8200"))
+MCP_POOL_RESTART_DELAY = float(os.environ.get("MCP_POOL_RESTART_DELAY", "2"))
+# One slot per concurrent run; defaults to the API's agent concurrency
+MCP_POOL_SLOTS = int(os.environ.get("MCP_POOL_SLOTS", os.environ.get("MAX_CONCURRENT_AGENTS", "4")))
+
+
+class PooledServer:
+    """One stdio MCP server exposed over SSE by a supervised gateway process."""
+
+    def __init__(self, name: str, slot: int, spec: dict, port: int):
+        self.name = name
+        self.slot = slot
+        self.spec = spec
+        self.port = port
+        self.process: asyncio.subprocess.Process | None = None
+        self.restarts = 0
+        self._supervisor: asyncio.Task | None = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{MCP_POOL_HOST}:{self.port}/sse"
+
+    def _command(self) -> list[str]:
+        stdio_cmd = shlex.join([self.spec["command"], *self.spec.get("args", [])])
+        return [*shlex.split(MCP_GATEWAY_CMD), "--stdio", stdio_cmd, "--port", str(self.port)]
+
+    async def _spawn(self) -> None:
+        env = {**os.environ, "HOME": "/root", **self.spec.get("env", {})}
+        self.process = await asyncio.create_subprocess_exec(
+            *self._command(),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+            cwd="/root",
+            env=env,
+        )
+        logger.info(f"MCP pool: started {self.name}#{self.slot} on :{self.port} (pid {self.process.pid})")
+
+    async def _supervise(self) -> None:
+        while True:
+            await self._spawn()
+            code = await self.process.wait()
+            self.restarts += 1
+            logger.warning(f"MCP pool: {self.name}#{self.slot} exited with {code}, restarting")
+            await asyncio.sleep(MCP_POOL_RESTART_DELAY)
+
+    def start(self) -> None:
+        self._supervisor = asyncio.create_task(self._supervise())
+
+    async def stop(self) -> None:
+        if self._supervisor:
+            self._supervisor.cancel()
+        if self.process and self.process.returncode is None:
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout=5.0)
+            except asyncio.TimeoutError:
+                self.process.kill()
+
+    async def is_ready(self) -> bool:
+        if not self.process or self.process.returncode is not None:
+            return False
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(MCP_POOL_HOST, self.port), timeout=0.5,
+            )
+            writer.close()
+            return True
+        except (OSError, asyncio.TimeoutError):
+            return False
+
+
+@dataclass
+class RunConfig:
+    """
+    A generated MCP config file and the pool slot it points at (None if it
+    uses no pooled servers). `sql_cached` is set when the run's SQL goes
+    through the cache proxy, which then sees (and invalidates on) its writes.
+    """
+    path: str
+    slot: int | None
+    sql_cached: bool = False
+
+    def release(self) -> None:
+        """Delete the config file and give the slot back. Safe to call twice."""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        if self.slot is not None:
+            _free_slots.put_nowait(self.slot)
+            self.slot = None
+
+
+_slots: list[dict[str, PooledServer]] = []
+_free_slots: asyncio.Queue = asyncio.Queue()
+_passthrough: dict[str, dict] = {}
+
+
+def _load_config() -> dict:
+    if not os.path.exists(MCP_CONFIG_PATH):
+        return {}
+    with open(MCP_CONFIG_PATH, "r") as f:
+        return json.load(f).get("mcpServers", {})
+
+
+async def start_pool(slots: int = MCP_POOL_SLOTS) -> None:
+    """Start `slots` gateways per stdio server in the MCP config. No-op unless MCP_POOL_ENABLED."""
+    global _free_slots
+    if not MCP_POOL_ENABLED:
+        return
+    config = _load_config()
+    stdio = {name: spec for name, spec in config.items() if spec.get("command")}
+    # Remote (http/sse) servers are handed to agents as-is
+    _passthrough.update({name: spec for name, spec in config.items() if name not in stdio})
+    if not stdio:
+        return
+
+    _free_slots = asyncio.Queue()
+    port = MCP_POOL_BASE_PORT
+    for slot in range(slots):
+        servers = {}
+        for name, spec in stdio.items():
+            servers[name] = PooledServer(name, slot, spec, port)
+            servers[name].start()
+            port += 1
+        _slots.append(servers)
+        _free_slots.put_nowait(slot)
+    logger.info(f"MCP pool: {slots} slot(s) of {len(stdio)} server(s), {len(_passthrough)} passthrough")
+
+
+async def stop_pool() -> None:
+    await asyncio.gather(
+        *(s.stop() for servers in _slots for s in servers.values()), return_exceptions=True,
+    )
+    _slots.clear()
+    _passthrough.clear()
+
+
+def pool_active() -> bool:
+    return bool(_slots)
+
+
+def upstream_url(name: str, slot: int) -> str | None:
+    """The gateway SSE URL of a pooled server in `slot`, or None if there is none."""
+    if not 0 <= slot < len(_slots):
+        return None
+    server = _slots[slot].get(name)
+    return server.url if server else None
+
+
+async def write_run_config(org_id: str) -> RunConfig | None:
+    """
+    Lease a free slot and write a per-run MCP config pointing at its servers.
+    Servers whose gateway is not up fall back to their original stdio
+    definition; with no free slot, all of them do. Returns None when the pool
+    is disabled. The caller must release() the returned config after the run.
+    """
+    if not _slots:
+        return None
+
+    try:
+        slot = _free_slots.get_nowait()
+    except asyncio.QueueEmpty:
+        logger.warning(f"MCP pool: no free slot — run for org {org_id} boots its own servers")
+        servers = {**_passthrough, **{name: s.spec for name, s in _slots[0].items()}}
+        slot = None
+        sql_cached = False
+    else:
+        servers = dict(_passthrough)
+        sql_cached = False
+        for name, server in _slots[slot].items():
+            if not await server.is_ready():
+                logger.warning(f"MCP pool: {name}#{slot} not ready — run boots its own instance")
+                servers[name] = server.spec
+            elif sql_cache.proxied(name):
+                servers[name] = sql_cache.run_config_entry(name, org_id, slot)
+                sql_cached = True
+            else:
+                servers[name] = {"type": "sse", "url": server.url}
+
+    try:
+        fd, path = tempfile.mkstemp(prefix="mcp-run-", suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"mcpServers": servers}, f)
+    except BaseException:
+        if slot is not None:
+            _free_slots.put_nowait(slot)
+        raise
+    return RunConfig(path, slot, sql_cached)
+
+
+async def pool_status() -> dict:
+    return {
+        "slots": len(_slots),
+        "free_slots": _free_slots.qsize() if _slots else 0,
+        "servers": {
+            f"{name}#{slot}": {"port": s.port, "ready": await s.is_ready(), "restarts": s.restarts}
+            for slot, servers in enumerate(_slots) for name, s in servers.items()
+        },
+    }
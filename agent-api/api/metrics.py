@@ -0,0 +1,102 @@
+"""
+In-process counters and summaries for the agent API, exposed on /api/health.
+Cheap enough to call on every turn; reset on restart.
+"""
+import logging
+from collections import Counter
+
+logger = logging.getLogger("onboarding-agent.metrics")
+
+_counters: Counter = Counter()
+_summaries: dict[str, dict] = {}
+_histograms: dict[str, dict] = {}
+
+
+def incr(name: str, value: float = 1) -> None:
+    _counters[name] += value
+
+
+def observe(name: str, value: float) -> None:
+    """Record one observation of `name` (count, sum, max)."""
+    s = _summaries.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+    s["count"] += 1
+    s["sum"] += value
+    s["max"] = max(s["max"], value)
+
+
+def histogram(name: str, value: float, bounds: tuple[float, ...]) -> None:
+    """Count `value` into the first bucket whose upper bound it doesn't exceed (or the overflow)."""
+    h = _histograms.setdefault(name, {"bounds": bounds, "counts": [0] * (len(bounds) + 1)})
+    for i, bound in enumerate(bounds):
+        if value <= bound:
+            h["counts"][i] += 1
+            break
+    else:
+        h["counts"][-1] += 1
+    observe(name, value)
+
+
+def record_prompt_usage(usage: dict | None) -> None:
+    """
+    Accumulate provider token usage from the CLI result so prompt-cache
+    effectiveness can be tracked: cached reads vs. uncached + cache writes.
+    """
+    if not usage:
+        return
+    incr("prompt.turns")
+    for key in ("input_tokens", "cache_creation_input_tokens", "cache_read_input_tokens", "output_tokens"):
+        incr(f"prompt.{key}", usage.get(key) or 0)
+    if usage.get("cache_read_input_tokens"):
+        incr("prompt.cache_hit_turns")
+
+
+def record_run_resources(stats: dict) -> None:
+    """Accumulate an agent run's resource accounting (see run_limits.RunMonitor.stop)."""
+    observe("agent.peak_rss_mb", stats.get("peak_rss_mb", 0))
+    observe("agent.cpu_seconds", stats.get("cpu_seconds", 0))
+    observe("agent.max_processes", stats.get("max_processes", 0))
+    if stats.get("killed"):
+        incr(f"agent.killed.{stats['killed']}")
+
+
+# Schema lookups the persona's schema digest should make unnecessary
+DISCOVERY_MARKERS = ("list_tables", "information_schema")
+
+
+def record_discovery_calls(tool_log: str) -> None:
+    """Count a run's schema-discovery tool calls (list_tables, information_schema queries)."""
+    observe("agent.discovery_calls", sum(tool_log.count(m) for m in DISCOVERY_MARKERS))
+
+
+def prompt_cache_stats() -> dict:
+    read = _counters["prompt.cache_read_input_tokens"]
+    written = _counters["prompt.cache_creation_input_tokens"]
+    uncached = _counters["prompt.input_tokens"]
+    total_input = read + written + uncached
+    turns = _counters["prompt.turns"]
+    return {
+        "turns": int(turns),
+        "cache_hit_turns": int(_counters["prompt.cache_hit_turns"]),
+        "input_tokens": int(uncached),
+        "cache_creation_input_tokens": int(written),
+        "cache_read_input_tokens": int(read),
+        "cached_token_ratio": round(read / total_input, 3) if total_input else 0.0,
+    }
+
+
+def snapshot() -> dict:
+    return {
+        "counters": {k: v for k, v in _counters.items() if not k.startswith("prompt.")},
+        "summaries": {
+            k: {**v, "avg": round(v["sum"] / v["count"], 3) if v["count"] else 0.0}
+            for k, v in _summaries.items()
+        },
+        "histograms": {
+            k: {
+                **{f"le_{b:g}": n for b, n in zip(h["bounds"], h["counts"])},
+                "overflow": h["counts"][-1],
+            }
+            for k, h in _histograms.items()
+        },
+        "prompt_cache": prompt_cache_stats(),
+    }
@@ -0,0 +1,74 @@
+"""
+On-demand sampling profiler for the live process.
+
+While a profile runs, a background thread reads thread stacks with
+sys._current_frames() every PROFILE_INTERVAL seconds. By default it samples
+only the event-loop thread; it can sample all threads. The result is in the
+collapsed ("folded") format: one `thread;outer;...;inner count` line per
+distinct stack. flamegraph.pl, inferno and speedscope all read this format
+directly.
+
+Nothing runs between profiles, and only one profile runs at a time. The
+profiled code is never instrumented, so overhead is limited to the sampling
+thread, and only while a profile is running.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+from collections import Counter
+from types import FrameType
+
+logger = logging.getLogger("onboarding-agent.profiler")
+
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+
+_running = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another is running."""
+
+
+async def profile(seconds: float, all_threads: bool = False) -> str:
+    """Sample for `seconds` (capped at PROFILE_MAX_SECONDS) and return folded stacks."""
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    try:
+        seconds = min(seconds, PROFILE_MAX_SECONDS)
+        only = None if all_threads else threading.get_ident()
+        logger.info(f"Profiling {'all threads' if all_threads else 'the event loop'} for {seconds:.1f}s")
+        stacks, samples = await asyncio.to_thread(_sample, seconds, only)
+    finally:
+        _running.release()
+    logger.info(f"Profile done: {samples} samples, {len(stacks)} distinct stacks")
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def _sample(seconds: float, only: int | None) -> tuple[Counter, int]:
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    stacks: Counter = Counter()
+    samples = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        for ident, frame in sys._current_frames().items():
+            if ident == me or (only is not None and ident != only):
+                continue
+            stacks[_fold(names.get(ident, f"thread-{ident}"), frame)] += 1
+        samples += 1
+        time.sleep(PROFILE_INTERVAL)
+    return stacks, samples
+
+
+def _fold(thread_name: str, frame: FrameType | None) -> str:
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    frames.append(thread_name)
+    return ";".join(reversed(frames))
@@ -0,0 +1,213 @@
+"""
+Resource limits and accounting for agent CLI runs.
+
+Every run is started in its own session (process group), so the CLI and all
+the tool and MCP children it spawns can be measured and killed together. While
+a run is active, a sampler walks /proc every RUN_SAMPLE_INTERVAL seconds. It
+records peak RSS summed over the group, CPU time and the peak number of live
+processes. If a run crosses AGENT_MEM_LIMIT_MB, AGENT_CPU_LIMIT_SECONDS or
+AGENT_PIDS_LIMIT, the sampler kills the whole group. A limit of 0 disables it.
+
+If AGENT_CGROUP_PARENT names a writable cgroup v2 directory, each run also
+gets a child cgroup with memory.max, pids.max and cpu.max (AGENT_CPU_QUOTA
+cores). The kernel then enforces the limits between samples, and the
+cgroup's own counters give exact peak memory and CPU time.
+"""
+import os
+import time
+import signal
+import asyncio
+import logging
+
+logger = logging.getLogger("onboarding-agent.run_limits")
+
+AGENT_MEM_LIMIT_MB = int(os.environ.get("AGENT_MEM_LIMIT_MB", "2048"))
+AGENT_CPU_LIMIT_SECONDS = float(os.environ.get("AGENT_CPU_LIMIT_SECONDS", "240"))
+AGENT_PIDS_LIMIT = int(os.environ.get("AGENT_PIDS_LIMIT", "64"))
+AGENT_CPU_QUOTA = float(os.environ.get("AGENT_CPU_QUOTA", "1"))
+AGENT_CGROUP_PARENT = os.environ.get("AGENT_CGROUP_PARENT", "")
+RUN_SAMPLE_INTERVAL = float(os.environ.get("RUN_SAMPLE_INTERVAL", "0.5"))
+
+_PROC = "/proc"
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class RunLimitExceeded(Exception):
+    """Raised when an agent run was killed for crossing a resource limit."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Agent run killed: {reason} limit exceeded")
+        self.reason = reason
+
+
+def spawn_kwargs() -> dict:
+    """Extra create_subprocess_exec arguments: run in a new session / process group."""
+    return {"start_new_session": True}
+
+
+def kill_group(process: asyncio.subprocess.Process) -> None:
+    """SIGKILL the process's whole group (it leads its own session), falling back to the process."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    except OSError:
+        if process.returncode is None:
+            process.kill()
+
+
+def _read_group(sid: int) -> dict[int, tuple[int, float]]:
+    """Return {pid: (rss_bytes, cpu_seconds)} for live processes in session `sid`."""
+    procs = {}
+    try:
+        entries = os.scandir(_PROC)
+    except OSError:
+        return procs
+    with entries:
+        for entry in entries:
+            if not entry.name.isdigit():
+                continue
+            try:
+                with open(f"{_PROC}/{entry.name}/stat", "rb") as f:
+                    raw = f.read().decode("ascii", errors="replace")
+            except OSError:
+                continue
+            # Fields after "(comm)": state ppid pgrp session ... utime(11) stime(12) ... rss(21)
+            fields = raw[raw.rfind(")") + 2:].split()
+            if len(fields) < 22 or int(fields[3]) != sid or fields[0] == "Z":
+                continue
+            cpu = (int(fields[11]) + int(fields[12])) / _CLK_TCK
+            procs[int(entry.name)] = (int(fields[21]) * _PAGE_SIZE, cpu)
+    return procs
+
+
+class RunMonitor:
+    """Measures one agent run's process group and enforces its limits."""
+
+    def __init__(self, process: asyncio.subprocess.Process, org_id: str = ""):
+        self.process = process
+        self.org_id = org_id
+        self.killed: str | None = None
+        self.peak_rss = 0
+        self.max_processes = 0
+        self._cpu_by_pid: dict[int, float] = {}
+        self._cgroup: str | None = None
+        self._task: asyncio.Task | None = None
+        self._started = time.time()
+
+    def start(self) -> None:
+        self._cgroup = _create_cgroup(self.process.pid)
+        if os.path.isdir(_PROC):
+            self._task = asyncio.create_task(self._sample_loop())
+
+    def kill(self, reason: str) -> None:
+        if self.killed is None:
+            self.killed = reason
+            logger.warning(f"Killing agent run for org {self.org_id} (pid {self.process.pid}): {reason} limit")
+        kill_group(self.process)
+
+    @property
+    def cpu_seconds(self) -> float:
+        return sum(self._cpu_by_pid.values())
+
+    async def _sample_loop(self) -> None:
+        while self.process.returncode is None:
+            procs = await asyncio.to_thread(_read_group, self.process.pid)
+            self._observe(procs)
+            if AGENT_MEM_LIMIT_MB and self.peak_rss > AGENT_MEM_LIMIT_MB * 1024 * 1024:
+                self.kill("memory")
+            elif AGENT_CPU_LIMIT_SECONDS and self.cpu_seconds > AGENT_CPU_LIMIT_SECONDS:
+                self.kill("cpu")
+            elif AGENT_PIDS_LIMIT and len(procs) > AGENT_PIDS_LIMIT:
+                self.kill("pids")
+            await asyncio.sleep(RUN_SAMPLE_INTERVAL)
+
+    def _observe(self, procs: dict[int, tuple[int, float]]) -> None:
+        self.peak_rss = max(self.peak_rss, sum(rss for rss, _ in procs.values()))
+        self.max_processes = max(self.max_processes, len(procs))
+        # Keep the last CPU reading of processes that have since exited
+        for pid, (_, cpu) in procs.items():
+            self._cpu_by_pid[pid] = cpu
+
+    async def stop(self) -> dict:
+        """Stop sampling, reap the group and return the run's resource stats."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self.process.returncode is None:
+            kill_group(self.process)
+            try:
+                await asyncio.wait_for(self.process.wait(), 5)
+            except asyncio.TimeoutError:
+                logger.error(f"Agent run pid {self.process.pid} did not exit after SIGKILL")
+        else:
+            # Tool children left behind by a finished CLI
+            kill_group(self.process)
+
+        stats = {
+            "peak_rss_mb": round(self.peak_rss / (1024 * 1024), 1),
+            "cpu_seconds": round(self.cpu_seconds, 2),
+            "max_processes": self.max_processes,
+            "wall_seconds": round(time.time() - self._started, 2),
+            "killed": self.killed,
+        }
+        if self._cgroup:
+            stats.update(_close_cgroup(self._cgroup, stats))
+            if stats.get("oom_killed") and not self.killed:
+                self.killed = stats["killed"] = "memory"
+        return stats
+
+
+def _write(path: str, value: str) -> None:
+    with open(path, "w") as f:
+        f.write(value)
+
+
+def _create_cgroup(pid: int) -> str | None:
+    """Place `pid` in a fresh child cgroup with the configured limits; None if unavailable."""
+    if not AGENT_CGROUP_PARENT:
+        return None
+    path = os.path.join(AGENT_CGROUP_PARENT, f"run-{pid}")
+    try:
+        os.makedirs(path, exist_ok=True)
+        if AGENT_MEM_LIMIT_MB:
+            _write(f"{path}/memory.max", str(AGENT_MEM_LIMIT_MB * 1024 * 1024))
+        if AGENT_PIDS_LIMIT:
+            _write(f"{path}/pids.max", str(AGENT_PIDS_LIMIT))
+        if AGENT_CPU_QUOTA:
+            _write(f"{path}/cpu.max", f"{int(AGENT_CPU_QUOTA * 100000)} 100000")
+        _write(f"{path}/cgroup.procs", str(pid))
+        return path
+    except OSError:
+        logger.warning(f"Could not set up cgroup {path} — relying on sampled limits")
+        return None
+
+
+def _close_cgroup(path: str, sampled: dict) -> dict:
+    """Read the cgroup's exact counters and remove it."""
+    out: dict = {}
+    try:
+        with open(f"{path}/memory.peak") as f:
+            out["peak_rss_mb"] = max(sampled["peak_rss_mb"], round(int(f.read()) / (1024 * 1024), 1))
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(f"{path}/cpu.stat") as f:
+            for line in f:
+                key, _, value = line.partition(" ")
+                if key == "usage_usec":
+                    out["cpu_seconds"] = round(int(value) / 1_000_000, 2)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(f"{path}/memory.events") as f:
+            events = dict(line.split() for line in f if line.strip())
+        out["oom_killed"] = int(events.get("oom_kill", 0)) > 0
+    except (OSError, ValueError):
+        pass
+    try:
+        os.rmdir(path)
+    except OSError:
+        logger.warning(f"Could not remove cgroup {path}")
+    return out
@@ -0,0 +1,48 @@
+"""
+Compact schema digest attached to the agent persona.
+
+Agents used to spend their first tool calls rediscovering table and column
+names with list_tables and information_schema queries. The digest gives
+them the schema up front instead. It is built by scripts/parse_schema.py
+(mounted at SCHEMA_DIGEST_SCRIPT) from the schema export (mounted at
+SCHEMA_EXPORT_PATH). The result is cached until either file changes, so a
+new export is picked up without a restart. If either file is missing the
+digest is empty and the persona is sent as before.
+"""
+import os
+import logging
+import importlib.util
+
+logger = logging.getLogger("onboarding-agent.schema_digest")
+
+SCHEMA_EXPORT_PATH = os.environ.get("SCHEMA_EXPORT_PATH", "/opt/peptide-agent/schema.sql")
+SCHEMA_DIGEST_SCRIPT = os.environ.get("SCHEMA_DIGEST_SCRIPT", "/opt/peptide-agent/parse_schema.py")
+
+_cache: tuple[tuple[float, float], str] | None = None  # ((export mtime, script mtime), digest)
+
+
+def get() -> str:
+    """The current digest, rebuilt only when the export or the generator changes."""
+    global _cache
+    try:
+        key = (os.path.getmtime(SCHEMA_EXPORT_PATH), os.path.getmtime(SCHEMA_DIGEST_SCRIPT))
+    except OSError:
+        return ""
+    if _cache is not None and _cache[0] == key:
+        return _cache[1]
+
+    try:
+        digest = _load_generator().build_digest(SCHEMA_EXPORT_PATH)
+        logger.info(f"Schema digest rebuilt from {SCHEMA_EXPORT_PATH} ({len(digest)} chars)")
+    except Exception:
+        logger.exception("Failed to build the schema digest — keeping the previous one")
+        digest = _cache[1] if _cache else ""
+    _cache = (key, digest)
+    return digest
+
+
+def _load_generator():
+    spec = importlib.util.spec_from_file_location("parse_schema", SCHEMA_DIGEST_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
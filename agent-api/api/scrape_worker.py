@@ -0,0 +1,166 @@
+"""
+Background website scrapes, kept off the chat request path.
+
+An org is queued when its tenant_config.website_url is set or changes — on
+first sight only if it has no products and nothing scraped yet. Orgs are
+noticed from the state snapshot the request path already loads (no extra
+queries), and a periodic sweep re-checks recently seen orgs so a URL the
+agent saved mid-turn is picked up without waiting for the next message.
+Workers call scrape-brand, which persists brand data and scraped_peptides
+itself; the result is handed back through `on_result` for the next turn.
+
+scrape-brand authenticates as the merchant, so a job carries the access
+token of the request that noticed it; the sweep only revisits orgs whose
+token has not expired.
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+try:
+    from api.auth import token_expiry
+except ImportError:
+    from auth import token_expiry
+
+logger = logging.getLogger("onboarding-agent.scrape_worker")
+
+SCRAPE_WORKERS = int(os.environ.get("SCRAPE_WORKERS", "2"))
+SCRAPE_QUEUE_MAX = int(os.environ.get("SCRAPE_QUEUE_MAX", "100"))
+SCRAPE_SWEEP_INTERVAL = float(os.environ.get("SCRAPE_SWEEP_INTERVAL", "300"))
+
+
+@dataclass
+class ScrapeJob:
+    org_id: str
+    url: str
+    access_token: str
+    queued_at: float
+
+
+ScrapeFn = Callable[[str, str], Awaitable[dict | None]]
+ResultFn = Callable[[str, dict], None]
+SnapshotFn = Callable[[str], Awaitable[dict]]
+
+_queue: asyncio.Queue | None = None
+_tasks: list[asyncio.Task] = []
+_pending: dict[str, str] = {}                  # org_id -> "queued" | "running"
+_known_urls: dict[str, str] = {}               # org_id -> website_url already scraped (or not needed)
+_tokens: dict[str, tuple[str, float]] = {}     # org_id -> (access_token, expires_at) for the sweep
+_stats: Counter = Counter()
+
+
+def start(scrape: ScrapeFn, on_result: ResultFn, get_snapshot: SnapshotFn) -> None:
+    """Start the scrape workers and the periodic sweep (call from the app lifespan)."""
+    global _queue
+    if _tasks:
+        return
+    _queue = asyncio.Queue(maxsize=SCRAPE_QUEUE_MAX)
+    for i in range(SCRAPE_WORKERS):
+        _tasks.append(asyncio.create_task(_worker(i, scrape, on_result)))
+    if SCRAPE_SWEEP_INTERVAL > 0:
+        _tasks.append(asyncio.create_task(_sweep(get_snapshot)))
+    logger.info(f"Scrape worker started ({SCRAPE_WORKERS} workers, sweep every {SCRAPE_SWEEP_INTERVAL:.0f}s)")
+
+
+async def stop() -> None:
+    global _queue
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    _pending.clear()
+    _queue = None
+
+
+def notice(org_id: str, snapshot: dict, access_token: str) -> bool:
+    """
+    Queue a background scrape if the snapshot shows a website URL that is
+    new or changed for this org. Never blocks; returns True if queued.
+    """
+    if access_token:
+        expires_at = token_expiry(access_token) or time.time() + 3600
+        _tokens[org_id] = (access_token, expires_at)
+
+    website = (snapshot.get("config") or {}).get("website_url")
+    if not website or _queue is None or org_id in _pending:
+        return False
+    known = _known_urls.get(org_id)
+    if known == website:
+        return False
+    if known is None and (snapshot.get("products") or snapshot.get("scraped", {}).get("total", 1)):
+        # Catalog or scrape data predates this process — nothing to do until the URL changes
+        _known_urls[org_id] = website
+        return False
+    return enqueue(org_id, website, access_token)
+
+
+def enqueue(org_id: str, url: str, access_token: str) -> bool:
+    """Queue a scrape of `url` for the org (e.g. one a request had no time left for)."""
+    if not access_token or _queue is None or org_id in _pending:
+        return False
+    try:
+        _queue.put_nowait(ScrapeJob(org_id, url, access_token, time.time()))
+    except asyncio.QueueFull:
+        _stats["dropped"] += 1
+        logger.warning(f"Scrape queue full — not queueing {url} for org {org_id}")
+        return False
+    _pending[org_id] = "queued"
+    _stats["queued"] += 1
+    logger.info(f"Queued background scrape of {url} for org {org_id}")
+    return True
+
+
+def status(org_id: str) -> str | None:
+    """'queued' or 'running' while the org has a background scrape in flight, else None."""
+    return _pending.get(org_id)
+
+
+def stats() -> dict:
+    return {
+        **{k: _stats[k] for k in ("queued", "succeeded", "failed", "dropped")},
+        "in_flight": len(_pending),
+        "queue_depth": _queue.qsize() if _queue else 0,
+    }
+
+
+async def _worker(n: int, scrape: ScrapeFn, on_result: ResultFn) -> None:
+    while True:
+        job = await _queue.get()
+        _pending[job.org_id] = "running"
+        try:
+            logger.info(f"[scrape-{n}] Scraping {job.url} for org {job.org_id}")
+            result = await scrape(job.url, job.access_token)
+            # Record the URL either way so a failing site isn't retried on every message
+            _known_urls[job.org_id] = job.url
+            if result:
+                _stats["succeeded"] += 1
+                on_result(job.org_id, result)
+            else:
+                _stats["failed"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            _stats["failed"] += 1
+            logger.exception(f"Background scrape failed for org {job.org_id}")
+        finally:
+            _pending.pop(job.org_id, None)
+            _queue.task_done()
+
+
+async def _sweep(get_snapshot: SnapshotFn) -> None:
+    """Re-check orgs seen with a still-valid token for a new or changed website URL."""
+    while True:
+        await asyncio.sleep(SCRAPE_SWEEP_INTERVAL)
+        now = time.time()
+        for org_id, (token, expires_at) in list(_tokens.items()):
+            if expires_at <= now:
+                _tokens.pop(org_id, None)
+                continue
+            try:
+                notice(org_id, await get_snapshot(org_id), token)
+            except Exception:
+                logger.warning(f"Scrape sweep failed for org {org_id} — continuing")
@@ -0,0 +1,111 @@
+"""
+Per-org Claude CLI session persistence.
+
+The first agent turn for an org starts a fresh CLI session with the full
+context prompt; later turns resume that session with --resume and send only
+what changed (new messages, a diff of the org state block, the new message).
+A session is rotated when it has run too many turns, accumulated too much
+prompt text, gone stale, or the persona (CLAUDE.md) has changed.
+
+Sessions are kept in memory and written through to the agent_sessions table
+so a restart can pick them up. Persistence failures never break a turn.
+"""
+import os
+import time
+import difflib
+import hashlib
+import logging
+from dataclasses import dataclass, asdict
+
+from supabase import Client
+
+logger = logging.getLogger("onboarding-agent.sessions")
+
+SESSION_MAX_TURNS = int(os.environ.get("SESSION_MAX_TURNS", "20"))
+SESSION_MAX_PROMPT_CHARS = int(os.environ.get("SESSION_MAX_PROMPT_CHARS", "200000"))
+SESSION_MAX_AGE_SECONDS = int(os.environ.get("SESSION_MAX_AGE_SECONDS", str(24 * 3600)))
+
+
+@dataclass
+class AgentSession:
+    org_id: str
+    session_id: str
+    persona_hash: str
+    turns: int
+    prompt_chars: int
+    state_block: str
+    last_message_at: str
+    started_at: float
+
+
+_sessions: dict[str, AgentSession] = {}
+
+
+def persona_hash(persona: str) -> str:
+    return hashlib.sha256(persona.encode("utf-8")).hexdigest()[:16]
+
+
+def load(sb: Client, org_id: str) -> AgentSession | None:
+    """Return the org's stored session, from memory or the agent_sessions table."""
+    if org_id in _sessions:
+        return _sessions[org_id]
+    try:
+        result = sb.table("agent_sessions").select("*").eq("org_id", org_id).limit(1).execute()
+    except Exception:
+        logger.warning("Failed to load agent session — starting fresh")
+        return None
+    if not result.data:
+        return None
+    row = result.data[0]
+    session = AgentSession(
+        org_id=org_id,
+        session_id=row["session_id"],
+        persona_hash=row.get("persona_hash") or "",
+        turns=row.get("turns") or 0,
+        prompt_chars=row.get("prompt_chars") or 0,
+        state_block=row.get("state_block") or "",
+        last_message_at=row.get("last_message_at") or "",
+        started_at=float(row.get("started_at") or 0),
+    )
+    _sessions[org_id] = session
+    return session
+
+
+def save(sb: Client, session: AgentSession) -> None:
+    _sessions[session.org_id] = session
+    try:
+        sb.table("agent_sessions").upsert(asdict(session), on_conflict="org_id").execute()
+    except Exception:
+        logger.warning("Failed to persist agent session — continuing")
+
+
+def clear(sb: Client, org_id: str) -> None:
+    _sessions.pop(org_id, None)
+    try:
+        sb.table("agent_sessions").delete().eq("org_id", org_id).execute()
+    except Exception:
+        logger.warning("Failed to clear agent session — continuing")
+
+
+def rotation_reason(session: AgentSession | None, current_persona_hash: str) -> str | None:
+    """Return why `session` can't be resumed, or None if it can."""
+    if session is None:
+        return "none"
+    if session.persona_hash != current_persona_hash:
+        return "persona_changed"
+    if session.turns >= SESSION_MAX_TURNS:
+        return "max_turns"
+    if session.prompt_chars >= SESSION_MAX_PROMPT_CHARS:
+        return "max_size"
+    if time.time() - session.started_at >= SESSION_MAX_AGE_SECONDS:
+        return "expired"
+    return None
+
+
+def state_diff(old: str, new: str) -> str:
+    """Line diff between two org state blocks, as +/- lines. Empty if unchanged."""
+    changes = [
+        line for line in difflib.ndiff(old.splitlines(), new.splitlines())
+        if line.startswith(("+ ", "- "))
+    ]
+    return "\n".join(changes)
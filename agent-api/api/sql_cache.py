@@ -0,0 +1,405 @@
+"""
+Read-through cache for the agent's read-only execute_sql calls.
+
+Within one onboarding session an agent re-runs the same lookups many times
+(the pending scraped_peptides query from the playbook, catalog counts, the
+tenant_config row). When the MCP pool is active, the per-run config points
+the Supabase server at this proxy instead of straight at its gateway. The
+proxy relays the MCP SSE transport unchanged and only inspects
+tools/call requests for execute_sql:
+
+- A read-only SELECT is keyed by (org, normalized SQL). A repeat within
+  SQL_CACHE_TTL is answered from memory and never reaches Postgres.
+- Any write invalidates the org's entries. The org comes from the
+  set_config('app.agent_org_id', ...) prelude the agent must put on every
+  write, and from the run's X-Agent-Org-Id header. Entries are invalidated
+  again when the write's response arrives, and a read that was in flight
+  across a write is not stored.
+- Anything else (volatile functions, statements that aren't SELECT) passes
+  through uncached. A SELECT that calls an unknown function is treated as a
+  write, since it may be an RPC that changes data.
+
+Writes made outside the agent's SQL tool (imports, scrapes, uploads) also
+invalidate through dispatch.invalidate_org_snapshot, and so does a run whose
+SQL bypassed the proxy (no free pool slot). The end of a turn does not, so
+reads carry over between the turns of a session. Writes made by the
+merchant's own UI are only covered by the TTL.
+
+The proxy is served by the API itself on /mcp/<server>/. The routes only
+accept requests carrying this process's proxy token, which is sent only in
+the generated run configs.
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+import secrets
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import AsyncIterator
+from urllib.parse import urljoin, urlsplit, parse_qs
+
+import httpx
+
+logger = logging.getLogger("onboarding-agent.sql_cache")
+
+SQL_CACHE_ENABLED = os.environ.get("SQL_CACHE_ENABLED", "1") == "1"
+SQL_CACHE_SERVERS = {s.strip() for s in os.environ.get("SQL_CACHE_SERVERS", "supabase").split(",") if s.strip()}
+SQL_CACHE_TOOL = os.environ.get("SQL_CACHE_TOOL", "execute_sql")
+SQL_CACHE_TTL = float(os.environ.get("SQL_CACHE_TTL", "300"))
+SQL_CACHE_MAX_ENTRIES = int(os.environ.get("SQL_CACHE_MAX_ENTRIES", "2000"))
+SQL_CACHE_MAX_RESULT_BYTES = int(os.environ.get("SQL_CACHE_MAX_RESULT_BYTES", "262144"))
+SQL_CACHE_PROXY_BASE = os.environ.get("SQL_CACHE_PROXY_BASE", "http://127.0.0.1:3500")
+
+TOKEN_HEADER = "X-MCP-Proxy-Token"
+_token = secrets.token_urlsafe(24)
+
+# --- Statement classification -------------------------------------------------
+
+_LEXEME = re.compile(
+    r"(?P<literal>'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")"
+    r"|(?P<comment>--[^\n]*|/\*.*?\*/)"
+    r"|(?P<space>\s+)"
+    r"|(?P<code>[^'\"\s/-]+|.)",
+    re.S,
+)
+_CALL = re.compile(r"([a-z_][a-z0-9_$.]*)\s*\(")
+_WORD = re.compile(r"[a-z_][a-z0-9_$]*")
+_ORG_PRELUDE = re.compile(r"set_config\s*\(\s*'app\.agent_org_id'\s*,\s*'([^']+)'", re.I)
+
+WRITE_KEYWORDS = frozenset({
+    "insert", "update", "delete", "merge", "truncate", "alter", "create", "drop", "grant",
+    "revoke", "copy", "call", "do", "vacuum", "reindex", "refresh", "set", "reset",
+})
+VOLATILE = frozenset({
+    "now", "random", "clock_timestamp", "statement_timestamp", "transaction_timestamp",
+    "timeofday", "gen_random_uuid", "uuid_generate_v4", "current_date", "current_time",
+    "current_timestamp", "localtime", "localtimestamp",
+})
+# Words that may be followed by "(" without being a function call
+_SYNTAX = frozenset({
+    "select", "from", "where", "and", "or", "not", "in", "exists", "any", "all", "some", "as",
+    "join", "on", "using", "lateral", "values", "over", "filter", "within", "partition", "by",
+    "group", "order", "having", "with", "recursive", "materialized", "union", "intersect",
+    "except", "is", "between", "like", "ilike", "similar", "to", "array", "row", "distinct",
+    "case", "when", "then", "else", "limit", "offset", "table",
+})
+# Functions (and parameterised types) that only read
+READ_FUNCTIONS = frozenset({
+    "count", "sum", "avg", "min", "max", "bool_and", "bool_or", "every", "array_agg",
+    "string_agg", "json_agg", "jsonb_agg", "json_object_agg", "jsonb_object_agg",
+    "coalesce", "nullif", "greatest", "least", "cast", "extract", "date_trunc", "date_part",
+    "to_char", "to_date", "to_number", "age", "lower", "upper", "initcap", "trim", "btrim",
+    "ltrim", "rtrim", "length", "char_length", "substring", "substr", "position", "strpos",
+    "replace", "split_part", "concat", "concat_ws", "left", "right", "lpad", "rpad", "format",
+    "regexp_replace", "regexp_match", "regexp_matches", "round", "ceil", "floor", "abs", "trunc",
+    "row_number", "rank", "dense_rank", "lag", "lead", "first_value", "last_value",
+    "json_build_object", "jsonb_build_object", "json_build_array", "jsonb_build_array",
+    "to_json", "to_jsonb", "row_to_json", "jsonb_array_length", "json_array_length",
+    "jsonb_array_elements", "jsonb_array_elements_text", "jsonb_each", "jsonb_each_text",
+    "jsonb_object_keys", "jsonb_typeof", "jsonb_extract_path_text", "unnest",
+    "array_length", "cardinality", "array_to_string", "string_to_array",
+    "numeric", "decimal", "varchar", "char", "interval",
+})
+
+
+def normalize(sql: str) -> tuple[str, str]:
+    """
+    Return (key text, code text) for a statement. The key text drops comments,
+    collapses whitespace and lowercases everything outside quotes. The code
+    text is the same with quoted text emptied, for classification.
+    """
+    key, code = [], []
+    for m in _LEXEME.finditer(sql):
+        kind = m.lastgroup
+        if kind == "literal":
+            key.append(m.group())
+            code.append("''")
+        elif kind in ("comment", "space"):
+            key.append(" ")
+            code.append(" ")
+        else:
+            key.append(m.group().lower())
+            code.append(m.group().lower())
+    key_text = re.sub(r" +", " ", "".join(key)).strip().rstrip(";").strip()
+    return key_text, " ".join("".join(code).split())
+
+
+def classify(sql: str) -> tuple[str, str]:
+    """Return ("read" | "write" | "uncacheable", normalized key text)."""
+    key_text, code = normalize(sql)
+    words = set(_WORD.findall(code))
+    if words & WRITE_KEYWORDS or "$" in code:
+        return "write", key_text
+    calls = {name.rsplit(".", 1)[-1] for name in _CALL.findall(code)} - _SYNTAX
+    if calls - READ_FUNCTIONS - VOLATILE:
+        return "write", key_text  # e.g. an RPC like import_scraped_peptides(...)
+    statements = [s.strip() for s in code.split(";") if s.strip()]
+    if not statements or (words | calls) & VOLATILE:
+        return "uncacheable", key_text
+    if not all(s.startswith(("select", "with")) for s in statements):
+        return "uncacheable", key_text
+    return "read", key_text
+
+
+def write_orgs(sql: str, run_org: str) -> set[str]:
+    """The orgs a write may have touched: those named in its set_config prelude, plus the run's."""
+    return {o for o in (*_ORG_PRELUDE.findall(sql), run_org) if o}
+
+
+# --- Cache --------------------------------------------------------------------
+
+_entries: OrderedDict[tuple[str, str], tuple[float, dict]] = OrderedDict()  # (org, sql) -> (stored at, result)
+_generations: Counter = Counter()   # org -> write count, to drop reads that were in flight across a write
+_stats: Counter = Counter()
+
+
+def lookup(org_id: str, key_text: str) -> dict | None:
+    entry = _entries.get((org_id, key_text))
+    if entry is None:
+        return None
+    if time.monotonic() - entry[0] > SQL_CACHE_TTL:
+        del _entries[(org_id, key_text)]
+        return None
+    _entries.move_to_end((org_id, key_text))
+    return entry[1]
+
+
+def store(org_id: str, key_text: str, result: dict) -> None:
+    _entries[(org_id, key_text)] = (time.monotonic(), result)
+    _entries.move_to_end((org_id, key_text))
+    while len(_entries) > SQL_CACHE_MAX_ENTRIES:
+        _entries.popitem(last=False)
+        _stats["evictions"] += 1
+
+
+def invalidate_org(org_id: str) -> None:
+    """Drop every cached result for the org (after anything that may have changed its data)."""
+    _generations[org_id] += 1
+    stale = [k for k in _entries if k[0] == org_id]
+    for k in stale:
+        del _entries[k]
+    if stale:
+        _stats["invalidated_entries"] += len(stale)
+
+
+def stats() -> dict:
+    hits, misses = _stats["hits"], _stats["misses"]
+    return {
+        "enabled": SQL_CACHE_ENABLED,
+        "entries": len(_entries),
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+        **{k: _stats[k] for k in ("uncacheable", "writes", "invalidated_entries", "evictions", "oversized")},
+        "sessions": len(_sessions),
+    }
+
+
+# --- MCP SSE proxy ------------------------------------------------------------
+
+@dataclass
+class _Session:
+    org_id: str
+    upstream_post_url: str
+    outbox: asyncio.Queue
+    # JSON-RPC id -> ("read", key text, org generation) | ("write", orgs)
+    pending: dict = field(default_factory=dict)
+    hits: int = 0
+    lookups: int = 0
+
+
+_sessions: dict[str, _Session] = {}
+_client: httpx.AsyncClient | None = None
+_serving = False
+
+
+def start() -> None:
+    """Route runs through the proxy; only the API process serves it (call from its lifespan)."""
+    global _serving
+    _serving = True
+
+
+def proxied(name: str) -> bool:
+    return SQL_CACHE_ENABLED and _serving and name in SQL_CACHE_SERVERS
+
+
+def run_config_entry(name: str, org_id: str, slot: int) -> dict:
+    """The MCP config entry pointing a run at this proxy for server `name` in its pool slot."""
+    return {
+        "type": "sse",
+        "url": f"{SQL_CACHE_PROXY_BASE}/mcp/{name}/sse?slot={slot}",
+        "headers": {"X-Agent-Org-Id": org_id, TOKEN_HEADER: _token},
+    }
+
+
+def authorized(headers) -> bool:
+    return secrets.compare_digest(headers.get(TOKEN_HEADER, ""), _token)
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=None))
+    return _client
+
+
+async def close() -> None:
+    global _client, _serving
+    _serving = False
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def open_stream(name: str, upstream_url: str, org_id: str) -> AsyncIterator[bytes]:
+    """
+    Connect to the server's gateway and return the SSE stream to relay to the
+    agent. Raises httpx errors if the gateway can't be reached.
+    """
+    client = _get_client()
+    response = await client.send(
+        client.build_request("GET", upstream_url, headers={"Accept": "text/event-stream", "X-Agent-Org-Id": org_id}),
+        stream=True,
+    )
+    if response.status_code != 200:
+        await response.aclose()
+        raise httpx.HTTPStatusError(f"Gateway returned {response.status_code}", request=response.request, response=response)
+    return _relay(name, upstream_url, org_id, response)
+
+
+async def _relay(name: str, upstream_url: str, org_id: str, response: httpx.Response) -> AsyncIterator[bytes]:
+    outbox: asyncio.Queue = asyncio.Queue()
+    session_ids: list[str] = []
+
+    async def pump() -> None:
+        lines: list[str] = []
+        try:
+            async for line in response.aiter_lines():
+                if line:
+                    lines.append(line)
+                    continue
+                if lines:
+                    await outbox.put(_on_event(name, upstream_url, org_id, lines, outbox, session_ids))
+                lines = []
+        except httpx.HTTPError as e:
+            logger.warning(f"SQL cache proxy: {name} stream ended: {e}")
+        finally:
+            await outbox.put(None)
+
+    reader = asyncio.create_task(pump())
+    try:
+        while (frame := await outbox.get()) is not None:
+            yield frame
+    finally:
+        reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+        await response.aclose()
+        for sid in session_ids:
+            session = _sessions.pop(sid, None)
+            if session and session.lookups:
+                logger.info(
+                    f"SQL cache: org {session.org_id} session served {session.hits}/{session.lookups} "
+                    f"reads from cache"
+                )
+
+
+def _on_event(
+    name: str, upstream_url: str, org_id: str, lines: list[str], outbox: asyncio.Queue, session_ids: list[str],
+) -> bytes:
+    """Inspect one upstream SSE event and return the frame to pass on."""
+    event = next((l[6:].strip() for l in lines if l.startswith("event:")), "message")
+    data = "\n".join(l[5:].lstrip() for l in lines if l.startswith("data:"))
+
+    if event == "endpoint":
+        # Point the agent's POSTs at the proxy, keeping the gateway's session id
+        query = urlsplit(data).query
+        sid = (parse_qs(query).get("sessionId") or [""])[0]
+        _sessions[sid] = _Session(org_id, urljoin(upstream_url, data), outbox)
+        session_ids.append(sid)
+        return f"event: endpoint\ndata: /mcp/{name}/message?{query}\n\n".encode()
+
+    session = _sessions.get(session_ids[-1]) if session_ids else None
+    if session and event == "message" and session.pending:
+        try:
+            _on_response(session, json.loads(data))
+        except ValueError:
+            pass
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+def _on_response(session: _Session, message) -> None:
+    if not isinstance(message, dict) or "id" not in message:
+        return
+    pending = session.pending.pop(message["id"], None)
+    if pending is None:
+        return
+    if pending[0] == "write":
+        for org in pending[1]:
+            invalidate_org(org)
+        return
+    _, key_text, generation = pending
+    result = message.get("result")
+    if not isinstance(result, dict) or result.get("isError") or _generations[session.org_id] != generation:
+        return
+    if len(json.dumps(result)) > SQL_CACHE_MAX_RESULT_BYTES:
+        _stats["oversized"] += 1
+        return
+    store(session.org_id, key_text, result)
+
+
+async def post_message(session_id: str, body: bytes, content_type: str) -> tuple[int, bytes, str]:
+    """
+    Handle one JSON-RPC message the agent posted. Cache hits are answered on
+    the session's SSE stream; everything else is forwarded to the gateway.
+    Returns (status, body, content type) for the agent's POST.
+    """
+    session = _sessions.get(session_id)
+    if session is None:
+        return 404, b"Unknown session", "text/plain"
+
+    try:
+        message = json.loads(body)
+    except ValueError:
+        message = None
+    if isinstance(message, dict) and message.get("method") == "tools/call":
+        params = message.get("params") or {}
+        query = (params.get("arguments") or {}).get("query")
+        if params.get("name") == SQL_CACHE_TOOL and isinstance(query, str) and "id" in message:
+            result = _on_sql_call(session, message["id"], query)
+            if result is not None:
+                reply = {"jsonrpc": "2.0", "id": message["id"], "result": result}
+                await session.outbox.put(f"event: message\ndata: {json.dumps(reply)}\n\n".encode())
+                return 202, b"Accepted", "text/plain"
+
+    response = await _get_client().post(
+        session.upstream_post_url, content=body, headers={"Content-Type": content_type or "application/json"},
+    )
+    return response.status_code, response.content, response.headers.get("content-type", "text/plain")
+
+
+def _on_sql_call(session: _Session, rpc_id, query: str) -> dict | None:
+    """Record an execute_sql call; return the cached result if it can be answered from memory."""
+    kind, key_text = classify(query)
+    if kind == "write":
+        orgs = write_orgs(query, session.org_id)
+        for org in orgs:
+            invalidate_org(org)
+        session.pending[rpc_id] = ("write", orgs)
+        _stats["writes"] += 1
+        return None
+    if kind == "uncacheable" or not session.org_id:
+        _stats["uncacheable"] += 1
+        return None
+
+    session.lookups += 1
+    cached = lookup(session.org_id, key_text)
+    if cached is not None:
+        session.hits += 1
+        _stats["hits"] += 1
+        return cached
+    _stats["misses"] += 1
+    session.pending[rpc_id] = ("read", key_text, _generations[session.org_id])
+    return None
@@ -0,0 +1,381 @@
+"""
+Server-side ingestion of files the merchant uploads in the onboarding chat.
+
+Attachments are downloaded concurrently (only from our Supabase Storage),
+spooled to bounded temp files and stream-parsed (CSV, XLSX, JSON). Files
+whose columns look like a contact list or a product list are bulk-inserted
+into `contacts` / `peptides` in multi-row batches, de-duplicated against
+what the org already has (peptides by name, contacts by email or phone). The agent gets a compact summary — row counts,
+detected columns, a few sample rows — instead of raw files to download.
+"""
+import os
+import io
+import csv
+import json
+import asyncio
+import logging
+import tempfile
+from typing import Iterator
+
+import httpx
+from supabase import Client
+
+logger = logging.getLogger("onboarding-agent.uploads")
+
+SUPABASE_URL = os.environ["SUPABASE_URL"]
+MAX_ATTACHMENT_BYTES = int(os.environ.get("MAX_ATTACHMENT_BYTES", str(10 * 1024 * 1024)))
+ATTACHMENT_CONCURRENCY = int(os.environ.get("ATTACHMENT_CONCURRENCY", "4"))
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "500"))
+SAMPLE_ROWS = 3
+# Keep small files in memory, spill larger ones to disk
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+CONTACT_COLUMNS = {
+    "name": ("name", "full name", "customer", "customer name", "contact", "contact name", "client"),
+    "first_name": ("first name", "firstname", "first", "given name"),
+    "last_name": ("last name", "lastname", "last", "surname", "family name"),
+    "email": ("email", "e-mail", "email address", "customer email"),
+    "phone": ("phone", "phone number", "mobile", "cell", "telephone"),
+    "company": ("company", "business", "organization", "organisation"),
+    "address": ("address", "street address", "shipping address", "billing address"),
+    "notes": ("notes", "note", "comments"),
+}
+PEPTIDE_COLUMNS = {
+    "name": ("name", "product", "product name", "peptide", "item", "item name", "title"),
+    "retail_price": ("price", "retail price", "regular price", "sale price", "msrp", "retail"),
+    "sku": ("sku", "product code", "item code"),
+    "description": ("description", "short description", "details"),
+    "base_cost": ("cost", "unit cost", "base cost", "cost price"),
+}
+
+
+class AttachmentError(Exception):
+    """Raised when an attachment can't be downloaded or parsed."""
+    pass
+
+
+def _normalize_header(header) -> str:
+    return " ".join(str(header or "").strip().lower().replace("_", " ").split())
+
+
+def _map_columns(headers: list[str], spec: dict[str, tuple[str, ...]]) -> dict[str, int]:
+    """Map target fields to column indexes using the alias table `spec`."""
+    normalized = [_normalize_header(h) for h in headers]
+    mapping = {}
+    for field, aliases in spec.items():
+        for i, h in enumerate(normalized):
+            if h in aliases:
+                mapping[field] = i
+                break
+    return mapping
+
+
+def detect_schema(headers: list[str]) -> tuple[str | None, dict[str, int]]:
+    """Return ("contacts" | "peptides" | None, column mapping) for a header row."""
+    contacts = _map_columns(headers, CONTACT_COLUMNS)
+    has_name = "name" in contacts or "first_name" in contacts
+    if has_name and ("email" in contacts or "phone" in contacts):
+        return "contacts", contacts
+    peptides = _map_columns(headers, PEPTIDE_COLUMNS)
+    if "name" in peptides and "retail_price" in peptides:
+        return "peptides", peptides
+    return None, {}
+
+
+# ── Download ──
+
+def _is_own_storage_url(url: str) -> bool:
+    return url.startswith(f"{SUPABASE_URL}/storage/v1/")
+
+
+async def _download(client: httpx.AsyncClient, url: str) -> tempfile.SpooledTemporaryFile:
+    """Stream `url` into a spooled temp file, enforcing MAX_ATTACHMENT_BYTES."""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    size = 0
+    try:
+        async with client.stream("GET", url) as resp:
+            if resp.status_code != 200:
+                raise AttachmentError(f"download returned {resp.status_code}")
+            async for chunk in resp.aiter_bytes():
+                size += len(chunk)
+                if size > MAX_ATTACHMENT_BYTES:
+                    raise AttachmentError("file exceeds size limit")
+                spool.write(chunk)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+# ── Parsing (streaming rows) ──
+
+def _file_kind(name: str, content_type: str) -> str | None:
+    ext = os.path.splitext(name.lower())[1]
+    if ext in (".csv", ".tsv", ".txt") or "csv" in content_type:
+        return "csv"
+    if ext in (".xlsx", ".xlsm") or "spreadsheetml" in content_type:
+        return "xlsx"
+    if ext == ".json" or "json" in content_type:
+        return "json"
+    return None
+
+
+def _iter_csv(fileobj) -> Iterator[list]:
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", errors="replace", newline="")
+    sample = text.read(4096)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+    except csv.Error:
+        dialect = csv.excel
+    yield from csv.reader(text, dialect)
+
+
+def _iter_xlsx(fileobj) -> Iterator[list]:
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise AttachmentError("spreadsheet support (openpyxl) is not installed")
+    workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield ["" if v is None else v for v in row]
+    finally:
+        workbook.close()
+
+
+def _iter_json(fileobj) -> Iterator[list]:
+    # JSON isn't line-streamable with the stdlib; size is already capped by the download.
+    data = json.load(fileobj)
+    if isinstance(data, dict):
+        data = next((v for v in data.values() if isinstance(v, list)), [])
+    rows = [r for r in data if isinstance(r, dict)]
+    if not rows:
+        return
+    headers = list(dict.fromkeys(k for r in rows[:50] for k in r))
+    yield headers
+    for r in rows:
+        yield [r.get(h, "") for h in headers]
+
+
+def _iter_rows(fileobj, kind: str) -> Iterator[list]:
+    if kind == "csv":
+        return _iter_csv(fileobj)
+    if kind == "xlsx":
+        return _iter_xlsx(fileobj)
+    return _iter_json(fileobj)
+
+
+# ── Row mapping ──
+
+def _cell(row: list, mapping: dict[str, int], field: str) -> str:
+    i = mapping.get(field)
+    if i is None or i >= len(row):
+        return ""
+    return str(row[i]).strip()
+
+
+def _parse_price(value: str) -> float | None:
+    cleaned = value.replace("$", "").replace(",", "").strip()
+    try:
+        return round(float(cleaned), 2)
+    except ValueError:
+        return None
+
+
+def _contact_row(org_id: str, row: list, mapping: dict[str, int]) -> dict | None:
+    name = _cell(row, mapping, "name") or " ".join(
+        p for p in (_cell(row, mapping, "first_name"), _cell(row, mapping, "last_name")) if p
+    )
+    email = _cell(row, mapping, "email").lower()
+    phone = _cell(row, mapping, "phone")
+    if not name or not (email or phone):
+        return None
+    record = {"org_id": org_id, "name": name, "type": "customer", "source": "onboarding_import"}
+    for field, value in (("email", email), ("phone", phone)):
+        if value:
+            record[field] = value
+    for field in ("company", "address", "notes"):
+        value = _cell(row, mapping, field)
+        if value:
+            record[field] = value
+    return record
+
+
+def _peptide_row(org_id: str, row: list, mapping: dict[str, int]) -> dict | None:
+    name = _cell(row, mapping, "name")
+    price = _parse_price(_cell(row, mapping, "retail_price"))
+    if not name or price is None:
+        return None
+    record = {"org_id": org_id, "name": name, "retail_price": price, "active": True}
+    for field in ("sku", "description"):
+        value = _cell(row, mapping, field)
+        if value:
+            record[field] = value
+    cost = _parse_price(_cell(row, mapping, "base_cost"))
+    if cost is not None:
+        record["base_cost"] = cost
+    return record
+
+
+# ── Bulk load ──
+
+def _normalize_phone(phone: str) -> str:
+    """Digits only, without a leading US country code. Must match existing_import_keys."""
+    digits = "".join(c for c in phone if c.isdigit())
+    if len(digits) == 11 and digits.startswith("1"):
+        digits = digits[1:]
+    return digits
+
+
+def _dedupe_keys(table: str, record: dict) -> set[str]:
+    """A record's de-dupe keys; it is a duplicate if any of them is already taken."""
+    if table == "peptides":
+        return {"name:" + record["name"].strip().lower()}
+    keys = set()
+    if record.get("email"):
+        keys.add("email:" + record["email"].strip().lower())
+    phone = _normalize_phone(record.get("phone") or "")
+    if len(phone) >= 7:
+        keys.add("phone:" + phone)
+    return keys
+
+
+def _existing_keys(sb: Client, table: str, org_id: str, keys: set[str]) -> set[str]:
+    """
+    Which of `keys` the org already has. Looked up per batch by the
+    existing_import_keys function, which normalizes the stored values the
+    same way (case, surrounding spaces, phone formatting) — a plain in_()
+    filter is case-sensitive and can't see through phone formatting.
+    """
+    if not keys:
+        return set()
+    result = sb.rpc("existing_import_keys", {
+        "p_org_id": org_id, "p_table": table, "p_keys": sorted(keys),
+    }).execute()
+    return {r["key"] for r in result.data or []}
+
+
+def _flush(sb: Client, org_id: str, table: str, batch: list[dict], stats: dict) -> None:
+    existing = _existing_keys(sb, table, org_id, set().union(*(_dedupe_keys(table, r) for r in batch)))
+    fresh = [r for r in batch if not existing & _dedupe_keys(table, r)]
+    stats["duplicates"] += len(batch) - len(fresh)
+    if not fresh:
+        return
+    try:
+        sb.table(table).insert(fresh).execute()
+        stats["inserted"] += len(fresh)
+    except Exception:
+        logger.exception(f"Bulk insert into {table} failed for {len(fresh)} rows")
+        stats["failed"] += len(fresh)
+
+
+def _ingest_file(sb: Client, org_id: str, fileobj, kind: str) -> dict:
+    """Parse one downloaded file and bulk-load it if its schema is recognized."""
+    rows = _iter_rows(fileobj, kind)
+    headers = [str(h) for h in next(rows, [])]
+    table, mapping = detect_schema(headers)
+    stats = {
+        "table": table, "columns": headers, "rows": 0, "inserted": 0,
+        "duplicates": 0, "invalid": 0, "failed": 0, "samples": [],
+    }
+    if table is None:
+        for row in rows:
+            stats["rows"] += 1
+            if len(stats["samples"]) < SAMPLE_ROWS:
+                stats["samples"].append([str(v) for v in row])
+        return stats
+
+    to_record = _contact_row if table == "contacts" else _peptide_row
+    seen: set[str] = set()
+    batch: list[dict] = []
+    for row in rows:
+        if not any(str(v).strip() for v in row):
+            continue
+        stats["rows"] += 1
+        record = to_record(org_id, row, mapping)
+        if record is None:
+            stats["invalid"] += 1
+            continue
+        keys = _dedupe_keys(table, record)
+        if keys & seen:
+            stats["duplicates"] += 1
+            continue
+        seen |= keys
+        if len(stats["samples"]) < SAMPLE_ROWS:
+            stats["samples"].append(record)
+        batch.append(record)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            _flush(sb, org_id, table, batch, stats)
+            batch = []
+    if batch:
+        _flush(sb, org_id, table, batch, stats)
+    return stats
+
+
+async def _process(
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    sb: Client,
+    org_id: str,
+    att: dict,
+) -> dict:
+    result = {"name": att["name"], "type": att["type"], "url": att["url"]}
+    kind = _file_kind(att["name"], att.get("type") or "")
+    if kind is None or not _is_own_storage_url(att["url"]):
+        result["status"] = "not_ingested"
+        return result
+    try:
+        async with semaphore:
+            spool = await _download(client, att["url"])
+        try:
+            stats = await asyncio.to_thread(_ingest_file, sb, org_id, spool, kind)
+        finally:
+            spool.close()
+        result.update(stats)
+        result["status"] = "imported" if stats["table"] else "parsed"
+    except Exception as e:
+        logger.warning(f"Attachment ingest failed for {att['name']}: {e}")
+        result["status"] = "failed"
+        result["error"] = str(e)[:200]
+    return result
+
+
+async def ingest_attachments(sb: Client, org_id: str, attachments: list[dict]) -> list[dict]:
+    """Download and ingest all attachments concurrently. Returns one result dict per file."""
+    semaphore = asyncio.Semaphore(ATTACHMENT_CONCURRENCY)
+    async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
+        return await asyncio.gather(*(
+            _process(client, semaphore, sb, org_id, att) for att in attachments
+        ))
+
+
+def format_ingest_summary(results: list[dict]) -> str:
+    """Render ingest results as the compact [UPLOADED FILES] block for the agent prompt."""
+    lines = ["[UPLOADED FILES]", "The server already processed the merchant's uploads:"]
+    for r in results:
+        label = f"  - {r['name']} ({r['type']})"
+        status = r["status"]
+        if status == "imported":
+            lines.append(
+                f"{label}: imported into {r['table']} — {r['inserted']} new rows, "
+                f"{r['duplicates']} duplicates skipped, {r['invalid']} rows missing required fields"
+                + (f", {r['failed']} failed to insert" if r["failed"] else "")
+                + f" (of {r['rows']} rows)"
+            )
+        elif status == "parsed":
+            lines.append(f"{label}: {r['rows']} rows, schema not recognized — nothing imported")
+        elif status == "failed":
+            lines.append(f"{label}: could not be processed ({r['error']}). URL: {r['url']}")
+        else:
+            lines.append(f"{label}: not a spreadsheet — download and process it yourself: {r['url']}")
+            continue
+        if r.get("columns"):
+            lines.append(f"    Columns: {', '.join(str(c) for c in r['columns'][:20])}")
+        for sample in r.get("samples", []):
+            if isinstance(sample, dict):
+                sample = {k: v for k, v in sample.items() if k != "org_id"}
+            lines.append(f"    Sample: {json.dumps(sample, default=str)[:200]}")
+    lines.append("Confirm the imports with the merchant; do not re-import these rows.")
+    return "\n".join(lines)
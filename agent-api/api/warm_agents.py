@@ -0,0 +1,144 @@
+"""
+Pre-spawned Claude CLI processes reserved for an org.
+
+When a merchant opens the onboarding chat, a CLI process is started with
+the exact arguments their next turn will use (persona, resume session, MCP
+config) and left waiting on stdin. The first real message is written to it
+instead of paying node startup and MCP connection from cold. Unclaimed
+processes are killed after WARM_AGENT_TTL seconds.
+
+A warm process counts against the agent concurrency limit: it holds an agent
+slot from spawn until the org's turn takes the slot over (take_slot) or the
+process is discarded. A real turn that finds no free slot evicts the oldest
+other org's warm process (evict_oldest) rather than queueing behind it.
+"""
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Callable
+
+try:
+    from api import run_limits
+    from api.mcp_pool import RunConfig
+except ImportError:
+    import run_limits
+    from mcp_pool import RunConfig
+
+logger = logging.getLogger("onboarding-agent.warm_agents")
+
+MAX_WARM_AGENTS = int(os.environ.get("MAX_WARM_AGENTS", "2"))
+WARM_AGENT_TTL = float(os.environ.get("WARM_AGENT_TTL", "120"))
+
+
+@dataclass
+class WarmAgent:
+    org_id: str
+    resume_session: str | None
+    persona_hash: str
+    process: asyncio.subprocess.Process
+    mcp_config: RunConfig | None
+    created_at: float
+    release_slot: Callable[[], None] | None = None  # gives back the agent slot it holds
+    expiry: asyncio.TimerHandle | None = None
+
+
+_warm: dict[str, WarmAgent] = {}
+
+
+def has_capacity() -> bool:
+    return len(_warm) < MAX_WARM_AGENTS
+
+
+def is_warm(org_id: str) -> bool:
+    return org_id in _warm
+
+
+def add(agent: WarmAgent) -> None:
+    """Reserve `agent` for its org, replacing any older reservation."""
+    discard(agent.org_id)
+    agent.expiry = asyncio.get_running_loop().call_later(WARM_AGENT_TTL, discard, agent.org_id)
+    _warm[agent.org_id] = agent
+    logger.info(f"Warm agent reserved for org {agent.org_id} (pid {agent.process.pid})")
+
+
+def take_slot(org_id: str) -> bool:
+    """
+    Hand the agent slot held by the org's warm process to its turn. Returns
+    True if the caller now owns a slot (and must release it), False if there
+    is no warm process holding one.
+    """
+    agent = _warm.get(org_id)
+    if agent is None or agent.release_slot is None:
+        return False
+    agent.release_slot = None
+    return True
+
+
+def evict_oldest(except_org: str) -> bool:
+    """
+    Discard the oldest warm process holding an agent slot that is not
+    reserved for `except_org`. Returns True if one was discarded.
+    """
+    holders = [a for a in _warm.values() if a.org_id != except_org and a.release_slot is not None]
+    if not holders:
+        return False
+    oldest = min(holders, key=lambda a: a.created_at)
+    logger.info(f"Evicting warm agent for org {oldest.org_id} to free an agent slot")
+    discard(oldest.org_id)
+    return True
+
+
+def claim(org_id: str, resume_session: str | None, persona_hash: str) -> WarmAgent | None:
+    """
+    Hand over the org's warm process if it was started with matching
+    arguments and is still alive; otherwise discard it and return None.
+    """
+    agent = _warm.pop(org_id, None)
+    if agent is None:
+        return None
+    if agent.expiry:
+        agent.expiry.cancel()
+    if (
+        agent.process.returncode is not None
+        or agent.resume_session != resume_session
+        or agent.persona_hash != persona_hash
+    ):
+        _kill(agent)
+        return None
+    _release_slot(agent)  # unless its turn already took it over
+    logger.info(f"Using warm agent for org {org_id} ({time.time() - agent.created_at:.1f}s old)")
+    return agent
+
+
+def discard(org_id: str) -> None:
+    agent = _warm.pop(org_id, None)
+    if agent is None:
+        return
+    if agent.expiry:
+        agent.expiry.cancel()
+    _kill(agent)
+
+
+def discard_all() -> None:
+    for org_id in list(_warm):
+        discard(org_id)
+
+
+def _release_slot(agent: WarmAgent) -> None:
+    if agent.release_slot is not None:
+        agent.release_slot()
+        agent.release_slot = None
+
+
+def _kill(agent: WarmAgent) -> None:
+    if agent.process.returncode is None:
+        run_limits.kill_group(agent.process)
+    if agent.mcp_config:
+        agent.mcp_config.release()
+    _release_slot(agent)
+
+
+def count() -> int:
+    return len(_warm)
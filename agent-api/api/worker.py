@@ -0,0 +1,143 @@
+"""
+Agent worker node: runs the Claude CLI runs the API tier queues (see
+agent_jobs.py).
+
+    AGENT_QUEUE_URL=supabase:// python -m api.worker
+
+(sqlite:// queues only reach workers on the API's own machine.)
+
+Each worker runs up to WORKER_CONCURRENCY runs at once, with its own MCP pool
+and run limits. While a run is in progress it heartbeats the job's lease.
+If the lease is lost (the API cancelled the job, or the lease expired and the
+job went to another worker), the run is killed. On SIGTERM or SIGINT the
+worker stops leasing and gives running jobs up to DRAIN_TIMEOUT seconds to
+finish. Runs still going after that are killed and reported as interrupted.
+"""
+import os
+import time
+import signal
+import socket
+import asyncio
+import logging
+
+try:
+    from api import agent_jobs, mcp_pool
+    from api.dispatch import call_claude_cli, AGENT_TIMEOUT, MAX_CONCURRENT_AGENTS
+    from api.drain import DRAIN_TIMEOUT
+except ImportError:
+    import agent_jobs
+    import mcp_pool
+    from dispatch import call_claude_cli, AGENT_TIMEOUT, MAX_CONCURRENT_AGENTS
+    from drain import DRAIN_TIMEOUT
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("onboarding-agent.worker")
+
+WORKER_ID = os.environ.get("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", str(MAX_CONCURRENT_AGENTS)))
+JOB_RETENTION_SECONDS = float(os.environ.get("JOB_RETENTION_SECONDS", str(24 * 3600)))
+PURGE_INTERVAL = 600.0
+
+
+async def run_job(job) -> None:
+    """Run one leased job to completion, failure or loss of its lease."""
+    queue = agent_jobs.backend()
+    payload = job.payload
+    resources: dict = {}
+    timeout = min(AGENT_TIMEOUT, payload["finish_by"] - time.time())
+    logger.info(f"[{WORKER_ID}] Running job {job.id} for org {payload['org_id']} (attempt {job.attempts})")
+
+    run = asyncio.create_task(call_claude_cli(
+        payload["prompt"],
+        org_id=payload["org_id"],
+        resume_session=payload.get("resume_session"),
+        resources=resources,
+        timeout=max(timeout, 0.0),
+    ))
+    try:
+        while not run.done():
+            await asyncio.wait({run}, timeout=agent_jobs.JOB_LEASE_SECONDS / 3)
+            if not run.done() and not await asyncio.to_thread(
+                queue.heartbeat, job.id, WORKER_ID, agent_jobs.JOB_LEASE_SECONDS,
+            ):
+                logger.warning(f"[{WORKER_ID}] Lost the lease on job {job.id} — stopping its run")
+                run.cancel()
+                await asyncio.gather(run, return_exceptions=True)
+                return
+    except asyncio.CancelledError:
+        run.cancel()
+        await asyncio.gather(run, return_exceptions=True)
+        await asyncio.to_thread(queue.fail, job.id, WORKER_ID, {"kind": "interrupted", "resources": resources})
+        raise
+
+    try:
+        reply, stderr_text, meta = run.result()
+    except Exception as e:
+        error, retry = agent_jobs.error_for(e, resources)
+        logger.warning(f"[{WORKER_ID}] Job {job.id} failed: {error['kind']}{' — will retry' if retry else ''}")
+        await asyncio.to_thread(queue.fail, job.id, WORKER_ID, error, retry)
+        return
+    done = await asyncio.to_thread(queue.complete, job.id, WORKER_ID, {
+        "reply": reply, "stderr": stderr_text, "meta": meta, "resources": resources,
+    })
+    if not done:
+        logger.warning(f"[{WORKER_ID}] Job {job.id} finished after its lease was lost — result dropped")
+
+
+async def main() -> None:
+    if not agent_jobs.ENABLED:
+        raise SystemExit("AGENT_QUEUE_URL is not set")
+    queue = agent_jobs.backend()
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    await mcp_pool.start_pool(WORKER_CONCURRENCY)
+    slots = asyncio.Semaphore(WORKER_CONCURRENCY)
+    running: set[asyncio.Task] = set()
+    last_purge = 0.0
+    logger.info(f"Worker {WORKER_ID} started ({WORKER_CONCURRENCY} slots) on {agent_jobs.AGENT_QUEUE_URL}")
+
+    def finished(task: asyncio.Task) -> None:
+        running.discard(task)
+        slots.release()
+        if not task.cancelled() and task.exception():
+            logger.error(f"[{WORKER_ID}] Job runner crashed", exc_info=task.exception())
+
+    try:
+        while not stopping.is_set():
+            await slots.acquire()
+            if stopping.is_set():
+                slots.release()
+                break
+            job = await asyncio.to_thread(
+                queue.lease, agent_jobs.AGENT_QUEUE_NAME, WORKER_ID, agent_jobs.JOB_LEASE_SECONDS,
+            )
+            if job is None:
+                slots.release()
+                if time.time() - last_purge > PURGE_INTERVAL:
+                    last_purge = time.time()
+                    await asyncio.to_thread(queue.purge, last_purge - JOB_RETENTION_SECONDS)
+                try:
+                    await asyncio.wait_for(stopping.wait(), agent_jobs.JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.create_task(run_job(job))
+            running.add(task)
+            task.add_done_callback(finished)
+
+        if running:
+            logger.info(f"Worker {WORKER_ID} draining {len(running)} running job(s) (up to {DRAIN_TIMEOUT:.0f}s)")
+            _, still_running = await asyncio.wait(set(running), timeout=DRAIN_TIMEOUT)
+            for task in still_running:
+                task.cancel()
+            await asyncio.gather(*still_running, return_exceptions=True)
+    finally:
+        await mcp_pool.stop_pool()
+    logger.info(f"Worker {WORKER_ID} stopped")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+"""
+Regression cases for the fast-path classifier (api/fastpath.py).
+
+Each case is a merchant message and the handler that must answer it, or
+None when it must go to the agent. From agent-api/:
+
+    python -m bench.fastpath_cases
+
+Prints the mismatches and exits 1 if there are any.
+"""
+import sys
+
+from api import fastpath
+
+CASES: list[tuple[str, str | None]] = [
+    # Plain status questions
+    ("what products do I have?", "products"),
+    ("how many peptides do we have", "products"),
+    ("show me my products", "products"),
+    ("is shipping set up?", "shipping"),
+    ("what's left?", "setup_status"),
+    ("what payment methods do I have set up?", "payments"),
+    ("how many contacts have you imported?", "contacts"),
+    ("what's my branding?", "branding"),
+    ("where is shipping set up from?", "shipping"),
+    ("which features are enabled?", "features"),
+    ("how many commission rules are there?", "commissions"),
+    # No tenant_config column says whether Stripe is connected, so the agent checks
+    ("is stripe connected?", None),
+    # Near misses: a qualifier the canned answer ignores
+    ("how many products are out of stock?", None),
+    ("how many peptides did I sell last month?", None),
+    ("show me my inactive products", None),
+    ("which of my peptides are most popular?", None),
+    ("how many customers ordered this week?", None),
+    ("how many contacts are VIP?", None),
+    ("how many commissions have I paid out?", None),
+    ("how much is shipping from miami?", None),
+    ("is my shipping address wrong?", None),
+    ("what does my logo cost?", None),
+    # Write intent, wherever it appears
+    ("is stripe connected? if not connect it", None),
+    ("is my branding ok? change the color to blue", None),
+    ("which of my peptides should I delete?", None),
+    ("what products should I remove from my catalog?", None),
+    ("add BPC-157 to my products", None),
+    ("did you import my contacts?", None),
+    ("do I have to set up stripe?", None),
+    ("is shipping set up? set it to Miami", None),
+    # Advice, permissions and questions to the assistant
+    ("how many products can I have on the free plan?", None),
+    ("what do you think of my branding?", None),
+    ("which products do you recommend?", None),
+    ("do you ship from here?", None),
+    ("how do I connect stripe?", None),
+    # More than one sentence
+    ("what products do I have? also what about shipping", None),
+    ("thanks. what's my branding?", None),
+]
+
+
+def main() -> int:
+    failures = []
+    for message, expected in CASES:
+        handler = fastpath.classify(message)
+        got = handler.name if handler else None
+        if got != expected:
+            failures.append((message, expected, got))
+    for message, expected, got in failures:
+        print(f"FAIL {message!r}: expected {expected}, got {got}")
+    print(f"{len(CASES) - len(failures)}/{len(CASES)} fast-path cases pass")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
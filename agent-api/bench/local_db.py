@@ -0,0 +1,120 @@
+"""
+In-memory stand-in for the supabase-py client, covering the query-builder
+calls the dispatch path makes (select/eq/in_/order/limit/single, insert,
+upsert, update, delete). Used by the replay runner so a replay never touches
+the real database.
+"""
+import uuid
+from datetime import datetime, timedelta, timezone
+
+
+class _Result:
+    def __init__(self, data: list[dict], count: int | None = None):
+        self.data = data
+        self.count = count
+
+
+class _Query:
+    def __init__(self, db: "LocalDB", table: str):
+        self._db = db
+        self._table = table
+        self._filters: list = []
+        self._orders: list[tuple[str, bool]] = []
+        self._limit: int | None = None
+        self._single = False
+        self._op = "select"
+        self._payload = None
+        self._on_conflict: str | None = None
+
+    def select(self, *columns, count: str | None = None):
+        return self
+
+    def eq(self, column: str, value):
+        self._filters.append(lambda r: r.get(column) == value)
+        return self
+
+    def in_(self, column: str, values):
+        values = set(values)
+        self._filters.append(lambda r: r.get(column) in values)
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        self._orders.append((column, desc))
+        return self
+
+    def limit(self, n: int):
+        self._limit = n
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def insert(self, rows):
+        self._op, self._payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict: str | None = None):
+        self._op, self._payload, self._on_conflict = "upsert", rows, on_conflict
+        return self
+
+    def update(self, values: dict):
+        self._op, self._payload = "update", values
+        return self
+
+    def delete(self):
+        self._op = "delete"
+        return self
+
+    def execute(self) -> _Result:
+        rows = self._db.tables.setdefault(self._table, [])
+        if self._op in ("insert", "upsert"):
+            items = self._payload if isinstance(self._payload, list) else [self._payload]
+            out = []
+            for item in items:
+                row = {"id": str(uuid.uuid4()), "created_at": self._db.now(), **item}
+                if self._op == "upsert":
+                    keys = (self._on_conflict or "id").split(",")
+                    rows[:] = [r for r in rows if any(r.get(k) != row.get(k) for k in keys)]
+                rows.append(row)
+                out.append(dict(row))
+            return _Result(out)
+
+        matched = [r for r in rows if all(f(r) for f in self._filters)]
+        if self._op == "update":
+            for r in matched:
+                r.update(self._payload)
+            return _Result([dict(r) for r in matched])
+        if self._op == "delete":
+            rows[:] = [r for r in rows if r not in matched]
+            return _Result(matched)
+
+        for column, desc in reversed(self._orders):
+            matched.sort(key=lambda r: str(r.get(column) or ""), reverse=desc)
+        count = len(matched)
+        if self._limit is not None:
+            matched = matched[:self._limit]
+        data = [dict(r) for r in matched]
+        if self._single:
+            return _Result(data[0] if data else None, count)
+        return _Result(data, count)
+
+
+class LocalDB:
+    """A dict of tables (lists of row dicts) behind a supabase-py-like `table()` API."""
+
+    def __init__(self):
+        self.tables: dict[str, list[dict]] = {}
+        self._last_ts = datetime.min.replace(tzinfo=timezone.utc)
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+    def now(self) -> str:
+        """Strictly increasing ISO timestamps, so created_at ordering is stable."""
+        ts = max(datetime.now(timezone.utc), self._last_ts + timedelta(microseconds=1))
+        self._last_ts = ts
+        return ts.isoformat(timespec="microseconds")
+
+    def seed(self, table: str, rows: list[dict]) -> None:
+        self.tables.setdefault(table, []).extend(dict(r) for r in rows)
@@ -0,0 +1,299 @@
+"""
+Replay captured production turns through dispatch_message.
+
+Capture turns on the droplet with CAPTURE_DIR (see api/capture.py), copy the
+turns-*.jsonl files here, then from agent-api/:
+
+    python -m bench.replay captures/turns-20261019.jsonl
+    python -m bench.replay captures/*.jsonl --speed 20 --save-baseline bench/baseline.json
+    python -m bench.replay captures/*.jsonl --speed 20 --baseline bench/baseline.json
+
+Each turn is submitted at its recorded arrival offset (divided by --speed), so
+overlap between merchants is preserved. Messages that were coalesced into
+one turn are submitted one by one too, and are served the recorded data of
+the turn they joined. The real dispatch path runs:
+fast path, prompt building, sessions, semaphore, CLI subprocess handling and
+audit writes. It runs against:
+- an in-memory database (bench/local_db.py), seeded with the recorded history
+- the recorded org snapshot, scrape payload and ingest results, each served
+  after its recorded duration
+- a simulated agent process (bench/sim_agent.py) that replies after the
+  recorded agent time
+
+The report separates end-to-end latency from dispatch overhead (latency minus
+the simulated scrape, ingest and agent time). Overhead includes the simulated
+agent's own interpreter start-up; it is constant between runs, so compare
+overhead against a baseline taken on the same machine. With --baseline it prints the
+diff and exits 1 when p95 latency or overhead regresses by more than
+--max-regression.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import contextvars
+from collections import Counter, defaultdict
+
+os.environ.setdefault("SUPABASE_URL", "http://replay.invalid")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "replay")
+os.environ.setdefault("MCP_POOL_ENABLED", "0")
+
+from api import capture, dispatch, run_limits, uploads  # noqa: E402
+from bench.local_db import LocalDB  # noqa: E402
+
+SIM_AGENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sim_agent.py")
+
+# Ignore regressions smaller than this many ms — timer noise on tiny stages
+MIN_REGRESSION_MS = 5.0
+
+_current: contextvars.ContextVar[dict] = contextvars.ContextVar("replay_turn")
+_speed = 1.0
+_tmpdir = ""
+
+
+# ── Stand-ins for the external calls a turn makes ──
+
+def _fetch_snapshot(org_id: str) -> dict:
+    return _current.get().get("snapshot") or {}
+
+
+async def _scrape(url: str, access_token: str) -> dict | None:
+    turn = _current.get()
+    scrape = turn.get("scrape") or {}
+    await asyncio.sleep((scrape.get("ms") or 0) / 1000 / _speed)
+    return scrape.get("result")
+
+
+async def _ingest(sb, org_id: str, attachments: list[dict]) -> list[dict]:
+    turn = _current.get()
+    ingest = turn.get("ingest") or {}
+    await asyncio.sleep((ingest.get("ms") or 0) / 1000 / _speed)
+    return ingest.get("results") or []
+
+
+async def _spawn_sim_agent(org_id: str, resume_session: str | None):
+    turn = _current.get()
+    agent = turn.get("agent") or {}
+    failed = agent.get("status") in ("error", "timeout", "killed")
+    result = {"type": "result", "subtype": "success", "is_error": False,
+              **(agent.get("meta") or {}), "result": agent.get("reply", "")}
+    delay = (agent.get("ms") or 0) / 1000 / _speed
+    if agent.get("status") == "timeout":
+        delay = dispatch.AGENT_TIMEOUT + 1
+    path = os.path.join(_tmpdir, f"agent-{turn['id']}-{time.monotonic_ns()}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "delay": delay,
+            "stdout": "" if failed else json.dumps(result),
+            "stderr": agent.get("tool_log") or "",
+            "exit": 1 if failed else 0,
+        }, f)
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-S", "-E", SIM_AGENT, path,   # skip site/env for a fast start
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        **run_limits.spawn_kwargs(),
+    )
+    return process, None
+
+
+def _install(db: LocalDB, turns: list[dict], speed: float) -> None:
+    dispatch._supabase = db
+    dispatch._fetch_org_snapshot = _fetch_snapshot
+    dispatch._scrape_website = _scrape
+    dispatch._spawn_claude_cli = _spawn_sim_agent
+    dispatch.RATE_LIMIT_MAX = 10 ** 9
+    dispatch.AGENT_TIMEOUT = dispatch.AGENT_TIMEOUT / speed
+    uploads.ingest_attachments = _ingest
+
+    # Seed each org's conversation as it stood before its first replayed turn
+    seen = set()
+    for turn in turns:
+        if turn["org_id"] in seen or turn.get("status") == "coalesced":
+            continue
+        seen.add(turn["org_id"])
+        history = turn.get("history") or []
+        answered = set(turn.get("message_ids") or [])
+        prior = [m for m in history if m.get("id") not in answered] if answered else history[:-1]
+        db.seed("onboarding_messages", [{**m, "org_id": turn["org_id"]} for m in prior])
+
+
+# ── Replay ──
+
+def _simulated_ms(turn: dict) -> float:
+    external = sum((turn.get(k) or {}).get("ms") or 0 for k in ("scrape", "ingest", "agent"))
+    return external / _speed
+
+
+async def _run_turn(turn: dict, at: float, t0: float, recorded: dict) -> dict:
+    """Submit `turn`'s message at offset `at`, serving the external calls from `recorded`."""
+    await asyncio.sleep(max(0.0, t0 + at - time.monotonic()))
+    _current.set(recorded)
+    start = time.monotonic()
+    try:
+        result = await dispatch.dispatch_message(
+            user_id=turn["user_id"],
+            org_id=turn["org_id"],
+            email=turn.get("email") or "",
+            full_name=turn.get("full_name") or "",
+            message=turn["message"],
+            attachments=turn.get("attachments"),
+            access_token=f"replay:{turn['id']}",
+        )
+        error = None if result.get("reply") else "empty reply"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    latency = (time.monotonic() - start) * 1000
+    return {
+        "id": turn["id"],
+        "org_id": turn["org_id"],
+        "recorded_status": turn.get("status"),
+        "recorded_ms": turn.get("total_ms"),
+        "latency_ms": latency,
+        "overhead_ms": max(0.0, latency - _simulated_ms(recorded)),
+        "error": error,
+    }
+
+
+async def replay(turns: list[dict], speed: float) -> tuple[list[dict], float]:
+    """Run `turns` at their recorded offsets; the replayed turns are captured to _tmpdir."""
+    global _speed, _tmpdir
+    _speed, _tmpdir = speed, tempfile.mkdtemp(prefix="replay-")
+    capture.CAPTURE_DIR, capture.CAPTURE_SAMPLE_RATE = _tmpdir, 1.0
+    _install(LocalDB(), turns, speed)
+
+    by_id = {turn["id"]: turn for turn in turns}
+    first = turns[0]["started_at"]
+    t0 = time.monotonic()
+    results = await asyncio.gather(*(
+        _run_turn(turn, (turn["started_at"] - first) / speed, t0, by_id.get(turn.get("coalesced_into")) or turn)
+        for turn in turns
+    ))
+    return list(results), time.monotonic() - t0
+
+
+def replayed_stages() -> dict[str, list[float]]:
+    """Per-stage timings of the replayed turns, from their own capture records."""
+    paths = [os.path.join(_tmpdir, n) for n in os.listdir(_tmpdir) if n.startswith("turns-")]
+    stages = defaultdict(list)
+    for t in capture.load(paths):
+        for name, ms in t.get("stages", {}).items():
+            stages[name].append(ms)
+    return stages
+
+
+# ── Report ──
+
+def _pct(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def _dist(values: list[float]) -> dict:
+    return {
+        "p50": round(_pct(values, 50), 1),
+        "p95": round(_pct(values, 95), 1),
+        "p99": round(_pct(values, 99), 1),
+        "max": round(max(values), 1) if values else 0.0,
+        "mean": round(sum(values) / len(values), 1) if values else 0.0,
+    }
+
+
+def summarize(results: list[dict], wall: float, speed: float, stages: dict[str, list[float]]) -> dict:
+    return {
+        "turns": len(results),
+        "speed": speed,
+        "wall_seconds": round(wall, 2),
+        "throughput_per_min": round(len(results) / wall * 60, 1) if wall else 0.0,
+        "errors": sum(1 for r in results if r["error"]),
+        "recorded_statuses": dict(Counter(r["recorded_status"] for r in results)),
+        "latency_ms": _dist([r["latency_ms"] for r in results]),
+        "overhead_ms": _dist([r["overhead_ms"] for r in results]),
+        "recorded_latency_ms": _dist([r["recorded_ms"] / speed for r in results if r["recorded_ms"] is not None]),
+        "stages_ms": {name: _dist(v) for name, v in sorted(stages.items())},
+    }
+
+
+def print_report(summary: dict) -> None:
+    print(f"\nReplayed {summary['turns']} turns at {summary['speed']}x in {summary['wall_seconds']}s "
+          f"({summary['throughput_per_min']} turns/min, {summary['errors']} errors)")
+    print(f"Recorded statuses: {summary['recorded_statuses']}\n")
+    print(f"{'':24}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}{'mean':>10}")
+    rows = [("latency", summary["latency_ms"]), ("overhead", summary["overhead_ms"]),
+            ("recorded latency", summary["recorded_latency_ms"])]
+    rows += [(f"  stage {n}", d) for n, d in summary["stages_ms"].items()]
+    for name, d in rows:
+        print(f"{name:24}" + "".join(f"{d[k]:>10.1f}" for k in ("p50", "p95", "p99", "max", "mean")))
+
+
+def diff_baseline(summary: dict, baseline: dict, max_regression: float) -> bool:
+    """Print current vs baseline; return True if a gated metric regressed."""
+    print(f"\n{'vs baseline':24}{'baseline':>12}{'current':>12}{'delta':>10}")
+    regressed = False
+    metrics = [("latency p50", "latency_ms", "p50"), ("latency p95", "latency_ms", "p95"),
+               ("overhead p50", "overhead_ms", "p50"), ("overhead p95", "overhead_ms", "p95")]
+    metrics += [(f"stage {n} p95", ("stages_ms", n), "p95") for n in summary["stages_ms"]]
+    for label, key, pct in metrics:
+        if isinstance(key, tuple):
+            old = baseline.get(key[0], {}).get(key[1], {}).get(pct)
+            new = summary[key[0]][key[1]][pct]
+        else:
+            old, new = baseline.get(key, {}).get(pct), summary[key][pct]
+        if old is None:
+            continue
+        delta = (new - old) / old if old else 0.0
+        gated = label in ("latency p95", "overhead p95")
+        bad = gated and delta > max_regression and new - old > MIN_REGRESSION_MS
+        regressed |= bad
+        print(f"{label:24}{old:>12.1f}{new:>12.1f}{delta:>+10.1%}" + ("  REGRESSION" if bad else ""))
+    return regressed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Replay captured turns through dispatch_message")
+    parser.add_argument("captures", nargs="+", help="turns-*.jsonl files written by capture mode")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression factor (default 1 = real time)")
+    parser.add_argument("--org", help="only replay turns for this org id")
+    parser.add_argument("--limit", type=int, help="replay at most N turns")
+    parser.add_argument("--baseline", help="baseline summary JSON to diff against")
+    parser.add_argument("--save-baseline", help="write this run's summary JSON here")
+    parser.add_argument("--max-regression", type=float, default=0.10,
+                        help="allowed relative p95 regression before exiting 1 (default 0.10)")
+    args = parser.parse_args()
+
+    turns = capture.load(args.captures)
+    if args.org:
+        turns = [t for t in turns if t["org_id"] == args.org]
+    if args.limit:
+        turns = turns[:args.limit]
+    if not turns:
+        print("No captured turns to replay")
+        return 1
+
+    # asyncio.run waits for the executor, so every replayed turn's capture is on disk after it
+    results, wall = asyncio.run(replay(turns, args.speed))
+    summary = summarize(results, wall, args.speed, replayed_stages())
+    print_report(summary)
+    for r in results:
+        if r["error"]:
+            print(f"  error in turn {r['id']} (org {r['org_id']}): {r['error']}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            if diff_baseline(summary, json.load(f), args.max_regression):
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,20 @@
+"""
+Simulated Claude CLI for replays: reads the prompt from stdin like the real
+CLI, waits out the recorded agent time, then writes the recorded tool log to
+stderr and the recorded JSON result to stdout.
+
+Usage (spawned by bench/replay.py): python sim_agent.py <response.json>
+where response.json is {"delay": seconds, "stdout": str, "stderr": str, "exit": int}.
+"""
+import sys
+import json
+import time
+
+with open(sys.argv[1], encoding="utf-8") as f:
+    response = json.load(f)
+
+sys.stdin.read()
+time.sleep(response["delay"])
+sys.stderr.write(response["stderr"])
+sys.stdout.write(response["stdout"])
+sys.exit(response["exit"])
@@ -0,0 +1,50 @@
+#!/bin/bash
+# Zero-downtime deploy (blue/green).
+#
+# Starts the idle color alongside the live one, waits until it is healthy,
+# points nginx at it, then stops the old color. Stopping sends SIGTERM,
+# which drains the old instance (api/drain.py): it refuses new work and lets
+# running agent turns finish before exiting. Capacity never drops to zero.
+#
+#   ./deploy.sh            # build and switch to the idle color
+set -euo pipefail
+cd "$(dirname "$0")"
+
+UPSTREAM_CONF=${UPSTREAM_CONF:-/etc/nginx/agent-upstream.conf}
+STATE_FILE=${STATE_FILE:-.active-color}
+HEALTH_TIMEOUT=${HEALTH_TIMEOUT:-120}
+STOP_TIMEOUT=${STOP_TIMEOUT:-140}   # keep in step with stop_grace_period
+
+if [ -f "$STATE_FILE" ]; then
+  active=$(cat "$STATE_FILE")
+  active_project="onboarding-agent-$active"
+else
+  # First run: the live instance is the plain `docker compose up` one
+  active=blue
+  active_project=$(basename "$PWD")
+fi
+if [ "$active" = blue ]; then next=green; port=3501; else next=blue; port=3500; fi
+
+echo "=== Deploying $next on :$port (live: $active) ==="
+AGENT_COLOR=$next AGENT_PORT=$port docker compose -p "onboarding-agent-$next" up -d --build
+
+echo "Waiting for $next to be healthy..."
+deadline=$((SECONDS + HEALTH_TIMEOUT))
+until curl -sf "http://127.0.0.1:$port/api/health" > /dev/null; do
+  if [ $SECONDS -ge $deadline ]; then
+    echo "$next never became healthy — leaving $active live"
+    AGENT_COLOR=$next docker compose -p "onboarding-agent-$next" down
+    exit 1
+  fi
+  sleep 2
+done
+
+echo "Switching nginx to $next"
+printf 'upstream agent_api {\n    server 127.0.0.1:%s;\n}\n' "$port" > "$UPSTREAM_CONF"
+nginx -t
+nginx -s reload
+echo "$next" > "$STATE_FILE"
+
+echo "Draining $active (up to ${STOP_TIMEOUT}s)..."
+AGENT_COLOR=$active docker compose -p "$active_project" down --timeout "$STOP_TIMEOUT"
+echo "=== $next is live ==="
@@ -23,4 +23,4 @@ done
 
 echo "Starting FastAPI on port 3500..."
 cd /opt/peptide-agent
-exec uvicorn api.main:app --host 0.0.0.0 --port 3500 --log-level info
+exec uvicorn api.main:app --host 0.0.0.0 --port 3500 --log-level info --timeout-graceful-shutdown 15
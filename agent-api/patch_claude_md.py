@@ -24,8 +24,9 @@ new_scrape_instructions = """**Your job is to IMMEDIATELY use this data to build
 
 1. Check what the scrape already auto-saved (brand data goes to `tenant_config`, peptides go to `scraped_peptides` with status `pending`)
 2. Apply any branding that wasn't auto-saved
-3. **IMMEDIATELY import ALL scraped peptides with confidence >= 0.5 into the `peptides` table** — do NOT ask permission first. Just import them all in one batch INSERT.
-4. Update each imported scraped_peptide's status to `imported` and link `imported_peptide_id`
+3. **IMMEDIATELY import ALL scraped peptides with confidence >= 0.5** — do NOT ask permission first. One call does the whole import (insert, skip names already in the catalog, mark scraped rows `imported` and link `imported_peptide_id`):
+   `SELECT * FROM import_scraped_peptides('<ORG_ID>');`
+4. Never import row by row or re-query each peptide — the function returns the imported table (name + retail_price, outcome `imported` or `duplicate`)
 5. Show the merchant a clean table of what you imported (name + price) and say "I pulled these from your website. Anything to adjust?"
 6. Guide them through the remaining setup (payments, shipping, contacts, etc.)
 
@@ -99,6 +100,29 @@ if old_import_step in content:
 else:
     print("FIX 3 SKIPPED: Could not find old import step")
 
+# ═══════════════════════════════════════════════════════════════
+# FIX 4: Replace the multi-step import SQL with the set-based RPC
+# ═══════════════════════════════════════════════════════════════
+
+old_import_call = """**IMMEDIATELY import ALL with confidence >= 0.5 — do NOT ask the merchant:**"""
+
+new_import_call = """**IMMEDIATELY import ALL with confidence >= 0.5 — do NOT ask the merchant.** Use the single set-based call (never per-row INSERTs/UPDATEs):
+```sql
+SELECT * FROM import_scraped_peptides('<ORG_ID>');            -- default min confidence 0.5
+SELECT * FROM import_scraped_peptides('<ORG_ID>', 0.7);       -- stricter threshold
+```
+It inserts the new peptides, skips names already in the catalog, marks the scraped rows `imported` with `imported_peptide_id`, and returns one row per scraped peptide (name, retail_price, outcome). Show that table to the merchant.
+
+The manual SQL below is only for importing a single hand-picked peptide:"""
+
+if new_import_call in content:
+    print("FIX 4 SKIPPED: Already applied")
+elif old_import_call in content:
+    content = content.replace(old_import_call, new_import_call)
+    print("FIX 4 APPLIED: Import step uses import_scraped_peptides()")
+else:
+    print("FIX 4 SKIPPED: Could not find import step")
+
 # Write back
 with open(CLAUDE_MD_PATH, "w") as f:
     f.write(content)
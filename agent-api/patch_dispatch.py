@@ -1,4 +1,4 @@
-"""Patch dispatch.py on the droplet to fix URL detection and add proactive scraping."""
+"""Patch dispatch.py on the droplet to fix URL detection and drop the request-path proactive scrape."""
 import re
 import sys
 
@@ -46,40 +46,22 @@ else:
     print("FIX 1 SKIPPED: URL_PATTERN not found")
 
 # ═══════════════════════════════════════════════════════════════
-# FIX 2: Add proactive scraping after URL detection block
+# FIX 2: Remove the request-path proactive scrape (now api/scrape_worker.py)
 # ═══════════════════════════════════════════════════════════════
 
-# We need to find the end of the URL scrape block and add proactive scrape after it
-# Look for: logger.info(f"Injected scrape results for {urls[0]}")
-marker = 'logger.info(f"Injected scrape results for {urls[0]}")'
-
-if marker in content:
-    proactive_block = '''
-
-    # 3b. Proactive scrape: if no URL in message but website exists with no products
-    if not scrape_block and access_token:
-        try:
-            tc = sb.table("tenant_config").select("website_url").eq("org_id", org_id).limit(1).execute()
-            prods = sb.table("peptides").select("id", count="exact").eq("org_id", org_id).eq("active", True).limit(1).execute()
-            has_website = tc.data and tc.data[0].get("website_url")
-            has_products = prods.count and prods.count > 0
-
-            if has_website and not has_products:
-                # Check if we already scraped (don't re-scrape)
-                already = sb.table("scraped_peptides").select("id", count="exact").eq("org_id", org_id).limit(1).execute()
-                if not (already.count and already.count > 0):
-                    logger.info(f"Proactive scrape: website={tc.data[0]['website_url']} but no products")
-                    scrape_result = await _scrape_website(tc.data[0]["website_url"], access_token)
-                    if scrape_result:
-                        scrape_block = _format_scrape_results(scrape_result)
-                        logger.info("Proactive scrape injected")
-        except Exception:
-            logger.debug("Proactive scrape check failed -- continuing without")'''
-
-    content = content.replace(marker, marker + proactive_block)
-    print("FIX 2 APPLIED: Proactive scrape logic added after URL detection")
+# Earlier versions of this script injected a "3b. Proactive scrape" block after
+# the URL scrape. It cost three queries on every message and blocked the reply
+# on a scrape of up to 60s; the background scrape worker replaces it.
+proactive_start = "\n\n    # 3b. Proactive scrape:"
+proactive_end = 'logger.debug("Proactive scrape check failed -- continuing without")'
+
+if proactive_start in content and proactive_end in content:
+    start = content.index(proactive_start)
+    end = content.index(proactive_end, start) + len(proactive_end)
+    content = content[:start] + content[end:]
+    print("FIX 2 APPLIED: Request-path proactive scrape removed")
 else:
-    print("FIX 2 SKIPPED: Could not find scrape marker")
+    print("FIX 2 SKIPPED: No proactive scrape block found")
 
 # ═══════════════════════════════════════════════════════════════
 # Write back
@@ -12,17 +12,29 @@ What it does:
 3. Chunks by topic with overlap
 4. Embeds with text-embedding-3-small -> stores in Supabase pgvector
 5. Tracks ingested videos (no duplicates)
+
+Cleanup and embedding results are cached in scripts/.ingest_cache.sqlite,
+keyed by model + prompt + input text, so --force re-ingests, chunking
+changes and crash recovery only pay for content that actually changed.
 """
 
 import os
 import re
 import sys
 import time
+import array
+import random
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from collections import deque
 from pathlib import Path
 from datetime import datetime, timezone
 
 from dotenv import load_dotenv
-from openai import OpenAI
+import openai as openai_lib
+from openai import AsyncOpenAI, OpenAI
 from youtube_transcript_api import YouTubeTranscriptApi
 from supabase import create_client
 
@@ -49,6 +61,122 @@ EMBEDDING_MODEL = "text-embedding-3-small"
 CLEANUP_MODEL = "gpt-4o-mini"
 CHUNK_TARGET_WORDS = 500
 CHUNK_OVERLAP_WORDS = 75
+CLEANUP_CHUNK_WORDS = 3000                                      # words per LLM call
+CLEANUP_CONCURRENCY = int(os.environ.get("CLEANUP_CONCURRENCY", "4"))   # in-flight calls per video
+CLEANUP_TPM = int(os.environ.get("CLEANUP_TPM", "200000"))      # tokens/minute across all videos
+CLEANUP_MAX_RETRIES = 6
+CACHE_PATH = Path(os.environ.get("INGEST_CACHE_PATH", Path(__file__).parent / ".ingest_cache.sqlite"))
+CACHE_MAX_MB = int(os.environ.get("INGEST_CACHE_MAX_MB", "512"))
+
+
+# ── Result cache ────────────────────────────────────────
+def cache_key(*parts: str) -> str:
+    """Content address for a cached result: hash of everything that determines it."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """On-disk cache of cleanup and embedding results, evicting least recently used past CACHE_MAX_MB."""
+
+    def __init__(self, path: Path, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.run_hits = {}
+        self.run_misses = {}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS results_lru ON results (last_used);
+        """)
+
+    def get_many(self, kind: str, keys: list[str]) -> dict[str, bytes]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT key, value FROM results WHERE key IN ({', '.join('?' * len(batch))})", batch,
+                ).fetchall()
+                found.update(rows)
+            if found:
+                self._db.executemany(
+                    "UPDATE results SET hits = hits + 1, last_used = ? WHERE key = ?",
+                    [(time.time(), key) for key in found],
+                )
+            self.run_hits[kind] = self.run_hits.get(kind, 0) + len(found)
+            self.run_misses[kind] = self.run_misses.get(kind, 0) + len(set(keys) - found.keys())
+        return found
+
+    def get(self, kind: str, key: str) -> bytes | None:
+        return self.get_many(kind, [key]).get(key)
+
+    def put_many(self, kind: str, items: dict[str, bytes]):
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO results (key, kind, value, size, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                [(key, kind, value, len(value), now, now) for key, value in items.items()],
+            )
+            self._evict()
+
+    def put(self, kind: str, key: str, value: bytes):
+        self.put_many(kind, {key: value})
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Evict down to 90% so we are not evicting on every write
+        excess = total - int(self.max_bytes * 0.9)
+        freed = 0
+        doomed = []
+        for key, size in self._db.execute("SELECT key, size FROM results ORDER BY last_used"):
+            doomed.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._db.executemany("DELETE FROM results WHERE key = ?", doomed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT kind, COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) FROM results GROUP BY kind"
+            ).fetchall()
+        return {kind: {"entries": n, "bytes": size, "hits": hits} for kind, n, size, hits in rows}
+
+    def clear(self) -> int:
+        with self._lock:
+            count = self._db.execute("DELETE FROM results").rowcount
+            self._db.execute("VACUUM")
+        return count
+
+    def run_summary(self) -> str:
+        kinds = sorted(set(self.run_hits) | set(self.run_misses))
+        return ", ".join(f"{k} {self.run_hits.get(k, 0)} hit / {self.run_misses.get(k, 0)} miss" for k in kinds)
+
+
+_result_cache: ResultCache | None = None
+
+
+def result_cache() -> ResultCache:
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache(CACHE_PATH, CACHE_MAX_MB * 1024 * 1024)
+    return _result_cache
+
 
 # ── Step 1: Extract transcript ──────────────────────────
 def extract_video_id(url_or_id: str) -> str:
@@ -147,33 +275,150 @@ RAW TRANSCRIPT:
 {text}"""
 
 
-def clean_with_llm(raw_text: str) -> str:
-    """Send transcript through GPT-4o-mini for cleanup."""
+CLEANUP_SYSTEM = "You are a scientific transcript editor. Preserve all peptide research content. Remove everything else."
+# Changes whenever the prompt does, so edited prompts never reuse old cleanups
+CLEANUP_PROMPT_VERSION = cache_key(CLEANUP_SYSTEM, CLEANUP_PROMPT)[:12]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 chars/token for English) — good enough for budgeting and batch sizing."""
+    return len(text) // 4 + 1
+
+
+class TokenBudget:
+    """Sliding one-minute token budget shared by every in-flight LLM call.
+
+    Callers reserve an estimate before the call and settle it with the real
+    usage afterwards. Thread-safe, so it holds across event loops and threads.
+    """
+
+    def __init__(self, tokens_per_minute: int):
+        self.limit = tokens_per_minute
+        self._lock = threading.Lock()
+        self._spent: deque[list] = deque()  # [timestamp, tokens]
+
+    async def reserve(self, tokens: int) -> list:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._spent and now - self._spent[0][0] >= 60:
+                    self._spent.popleft()
+                used = sum(t for _, t in self._spent)
+                # A single oversized request still goes through once the window is empty
+                if used + tokens <= self.limit or not self._spent:
+                    entry = [now, tokens]
+                    self._spent.append(entry)
+                    return entry
+                wait = 60 - (now - self._spent[0][0])
+            await asyncio.sleep(max(wait, 0.05))
+
+    def settle(self, entry: list, actual_tokens: int):
+        with self._lock:
+            entry[1] = actual_tokens
+
+
+cleanup_budget = TokenBudget(CLEANUP_TPM)
+
+_async_openai: AsyncOpenAI | None = None
+_async_openai_loop = None
+
+
+def async_openai() -> AsyncOpenAI:
+    """AsyncOpenAI client for the running event loop (its connection pool is loop-bound)."""
+    global _async_openai, _async_openai_loop
+    loop = asyncio.get_running_loop()
+    if _async_openai is None or _async_openai_loop is not loop:
+        # Retries are ours (see retry_delay)
+        _async_openai = AsyncOpenAI(api_key=OPENAI_KEY, max_retries=0)
+        _async_openai_loop = loop
+    return _async_openai
+
+
+def retry_delay(error: Exception, attempt: int) -> float | None:
+    """Seconds to wait before retrying an OpenAI call, or None if it should not be retried."""
+    if isinstance(error, (openai_lib.APIConnectionError, openai_lib.APITimeoutError)):
+        retry_after = None
+    elif isinstance(error, openai_lib.APIStatusError) and (error.status_code == 429 or error.status_code >= 500):
+        headers = error.response.headers
+        retry_after = None
+        try:
+            if headers.get("retry-after-ms"):
+                retry_after = float(headers["retry-after-ms"]) / 1000
+            elif headers.get("retry-after"):
+                retry_after = float(headers["retry-after"])
+        except ValueError:
+            pass
+    else:
+        return None
+    # Exponential backoff with full jitter, but never sooner than the server asked
+    backoff = random.uniform(0, min(60.0, 2.0 * 2 ** attempt))
+    return max(backoff, retry_after or 0.0)
+
+
+async def clean_chunk(chunk: str) -> tuple[str, int | None]:
+    """Clean one transcript chunk. Returns (markdown, total tokens), tokens None if it came from the cache."""
+    key = cache_key("cleanup", CLEANUP_MODEL, CLEANUP_PROMPT_VERSION, chunk)
+    cached = result_cache().get("cleanup", key)
+    if cached is not None:
+        return cached.decode("utf-8"), None
+
+    prompt = CLEANUP_PROMPT.format(text=chunk)
+    # Cleanup output is about as long as its input
+    estimate = estimate_tokens(CLEANUP_SYSTEM) + estimate_tokens(prompt) + estimate_tokens(chunk)
+    for attempt in range(CLEANUP_MAX_RETRIES + 1):
+        reservation = await cleanup_budget.reserve(estimate)
+        try:
+            response = await async_openai().chat.completions.create(
+                model=CLEANUP_MODEL,
+                messages=[
+                    {"role": "system", "content": CLEANUP_SYSTEM},
+                    {"role": "user", "content": prompt},
+                ],
+                temperature=0.1,
+            )
+        except Exception as e:
+            cleanup_budget.settle(reservation, 0)
+            delay = retry_delay(e, attempt)
+            if delay is None or attempt == CLEANUP_MAX_RETRIES:
+                raise
+            print(f"         (cleanup call failed: {type(e).__name__} — retrying in {delay:.1f}s)")
+            await asyncio.sleep(delay)
+            continue
+        tokens = response.usage.total_tokens if response.usage else estimate
+        cleanup_budget.settle(reservation, tokens)
+        result = response.choices[0].message.content or ""
+        if result and response.choices[0].finish_reason != "length":
+            result_cache().put("cleanup", key, result.encode("utf-8"))
+        return result, tokens
+
+
+async def clean_with_llm_async(raw_text: str) -> str:
+    """Send transcript through GPT-4o-mini for cleanup, CLEANUP_CONCURRENCY chunks at a time."""
     print(f"  [2/5] Cleaning with {CLEANUP_MODEL}...")
 
-    # Split into ~8000 char chunks for the LLM (well within context window)
     words = raw_text.split()
-    chunk_size = 3000  # words per LLM call
-    chunks = []
-    for i in range(0, len(words), chunk_size):
-        chunks.append(" ".join(words[i:i + chunk_size]))
-
-    cleaned_parts = []
-    for i, chunk in enumerate(chunks):
-        print(f"         Chunk {i + 1}/{len(chunks)}...", end=" ", flush=True)
-        response = openai.chat.completions.create(
-            model=CLEANUP_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a scientific transcript editor. Preserve all peptide research content. Remove everything else."},
-                {"role": "user", "content": CLEANUP_PROMPT.format(text=chunk)},
-            ],
-            temperature=0.1,
-        )
-        result = response.choices[0].message.content or ""
-        cleaned_parts.append(result)
-        # Show token usage
-        usage = response.usage
-        print(f"({usage.total_tokens:,} tokens)" if usage else "")
+    chunks = [" ".join(words[i:i + CLEANUP_CHUNK_WORDS]) for i in range(0, len(words), CLEANUP_CHUNK_WORDS)]
+
+    slots = asyncio.Semaphore(CLEANUP_CONCURRENCY)
+    done = 0
+
+    async def run(i: int, chunk: str) -> str:
+        nonlocal done
+        async with slots:
+            result, tokens = await clean_chunk(chunk)
+        done += 1
+        usage = "cached" if tokens is None else f"{tokens:,} tokens"
+        print(f"         Chunk {i + 1}/{len(chunks)} done ({usage}) [{done}/{len(chunks)}]")
+        return result
+
+    tasks = [asyncio.ensure_future(run(i, chunk)) for i, chunk in enumerate(chunks)]
+    try:
+        # gather keeps chunk order regardless of completion order
+        cleaned_parts = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
 
     cleaned = "\n\n".join(cleaned_parts)
     word_count = len(cleaned.split())
@@ -181,6 +426,11 @@ def clean_with_llm(raw_text: str) -> str:
     return cleaned
 
 
+def clean_with_llm(raw_text: str) -> str:
+    """Synchronous entry point for clean_with_llm_async."""
+    return asyncio.run(clean_with_llm_async(raw_text))
+
+
 # ── Step 4: Topic-based chunking ────────────────────────
 def chunk_by_topic(markdown: str) -> list[dict]:
     """Split cleaned markdown at ## headers, with word-based overlap for long sections."""
@@ -221,47 +471,128 @@ def chunk_by_topic(markdown: str) -> list[dict]:
 
 
 # ── Step 5: Embed and store ─────────────────────────────
+EMBED_BATCH_SIZE = 256            # inputs per embeddings call (API max is 2048)
+EMBED_BATCH_MAX_TOKENS = 200_000  # per-call token ceiling (API max is 300k)
+INSERT_BATCH_SIZE = 50            # rows per Supabase insert (~30KB each with the vector)
+
+
+def embed_texts(texts: list[str]) -> list[list[float]]:
+    """Embed texts, serving repeats from the cache and batching the rest into as few calls as the limits allow."""
+    cache = result_cache()
+    keys = [cache_key("embedding", EMBEDDING_MODEL, text) for text in texts]
+    cached = cache.get_many("embedding", keys)
+    # Each distinct uncached text is embedded once
+    pending = list({key: text for key, text in zip(keys, texts) if key not in cached}.items())
+
+    start = 0
+    while start < len(pending):
+        end, tokens = start, 0
+        while end < len(pending) and end - start < EMBED_BATCH_SIZE:
+            tokens += estimate_tokens(pending[end][1])
+            if tokens > EMBED_BATCH_MAX_TOKENS and end > start:
+                break
+            end += 1
+        batch = pending[start:end]
+        response = openai.embeddings.create(model=EMBEDDING_MODEL, input=[text for _, text in batch])
+        fresh = {
+            batch[d.index][0]: array.array("f", d.embedding).tobytes()
+            for d in response.data
+        }
+        cache.put_many("embedding", fresh)
+        cached.update(fresh)
+        start = end
+
+    print(f"         Embedded {len(pending)} new texts ({len(texts) - len(pending)} from cache)")
+    return [array.array("f", cached[key]).tolist() for key in keys]
+
+
+def insert_rows(rows: list[dict]) -> int:
+    """Bulk-insert rows in chunks; a chunk that fails is retried row by row. Returns rows stored."""
+    stored = 0
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        batch = rows[start:start + INSERT_BATCH_SIZE]
+        try:
+            result = supabase.table("embeddings").insert(batch).execute()
+            if result.data and len(result.data) == len(batch):
+                stored += len(batch)
+                continue
+        except Exception as e:
+            print(f"  WARN: bulk insert of {len(batch)} rows failed ({e}) — retrying one by one")
+        for row in batch:
+            try:
+                result = supabase.table("embeddings").insert(row).execute()
+            except Exception as e:
+                result = None
+                print(f"  ERROR storing chunk {row['metadata']['chunk_index']}: {e}")
+            if result is not None and result.data:
+                stored += 1
+            elif result is not None:
+                print(f"  ERROR storing chunk {row['metadata']['chunk_index']}")
+    return stored
+
+
 def embed_and_store(chunks: list[dict], video_id: str, video_url: str, video_title: str):
-    """Generate embeddings and store in Supabase."""
+    """Generate embeddings and store in Supabase (batched: a few round trips per video)."""
     print(f"  [4/5] Embedding {len(chunks)} chunks...")
 
-    for i, chunk in enumerate(chunks):
-        # Generate embedding
-        text_for_embedding = chunk["content"].replace("\n", " ")
-        response = openai.embeddings.create(
-            model=EMBEDDING_MODEL,
-            input=text_for_embedding,
-        )
-        embedding = response.data[0].embedding
-
-        # Store in Supabase
-        result = supabase.table("embeddings").insert({
-            "content": chunk["content"],
-            "embedding": embedding,
-            "metadata": {
-                "type": "global",
-                "source": "youtube_pipeline",
-                "video_id": video_id,
-                "video_url": video_url,
-                "title": video_title,
-                "topic": chunk["topic"],
-                "chunk_index": i,
-                "word_count": len(chunk["content"].split()),
-                "ingested_at": datetime.now(timezone.utc).isoformat(),
-            }
-        }).execute()
-
-        if not result.data:
-            print(f"  ERROR storing chunk {i}")
-        else:
-            print(f"         [{i + 1}/{len(chunks)}] {chunk['topic'][:50]}... ({len(chunk['content'].split())} words)")
-
-    print(f"  [5/5] Stored {len(chunks)} chunks in Supabase!")
+    embeddings = embed_texts([chunk["content"].replace("\n", " ") for chunk in chunks])
+    ingested_at = datetime.now(timezone.utc).isoformat()
+    rows = [{
+        "content": chunk["content"],
+        "embedding": embedding,
+        "metadata": {
+            "type": "global",
+            "source": "youtube_pipeline",
+            "video_id": video_id,
+            "video_url": video_url,
+            "title": video_title,
+            "topic": chunk["topic"],
+            "chunk_index": i,
+            "word_count": len(chunk["content"].split()),
+            "ingested_at": ingested_at,
+        }
+    } for i, (chunk, embedding) in enumerate(zip(chunks, embeddings))]
+
+    stored = insert_rows(rows)
+    if stored and _ingested_ids is not None:
+        _ingested_ids.add(video_id)
+    print(f"  [5/5] Stored {stored}/{len(chunks)} chunks in Supabase!")
 
 
 # ── Dedup check ─────────────────────────────────────────
+INGESTED_PAGE_SIZE = 1000  # rows requested per page (PostgREST's default max_rows)
+
+_ingested_ids: set[str] | None = None
+
+
+def ingested_video_ids() -> set[str]:
+    """Video IDs already in the knowledge base, loaded once per run with one paginated query."""
+    global _ingested_ids
+    if _ingested_ids is None:
+        ids = set()
+        start = 0
+        while True:
+            result = supabase.table("embeddings") \
+                .select("video_id:metadata->>video_id") \
+                .eq("metadata->>source", "youtube_pipeline") \
+                .order("id") \
+                .range(start, start + INGESTED_PAGE_SIZE - 1) \
+                .execute()
+            rows = result.data or []
+            # Stop only on an empty page: the server may cap pages below INGESTED_PAGE_SIZE
+            if not rows:
+                break
+            ids.update(row["video_id"] for row in rows if row.get("video_id"))
+            start += len(rows)
+        _ingested_ids = ids
+    return _ingested_ids
+
+
 def already_ingested(video_id: str) -> bool:
-    """Check if this video has already been ingested."""
+    """Check if this video has already been ingested (in memory once the set is loaded)."""
+    if _ingested_ids is not None:
+        return video_id in _ingested_ids
+    # Single-video runs: one indexed lookup beats paging through every chunk
     result = supabase.table("embeddings") \
         .select("id") \
         .eq("metadata->>video_id", video_id) \
@@ -284,6 +615,12 @@ def save_transcript(video_id: str, raw: str, cleaned: str):
 
 
 # ── Main pipeline ───────────────────────────────────────
+def fallback_title(cleaned: str, video_id: str) -> str:
+    """First ## header of the cleaned transcript, or a generic title."""
+    first_header = re.search(r'^## (.+)$', cleaned, re.MULTILINE)
+    return first_header.group(1).strip() if first_header else f"YouTube Video {video_id}"
+
+
 def process_video(url_or_id: str, force: bool = False, video_title: str = "", cookies_path: str = ""):
     """Full pipeline: transcript -> clean -> chunk -> embed -> store."""
     video_id = extract_video_id(url_or_id)
@@ -319,14 +656,14 @@ def process_video(url_or_id: str, force: bool = False, video_title: str = "", co
 
     # Use provided title, or fall back to first header, or video ID
     if not video_title:
-        first_header = re.search(r'^## (.+)$', cleaned, re.MULTILINE)
-        video_title = first_header.group(1).strip() if first_header else f"YouTube Video {video_id}"
+        video_title = fallback_title(cleaned, video_id)
 
     # Step 5: Embed and store
     embed_and_store(chunks, video_id, video_url, video_title)
 
     print(f"\n  DONE! {len(chunks)} knowledge chunks stored for video {video_id}")
-    print(f"  Cost estimate: ~$0.01-0.03")
+    print(f"  Cost estimate: ~$0.01-0.03 (less for cached content)")
+    print(f"  Cache: {result_cache().run_summary()}")
 
 
 def purge_video(video_id: str):
@@ -338,22 +675,30 @@ def purge_video(video_id: str):
         .eq("metadata->>source", "youtube_pipeline") \
         .execute()
     count = len(result.data) if result.data else 0
+    if _ingested_ids is not None:
+        _ingested_ids.discard(video_id)
     print(f"  Deleted {count} chunks.")
 
 
 # ── Channel batch processing ────────────────────────────
-def process_channel(channel_url: str, limit: int = 100, force: bool = False, delay: int = 10, cookies_path: str = ""):
-    """Pull video IDs from a YouTube channel and process them."""
+# Channel videos flow through a staged pipeline: each stage has its own
+# workers, and the bounded queues between stages apply backpressure. Total
+# time is set by the slowest stage rather than the sum of all of them.
+FETCH_WORKERS = int(os.environ.get("INGEST_FETCH_WORKERS", "1"))   # YouTube is the touchy one
+CLEAN_WORKERS = int(os.environ.get("INGEST_CLEAN_WORKERS", "3"))   # videos in LLM cleanup at once
+CHUNK_WORKERS = 1
+STORE_WORKERS = int(os.environ.get("INGEST_STORE_WORKERS", "2"))
+RATE_LIMIT_PAUSE = 60  # seconds to hold all fetches after YouTube blocks us
+
+
+def list_channel_videos(channel_url: str, limit: int):
+    """Yield {"id", "title"} for a channel's videos, newest first, as scrapetube pages them in."""
     try:
         import scrapetube
     except ImportError:
         print("ERROR: scrapetube not installed. Run: uv pip install scrapetube")
         sys.exit(1)
 
-    print(f"\nFetching up to {limit} videos from channel...")
-    print(f"  Channel: {channel_url}\n")
-
-    # Extract channel handle or ID
     # scrapetube accepts channel_url directly
     try:
         videos = scrapetube.get_channel(channel_url=channel_url, limit=limit, sort_by="newest")
@@ -366,8 +711,6 @@ def process_channel(channel_url: str, limit: int = 100, force: bool = False, del
             print(f"ERROR: Could not parse channel URL: {channel_url}")
             sys.exit(1)
 
-    # Collect all video IDs and titles
-    video_list = []
     for v in videos:
         vid = v.get("videoId", "")
         title = ""
@@ -376,57 +719,123 @@ def process_channel(channel_url: str, limit: int = 100, force: bool = False, del
         except (AttributeError, IndexError, TypeError):
             title = str(v.get("title", ""))
         if vid:
-            video_list.append({"id": vid, "title": title})
-
-    print(f"  Found {len(video_list)} videos\n")
-
-    if not video_list:
-        print("  No videos found. Check the channel URL.")
-        return
+            yield {"id": vid, "title": title}
+
+
+async def _stage(name: str, work, inbox: asyncio.Queue, outbox: asyncio.Queue | None, workers: int, failed: list):
+    """Run `workers` copies of `work` over inbox until it yields None, passing results to outbox."""
+    async def worker():
+        while (video := await inbox.get()) is not None:
+            try:
+                result = await work(video)
+            except Exception as e:
+                print(f"  FAILED ({name}) {video['id']}: {e}")
+                failed.append({"id": video["id"], "title": video["title"]})
+                continue
+            if outbox is not None and result is not None:
+                await outbox.put(result)
+        await inbox.put(None)  # let sibling workers see the end too
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    if outbox is not None:
+        await outbox.put(None)
+
+
+async def run_channel_pipeline(videos, force: bool, delay: int, cookies_path: str) -> dict:
+    """listing → fetch (rate-limited) → clean → chunk → embed+store, one worker pool per stage."""
+    fetch_q = asyncio.Queue(maxsize=FETCH_WORKERS)
+    clean_q = asyncio.Queue(maxsize=CLEAN_WORKERS)
+    chunk_q = asyncio.Queue(maxsize=CHUNK_WORKERS)
+    store_q = asyncio.Queue(maxsize=STORE_WORKERS)
+    totals = {"listed": 0, "succeeded": 0, "skipped": 0, "failed": []}
+    fetch_lock = asyncio.Lock()
+    next_fetch_at = 0.0
+
+    async def produce():
+        if not force:
+            await asyncio.to_thread(ingested_video_ids)
+        listing = iter(videos)
+        while (video := await asyncio.to_thread(next, listing, None)) is not None:
+            totals["listed"] += 1
+            print(f"\n[{totals['listed']}] {video['id']}: {video['title'][:60]}")
+            if not force and already_ingested(video["id"]):
+                print(f"  SKIP: {video['id']} already ingested.")
+                totals["skipped"] += 1
+                continue
+            await fetch_q.put(video)
+        await fetch_q.put(None)
+
+    async def fetch(video: dict) -> dict:
+        nonlocal next_fetch_at
+        # Space transcript fetches `delay` seconds apart to avoid YouTube rate limiting
+        async with fetch_lock:
+            wait = next_fetch_at - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            next_fetch_at = time.monotonic() + delay
+        try:
+            video["raw"] = await asyncio.to_thread(fetch_transcript, video["id"], cookies_path)
+        except Exception as e:
+            # On rate limit errors, hold every fetch for a while. Match "IP" as a
+            # word: every fetch error says "Transcript fetch failed".
+            if re.search(r'blocking|\bip\b', str(e), re.IGNORECASE):
+                print(f"  Rate limited! Pausing fetches for {RATE_LIMIT_PAUSE}s...")
+                next_fetch_at = max(next_fetch_at, time.monotonic() + RATE_LIMIT_PAUSE)
+            raise
+        video["preprocessed"] = preprocess(video["raw"])
+        return video
+
+    async def clean(video: dict) -> dict:
+        video["cleaned"] = await clean_with_llm_async(video.pop("preprocessed"))
+        save_transcript(video["id"], video.pop("raw"), video["cleaned"])
+        return video
+
+    async def chunk(video: dict) -> dict:
+        video["chunks"] = chunk_by_topic(video["cleaned"])
+        if not video["chunks"]:
+            raise RuntimeError("No chunks produced. Transcript may be too short or empty.")
+        video["title"] = video["title"] or fallback_title(video["cleaned"], video["id"])
+        del video["cleaned"]
+        return video
+
+    async def store(video: dict) -> None:
+        video_url = f"https://www.youtube.com/watch?v={video['id']}"
+        await asyncio.to_thread(embed_and_store, video["chunks"], video["id"], video_url, video["title"])
+        totals["succeeded"] += 1
+        print(f"  DONE! {len(video['chunks'])} knowledge chunks stored for video {video['id']}")
+
+    failed = totals["failed"]
+    await asyncio.gather(
+        produce(),
+        _stage("fetch", fetch, fetch_q, clean_q, FETCH_WORKERS, failed),
+        _stage("clean", clean, clean_q, chunk_q, CLEAN_WORKERS, failed),
+        _stage("chunk", chunk, chunk_q, store_q, CHUNK_WORKERS, failed),
+        _stage("store", store, store_q, None, STORE_WORKERS, failed),
+    )
+    return totals
 
-    # Process each video
-    succeeded = 0
-    skipped = 0
-    failed = 0
-    failed_list = []
 
-    for i, video in enumerate(video_list):
-        print(f"\n[{i + 1}/{len(video_list)}] {video['title'][:60]}")
+def process_channel(channel_url: str, limit: int = 100, force: bool = False, delay: int = 10, cookies_path: str = ""):
+    """Pull video IDs from a YouTube channel and process them through the staged pipeline."""
+    print(f"\nFetching up to {limit} videos from channel...")
+    print(f"  Channel: {channel_url}\n")
 
-        # Check for duplicates
-        if not force and already_ingested(video["id"]):
-            print(f"  SKIP: Already ingested.")
-            skipped += 1
-            continue
+    videos = list_channel_videos(channel_url, limit)
+    totals = asyncio.run(run_channel_pipeline(videos, force=force, delay=delay, cookies_path=cookies_path))
 
-        try:
-            process_video(video["id"], force=force, video_title=video.get("title", ""), cookies_path=cookies_path)
-            succeeded += 1
-            # Delay between videos to avoid YouTube rate limiting
-            if delay > 0 and i < len(video_list) - 1:
-                print(f"  (waiting {delay}s to avoid rate limit...)")
-                time.sleep(delay)
-        except SystemExit:
-            print(f"  FAILED: Could not process {video['id']}")
-            failed += 1
-            failed_list.append(video)
-        except Exception as e:
-            print(f"  FAILED: {e}")
-            failed += 1
-            failed_list.append(video)
-            # On rate limit errors, wait extra
-            if "blocking" in str(e).lower() or "ip" in str(e).lower():
-                wait = 60
-                print(f"  Rate limited! Waiting {wait}s...")
-                time.sleep(wait)
+    if not totals["listed"]:
+        print("  No videos found. Check the channel URL.")
+        return
 
     # Summary
+    failed_list = totals["failed"]
     print(f"\n{'='*60}")
     print(f"  BATCH COMPLETE")
     print(f"{'='*60}")
-    print(f"  Succeeded: {succeeded}")
-    print(f"  Skipped (already ingested): {skipped}")
-    print(f"  Failed: {failed}")
+    print(f"  Found: {totals['listed']}")
+    print(f"  Succeeded: {totals['succeeded']}")
+    print(f"  Skipped (already ingested): {totals['skipped']}")
+    print(f"  Failed: {len(failed_list)}")
     if failed_list:
         print(f"\n  Failed videos:")
         for v in failed_list:
@@ -438,6 +847,7 @@ def process_channel(channel_url: str, limit: int = 100, force: bool = False, del
         .eq("metadata->>source", "youtube_pipeline") \
         .execute()
     print(f"    {len(result.data)} chunks across all videos")
+    print(f"\n  Cache: {result_cache().run_summary()}")
 
 
 # ── CLI ─────────────────────────────────────────────────
@@ -454,11 +864,13 @@ Usage:
   uv run python scripts/ingest_youtube.py --channel <CHANNEL_URL> [--limit N] [--delay N]
   uv run python scripts/ingest_youtube.py --purge <VIDEO_ID>     (delete all chunks for video)
   uv run python scripts/ingest_youtube.py --status               (show ingested videos)
+  uv run python scripts/ingest_youtube.py --cache-stats          (show cleanup/embedding cache usage)
+  uv run python scripts/ingest_youtube.py --cache-clear          (empty the cache)
 
 Options:
   --force       Re-ingest even if video already exists
   --limit N     Max videos to fetch from channel (default: 100)
-  --delay N     Seconds between videos to avoid rate limit (default: 10)
+  --delay N     Min seconds between transcript fetches, to avoid rate limit (default: 10)
   --cookies F   Path to cookies.txt file to bypass YouTube IP bans
                 Export from Chrome: use 'Get cookies.txt LOCALLY' extension
 
@@ -502,6 +914,20 @@ Examples:
         process_channel(channel_url, limit=limit, force=force, delay=delay, cookies_path=cookies_path)
     elif args[0] == "--purge" and len(args) > 1:
         purge_video(extract_video_id(args[1]))
+    elif args[0] == "--cache-stats":
+        stats = result_cache().stats()
+        print(f"\nCache: {CACHE_PATH} (limit {CACHE_MAX_MB} MB)")
+        if not stats:
+            print("  Empty.")
+        else:
+            print(f"\n{'Kind':<12} {'Entries':<10} {'Size (MB)':<11} {'Hits'}")
+            print("-" * 45)
+            for kind, info in sorted(stats.items()):
+                print(f"{kind:<12} {info['entries']:<10} {info['bytes'] / 1024 / 1024:<11.1f} {info['hits']}")
+            total = sum(info["bytes"] for info in stats.values())
+            print(f"\nTotal: {total / 1024 / 1024:.1f} MB of {CACHE_MAX_MB} MB")
+    elif args[0] == "--cache-clear":
+        print(f"Cleared {result_cache().clear()} cached results.")
     elif args[0] == "--status":
         # Show ingested video stats
         result = supabase.table("embeddings") \
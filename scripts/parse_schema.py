@@ -1,16 +1,61 @@
 #!/usr/bin/env python3
 """
-Parse Supabase schema JSON export and generate CREATE TABLE statements.
-Reads the MCP tool result file, extracts the column definitions JSON,
-groups by table, and outputs proper PostgreSQL DDL.
+Parse a Supabase schema export and generate either:
+- ddl: CREATE TABLE statements, from an information_schema.columns JSON
+  export (an MCP execute_sql tool result file or a plain JSON array)
+- digest: a compact, token-efficient schema summary for the onboarding
+  agent's persona, from either that JSON export or the DDL master schema
+  (supabase/schema.sql)
+
+The digest lists enums, then every table with its columns and types,
+onboarding-relevant tables first and in full. Other tables keep only their
+key columns (PK, foreign keys, required, enum-typed) unless --full is given.
+The agent API imports this file to rebuild the digest whenever the export
+changes (see agent-api/api/schema_digest.py).
+
+Usage:
+  python scripts/parse_schema.py [INPUT] [--format ddl|digest] [--full] [-o OUTPUT]
+  python scripts/parse_schema.py supabase/schema.sql          # digest
+  python scripts/parse_schema.py columns.json                 # CREATE TABLE DDL
 """
 
+import argparse
 import json
+import os
 import re
 import sys
 from collections import OrderedDict
 
-INPUT_FILE = r"C:\Users\Not John Or Justin\.claude-jarvis\projects\C--Users-Not-John-Or-Justin\c8d9a3e2-6507-4f82-8cf5-8351418d4e10\tool-results\mcp-supabase-execute_sql-1771741590450.txt"
+DEFAULT_INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "supabase", "schema.sql")
+
+# Tables the onboarding agent reads and writes, in the order the digest lists them
+ONBOARDING_TABLES = (
+    "tenant_config",
+    "peptides",
+    "scraped_peptides",
+    "contacts",
+    "org_features",
+    "pricing_tiers",
+    "wholesale_pricing_tiers",
+    "commissions",
+    "tenant_connections",
+    "onboarding_messages",
+    "organizations",
+    "profiles",
+    "user_roles",
+)
+
+# Column names worth keeping in a non-onboarding table's key-column summary
+KEY_COLUMN_NAMES = {"id", "org_id", "name", "status", "email", "title"}
+
+DIGEST_TYPES = {
+    "timestamp with time zone": "timestamptz",
+    "timestamp without time zone": "timestamp",
+    "time with time zone": "timetz",
+    "time without time zone": "time",
+    "double precision": "float8",
+    "character varying": "varchar",
+}
 
 
 def extract_columns_json(filepath: str) -> list[dict]:
@@ -20,6 +65,9 @@ def extract_columns_json(filepath: str) -> list[dict]:
 
     # Parse outer JSON array
     outer = json.loads(raw)
+    if outer and "table_name" in outer[0]:
+        # Already a plain array of column rows
+        return outer
     # Get the text field from the first element
     text_field = outer[0]["text"]
 
@@ -195,16 +243,182 @@ def generate_create_tables(columns: list[dict]) -> str:
     return "\n".join(output_parts)
 
 
-def main():
-    columns = extract_columns_json(INPUT_FILE)
-    print(f"-- Parsed {len(columns)} column definitions", file=sys.stderr)
+# ── Schema digest ──
+
+def _digest_type(sql_type: str) -> str:
+    """Shorten a PostgreSQL type name for the digest."""
+    sql_type = sql_type.strip()
+    for long, short in DIGEST_TYPES.items():
+        if sql_type.startswith(long):
+            return short + sql_type[len(long):]
+    return sql_type
+
 
-    # Count unique tables
-    table_names = sorted(set(c["table_name"] for c in columns))
-    print(f"-- Found {len(table_names)} tables", file=sys.stderr)
+def _new_table() -> dict:
+    return {"columns": [], "pk": [], "unique": [], "fks": {}}
 
-    sql = generate_create_tables(columns)
-    print(sql)
+
+def schema_from_columns(columns: list[dict]) -> tuple[dict, dict]:
+    """Tables from information_schema column rows (no key constraints in this export)."""
+    tables: OrderedDict[str, dict] = OrderedDict()
+    enums: dict[str, list[str]] = {}
+    for col in columns:
+        table = tables.setdefault(col["table_name"], _new_table())
+        required = col["is_nullable"] == "NO" and not col["column_default"]
+        table["columns"].append((col["column_name"], _digest_type(map_data_type(col)), required))
+    return tables, enums
+
+
+_ENUM_RE = re.compile(r"CREATE TYPE (?:public\.)?(\w+) AS ENUM \((.*?)\);", re.S)
+_TABLE_RE = re.compile(r"CREATE TABLE (?:IF NOT EXISTS )?(?:public\.)?(\w+) \((.*?)\n\);", re.S)
+_KEY_RE = re.compile(r"ALTER TABLE (?:public\.)?(\w+) ADD CONSTRAINT \w+ (PRIMARY KEY|UNIQUE) \(([^)]*)\)")
+_FK_RE = re.compile(
+    r"ALTER TABLE (?:public\.)?(\w+) ADD CONSTRAINT \w+ FOREIGN KEY \((\w+)\) "
+    r"REFERENCES (?:public\.)?(\w+)\((\w+)\)"
+)
+
+
+def schema_from_ddl(sql: str) -> tuple[dict, dict]:
+    """Tables, keys and enums from a DDL master schema like supabase/schema.sql."""
+    enums = {
+        name: re.findall(r"'([^']*)'", values)
+        for name, values in _ENUM_RE.findall(sql)
+    }
+    tables: OrderedDict[str, dict] = OrderedDict()
+    for name, body in _TABLE_RE.findall(sql):
+        table = tables.setdefault(name, _new_table())
+        for line in body.splitlines():
+            line = line.strip().rstrip(",")
+            if not line or line.startswith("--"):
+                continue
+            column, _, rest = line.partition(" ")
+            sql_type = re.split(r" (?:NOT NULL|DEFAULT|PRIMARY KEY|REFERENCES|UNIQUE)\b", rest)[0]
+            required = "NOT NULL" in rest and "DEFAULT" not in rest
+            table["columns"].append((column.strip('"'), _digest_type(sql_type), required))
+    for name, kind, cols in _KEY_RE.findall(sql):
+        if name in tables:
+            cols = [c.strip() for c in cols.split(",")]
+            if kind == "PRIMARY KEY":
+                tables[name]["pk"] = cols
+            else:
+                tables[name]["unique"].append(cols)
+    for name, column, ref_table, ref_column in _FK_RE.findall(sql):
+        if name in tables:
+            tables[name]["fks"][column] = ref_table if ref_column == "id" else f"{ref_table}.{ref_column}"
+    return tables, enums
+
+
+def load_schema(path: str) -> tuple[dict, dict]:
+    """Read a JSON column export or a DDL schema file."""
+    with open(path, "r", encoding="utf-8") as f:
+        head = f.read(1).lstrip()
+    if head == "[":
+        return schema_from_columns(extract_columns_json(path))
+    with open(path, "r", encoding="utf-8") as f:
+        return schema_from_ddl(f.read())
+
+
+def _format_table(name: str, table: dict, enums: dict, full: bool) -> str:
+    keys = []
+    if table["pk"] and table["pk"] != ["id"]:
+        keys.append("PK " + ",".join(table["pk"]))
+    keys += ["unique " + ",".join(cols) for cols in table["unique"]]
+
+    parts = []
+    for column, sql_type, required in table["columns"]:
+        fk = table["fks"].get(column)
+        keep = (
+            full or required or fk or sql_type in enums
+            or column in KEY_COLUMN_NAMES or column in table["pk"]
+        )
+        if not keep:
+            continue
+        part = f"{column} {sql_type}"
+        if required:
+            part += "!"
+        if fk:
+            part += f"->{fk}"
+        parts.append(part)
+    hidden = len(table["columns"]) - len(parts)
+    if hidden:
+        parts.append(f"+{hidden} more")
+
+    head = f"{name} ({'; '.join(keys)})" if keys else name
+    return f"{head}: {', '.join(parts)}"
+
+
+def generate_digest(
+    tables: dict,
+    enums: dict,
+    source: str = "",
+    priority: tuple[str, ...] = ONBOARDING_TABLES,
+    full: bool = False,
+) -> str:
+    """Render the compact schema digest attached to the agent persona."""
+    first = [t for t in priority if t in tables]
+    rest = sorted(t for t in tables if t not in priority)
+    lines = [
+        "[DATABASE SCHEMA]",
+        f"public schema, {len(tables)} tables" + (f" (from {source})" if source else "") + ".",
+        "Use this instead of mcp__supabase__list_tables or information_schema queries;",
+        "only look a table up if it is missing here. Notation: `col type`, `!` = NOT NULL",
+        "with no default (set it on insert), `->table` = foreign key to table.id,",
+        "`+N more` = other columns left out. The primary key is `id` unless shown.",
+        "",
+    ]
+    if enums:
+        lines.append("Enums:")
+        lines += [f"  {name}: {'|'.join(values)}" for name, values in enums.items()]
+        lines.append("")
+    lines.append("Onboarding tables:")
+    lines += [_format_table(t, tables[t], enums, full=True) for t in first]
+    lines.append("")
+    lines.append("Other tables:")
+    lines += [_format_table(t, tables[t], enums, full=full) for t in rest]
+    return "\n".join(lines) + "\n"
+
+
+def build_digest(path: str, full: bool = False) -> str:
+    """Load a schema export and render its digest (used by the agent API)."""
+    tables, enums = load_schema(path)
+    return generate_digest(tables, enums, source=os.path.basename(path), full=full)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("input", nargs="?", default=DEFAULT_INPUT,
+                        help="schema export: information_schema JSON or DDL (default: supabase/schema.sql)")
+    parser.add_argument("--format", choices=("ddl", "digest"),
+                        help="default: ddl for a JSON export, digest for a DDL file")
+    parser.add_argument("--full", action="store_true", help="digest: list every column of every table")
+    parser.add_argument("-o", "--output", help="write here instead of stdout")
+    args = parser.parse_args()
+
+    with open(args.input, "r", encoding="utf-8") as f:
+        is_json = f.read(1).lstrip() == "["
+    fmt = args.format or ("ddl" if is_json else "digest")
+
+    if fmt == "digest":
+        output = build_digest(args.input, full=args.full)
+        print(f"-- Digest: {len(output)} chars", file=sys.stderr)
+    else:
+        if not is_json:
+            print("ERROR: --format ddl needs an information_schema JSON export", file=sys.stderr)
+            sys.exit(1)
+        columns = extract_columns_json(args.input)
+        print(f"-- Parsed {len(columns)} column definitions", file=sys.stderr)
+
+        # Count unique tables
+        table_names = sorted(set(c["table_name"] for c in columns))
+        print(f"-- Found {len(table_names)} tables", file=sys.stderr)
+
+        output = generate_create_tables(columns) + "\n"
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output)
 
 
 if __name__ == "__main__":
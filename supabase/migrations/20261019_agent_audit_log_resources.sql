@@ -0,0 +1,3 @@
+-- Per-run resource accounting for agent turns (peak_rss_mb, cpu_seconds,
+-- max_processes, wall_seconds, killed) — see agent-api/api/run_limits.py.
+ALTER TABLE agent_audit_log ADD COLUMN IF NOT EXISTS resources JSONB;
@@ -0,0 +1,3 @@
+-- Provider token usage per agent turn (input, cache_creation_input_tokens,
+-- cache_read_input_tokens, output) — used to track prompt-cache hit rates.
+ALTER TABLE agent_audit_log ADD COLUMN IF NOT EXISTS usage JSONB;
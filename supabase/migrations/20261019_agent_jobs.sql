@@ -0,0 +1,165 @@
+-- Agent Jobs — the networked job queue behind AGENT_QUEUE_URL=supabase://
+-- (agent-api/api/job_queue.py SupabaseBackend). The API tier enqueues Claude CLI
+-- runs here and worker nodes on any host lease them. Mirrors the SQLite backend's
+-- jobs table: times are epoch seconds, all taken from the database clock so
+-- hosts with drifting clocks agree on lease expiry.
+-- Written only by the agent backend (service key); never exposed to the frontend.
+CREATE TABLE IF NOT EXISTS agent_jobs (
+  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  queue TEXT NOT NULL,
+  payload JSONB NOT NULL,
+  status TEXT NOT NULL DEFAULT 'queued',   -- queued | leased | done | failed | expired | cancelled
+  attempts INTEGER NOT NULL DEFAULT 0,
+  max_attempts INTEGER NOT NULL DEFAULT 1,
+  not_after DOUBLE PRECISION,              -- a job not started by then expires
+  lease_owner TEXT,
+  lease_expires_at DOUBLE PRECISION,
+  result JSONB,
+  error JSONB,
+  created_at DOUBLE PRECISION NOT NULL DEFAULT extract(epoch FROM clock_timestamp()),
+  updated_at DOUBLE PRECISION NOT NULL DEFAULT extract(epoch FROM clock_timestamp())
+);
+
+CREATE INDEX IF NOT EXISTS agent_jobs_ready ON agent_jobs (queue, status, created_at);
+
+-- RLS on with no policies: only the service role can read or write.
+ALTER TABLE agent_jobs ENABLE ROW LEVEL SECURITY;
+
+-- Claim the oldest ready job. Expired leases are requeued (or failed once out of
+-- attempts) and stale jobs expired first. SKIP LOCKED lets concurrent workers
+-- lease different jobs without waiting on each other.
+CREATE OR REPLACE FUNCTION public.agent_job_lease(p_queue text, p_owner text, p_lease_seconds double precision)
+RETURNS SETOF agent_jobs
+LANGUAGE plpgsql
+SET search_path TO 'public'
+AS $$
+DECLARE
+  v_now double precision := extract(epoch FROM clock_timestamp());
+BEGIN
+  UPDATE agent_jobs SET
+    status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+    error = CASE WHEN attempts < max_attempts THEN error ELSE '{"kind": "lease_expired"}'::jsonb END,
+    lease_owner = NULL, lease_expires_at = NULL, updated_at = v_now
+  WHERE id IN (
+    SELECT id FROM agent_jobs
+    WHERE queue = p_queue AND status = 'leased' AND lease_expires_at < v_now
+    FOR UPDATE SKIP LOCKED
+  );
+
+  UPDATE agent_jobs SET status = 'expired', updated_at = v_now
+  WHERE id IN (
+    SELECT id FROM agent_jobs
+    WHERE queue = p_queue AND status = 'queued' AND not_after < v_now
+    FOR UPDATE SKIP LOCKED
+  );
+
+  RETURN QUERY
+  UPDATE agent_jobs SET
+    status = 'leased', attempts = attempts + 1, lease_owner = p_owner,
+    lease_expires_at = v_now + p_lease_seconds, updated_at = v_now
+  WHERE id = (
+    SELECT id FROM agent_jobs
+    WHERE queue = p_queue AND status = 'queued'
+    ORDER BY created_at
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+  )
+  RETURNING *;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.agent_job_heartbeat(p_id uuid, p_owner text, p_lease_seconds double precision)
+RETURNS boolean
+LANGUAGE sql
+SET search_path TO 'public'
+AS $$
+  WITH t AS (SELECT extract(epoch FROM clock_timestamp()) AS now)
+  UPDATE agent_jobs SET lease_expires_at = t.now + p_lease_seconds, updated_at = t.now
+  FROM t
+  WHERE id = p_id AND lease_owner = p_owner AND status = 'leased'
+  RETURNING true;
+$$;
+
+CREATE OR REPLACE FUNCTION public.agent_job_complete(p_id uuid, p_owner text, p_result jsonb)
+RETURNS boolean
+LANGUAGE sql
+SET search_path TO 'public'
+AS $$
+  UPDATE agent_jobs SET
+    status = 'done', result = p_result, lease_expires_at = NULL,
+    updated_at = extract(epoch FROM clock_timestamp())
+  WHERE id = p_id AND lease_owner = p_owner AND status = 'leased'
+  RETURNING true;
+$$;
+
+CREATE OR REPLACE FUNCTION public.agent_job_fail(p_id uuid, p_owner text, p_error jsonb, p_retry boolean)
+RETURNS boolean
+LANGUAGE sql
+SET search_path TO 'public'
+AS $$
+  UPDATE agent_jobs SET
+    status = CASE WHEN p_retry AND attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+    error = p_error, lease_owner = NULL, lease_expires_at = NULL,
+    updated_at = extract(epoch FROM clock_timestamp())
+  WHERE id = p_id AND lease_owner = p_owner AND status = 'leased'
+  RETURNING true;
+$$;
+
+CREATE OR REPLACE FUNCTION public.agent_job_cancel(p_id uuid)
+RETURNS boolean
+LANGUAGE sql
+SET search_path TO 'public'
+AS $$
+  UPDATE agent_jobs SET status = 'cancelled', updated_at = extract(epoch FROM clock_timestamp())
+  WHERE id = p_id AND status IN ('queued', 'leased')
+  RETURNING true;
+$$;
+
+CREATE OR REPLACE FUNCTION public.agent_job_purge(p_older_than double precision)
+RETURNS integer
+LANGUAGE sql
+SET search_path TO 'public'
+AS $$
+  WITH purged AS (
+    DELETE FROM agent_jobs
+    WHERE status IN ('done', 'failed', 'expired', 'cancelled') AND updated_at < p_older_than
+    RETURNING 1
+  )
+  SELECT count(*)::integer FROM purged;
+$$;
+
+CREATE OR REPLACE FUNCTION public.agent_job_stats(p_queue text)
+RETURNS jsonb
+LANGUAGE sql
+SET search_path TO 'public'
+AS $$
+  SELECT jsonb_build_object(
+    'counts', COALESCE((
+      SELECT jsonb_object_agg(status, n) FROM (
+        SELECT status, count(*) AS n FROM agent_jobs WHERE queue = p_queue GROUP BY status
+      ) c
+    ), '{}'::jsonb),
+    'busy_workers', (
+      SELECT count(DISTINCT lease_owner) FROM agent_jobs WHERE queue = p_queue AND status = 'leased'
+    ),
+    'oldest_queued_seconds', COALESCE((
+      SELECT extract(epoch FROM clock_timestamp()) - min(created_at)
+      FROM agent_jobs WHERE queue = p_queue AND status = 'queued'
+    ), 0)
+  );
+$$;
+
+REVOKE ALL ON FUNCTION public.agent_job_lease(text, text, double precision) FROM PUBLIC;
+REVOKE ALL ON FUNCTION public.agent_job_heartbeat(uuid, text, double precision) FROM PUBLIC;
+REVOKE ALL ON FUNCTION public.agent_job_complete(uuid, text, jsonb) FROM PUBLIC;
+REVOKE ALL ON FUNCTION public.agent_job_fail(uuid, text, jsonb, boolean) FROM PUBLIC;
+REVOKE ALL ON FUNCTION public.agent_job_cancel(uuid) FROM PUBLIC;
+REVOKE ALL ON FUNCTION public.agent_job_purge(double precision) FROM PUBLIC;
+REVOKE ALL ON FUNCTION public.agent_job_stats(text) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.agent_job_lease(text, text, double precision) TO service_role;
+GRANT EXECUTE ON FUNCTION public.agent_job_heartbeat(uuid, text, double precision) TO service_role;
+GRANT EXECUTE ON FUNCTION public.agent_job_complete(uuid, text, jsonb) TO service_role;
+GRANT EXECUTE ON FUNCTION public.agent_job_fail(uuid, text, jsonb, boolean) TO service_role;
+GRANT EXECUTE ON FUNCTION public.agent_job_cancel(uuid) TO service_role;
+GRANT EXECUTE ON FUNCTION public.agent_job_purge(double precision) TO service_role;
+GRANT EXECUTE ON FUNCTION public.agent_job_stats(text) TO service_role;
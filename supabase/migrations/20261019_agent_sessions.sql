@@ -0,0 +1,20 @@
+-- Agent Sessions — one resumable Claude CLI session per org for the onboarding agent.
+-- Written only by the agent backend (service key); never exposed to the frontend.
+CREATE TABLE IF NOT EXISTS agent_sessions (
+  org_id UUID PRIMARY KEY REFERENCES organizations(id) ON DELETE CASCADE,
+  session_id TEXT NOT NULL,              -- Claude CLI session id passed to --resume
+  persona_hash TEXT NOT NULL,            -- hash of CLAUDE.md the session was started with
+  turns INTEGER NOT NULL DEFAULT 0,      -- agent turns run in this session
+  prompt_chars INTEGER NOT NULL DEFAULT 0, -- prompt + reply characters accumulated
+  state_block TEXT NOT NULL DEFAULT '',  -- org state snapshot sent on the last turn
+  last_message_at TEXT NOT NULL DEFAULT '', -- created_at of the last reply the session saw
+  started_at DOUBLE PRECISION NOT NULL,  -- epoch seconds, for age-based rotation
+  updated_at TIMESTAMPTZ DEFAULT now()
+);
+
+-- RLS on with no policies: only the service role can read or write.
+ALTER TABLE agent_sessions ENABLE ROW LEVEL SECURITY;
+
+-- Upserts from the agent backend must refresh updated_at too
+DROP TRIGGER IF EXISTS update_agent_sessions_updated_at ON agent_sessions;
+CREATE TRIGGER update_agent_sessions_updated_at BEFORE UPDATE ON agent_sessions FOR EACH ROW EXECUTE FUNCTION public.update_updated_at_column();
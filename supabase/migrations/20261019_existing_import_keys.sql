@@ -0,0 +1,43 @@
+-- De-dupe lookup for chat file imports (agent-api/api/uploads.py).
+-- Given one batch's keys — 'name:<lowercased name>' for peptides,
+-- 'email:<lowercased email>' / 'phone:<digits>' for contacts — returns the ones
+-- the org already has. Stored values are normalized the same way as the
+-- uploaded ones: trimmed and lowercased, phones reduced to digits without a
+-- leading US country code (uploads._normalize_phone).
+-- Called by the agent backend (service role) once per insert batch.
+
+CREATE OR REPLACE FUNCTION public.existing_import_keys(
+  p_org_id uuid,
+  p_table text,
+  p_keys text[]
+)
+RETURNS TABLE (key text)
+LANGUAGE sql
+STABLE
+SET search_path TO 'public'
+AS $$
+  SELECT DISTINCT k.key FROM (
+    SELECT 'name:' || lower(btrim(p.name)) AS key
+    FROM peptides p
+    WHERE p_table = 'peptides' AND p.org_id = p_org_id
+    UNION ALL
+    SELECT 'email:' || lower(btrim(c.email))
+    FROM contacts c
+    WHERE p_table = 'contacts' AND c.org_id = p_org_id AND c.email IS NOT NULL
+    UNION ALL
+    SELECT 'phone:' || CASE
+      WHEN d.digits ~ '^1\d{10}$' THEN substr(d.digits, 2)
+      ELSE d.digits
+    END
+    FROM contacts c
+    CROSS JOIN LATERAL (SELECT regexp_replace(c.phone, '\D', '', 'g') AS digits) d
+    WHERE p_table = 'contacts' AND c.org_id = p_org_id AND c.phone IS NOT NULL
+  ) k
+  WHERE k.key = ANY(p_keys);
+$$;
+
+-- Functions are executable by PUBLIC (which includes anon) unless revoked
+REVOKE ALL ON FUNCTION public.existing_import_keys(uuid, text, text[]) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.existing_import_keys(uuid, text, text[]) TO service_role;
+
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,111 @@
+-- Set-based import of an org's pending scraped_peptides into its catalog.
+-- One transaction: INSERT ... SELECT the eligible rows (confidence >= threshold,
+-- de-duplicated by case-insensitive name, skipping names already in peptides),
+-- then mark every eligible scraped row 'imported' and link imported_peptide_id
+-- to the new — or already existing — peptide. Returns one row per scraped row.
+-- Used by the onboarding agent (MCP execute_sql, a direct connection with no JWT)
+-- and POST /api/peptides/import-scraped (service role).
+
+CREATE OR REPLACE FUNCTION public.import_scraped_peptides(
+  p_org_id uuid,
+  p_min_confidence numeric DEFAULT 0.5
+)
+RETURNS TABLE (
+  scraped_id uuid,
+  peptide_id uuid,
+  name text,
+  retail_price numeric,
+  outcome text   -- imported | duplicate (name already in catalog)
+)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path TO 'public'
+AS $$
+#variable_conflict use_column
+BEGIN
+  -- Allowed callers:
+  -- * service role (agent backend via PostgREST)
+  -- * a privileged direct connection with no JWT (the agent's MCP execute_sql);
+  --   checked on session_user, since current_user is the owner in SECURITY DEFINER.
+  --   If that session is already scoped to an org, it must be this one.
+  -- * an authenticated admin or staff member of the org (not customers or clients)
+  IF coalesce(auth.role(), '') = 'service_role' THEN
+    NULL;
+  ELSIF nullif(current_setting('request.jwt.claims', true), '') IS NULL
+    AND EXISTS (
+      SELECT 1 FROM pg_roles r
+      WHERE r.rolname = session_user AND (r.rolsuper OR r.rolbypassrls OR r.rolname = 'postgres')
+    ) THEN
+    IF coalesce(nullif(current_setting('app.agent_org_id', true), ''), p_org_id::text) <> p_org_id::text THEN
+      RAISE EXCEPTION 'Not allowed to import peptides for org % (session is scoped to another org)', p_org_id;
+    END IF;
+  ELSIF coalesce(auth.role(), '') = 'authenticated' AND EXISTS (
+    SELECT 1 FROM profiles
+    WHERE user_id = auth.uid() AND org_id = p_org_id AND role IN ('admin', 'staff', 'super_admin')
+  ) THEN
+    NULL;
+  ELSE
+    RAISE EXCEPTION 'Not allowed to import peptides for org %', p_org_id;
+  END IF;
+
+  -- Lock writes in this transaction to the org (enforce_agent_org_scope triggers)
+  PERFORM set_config('app.agent_org_id', p_org_id::text, true);
+  -- Serialize concurrent imports for the same org
+  PERFORM pg_advisory_xact_lock(hashtext('import_scraped_peptides:' || p_org_id::text));
+
+  RETURN QUERY
+  WITH eligible AS (
+    SELECT s.id, btrim(s.name) AS name, s.price, s.description, s.confidence, s.created_at,
+           lower(btrim(s.name)) AS key
+    FROM scraped_peptides s
+    WHERE s.org_id = p_org_id
+      AND s.status = 'pending'
+      AND coalesce(s.confidence, 0) >= p_min_confidence
+      AND btrim(s.name) <> ''
+  ),
+  candidates AS (
+    SELECT DISTINCT ON (e.key) e.*
+    FROM eligible e
+    ORDER BY e.key, e.confidence DESC NULLS LAST, e.created_at
+  ),
+  existing AS (
+    SELECT DISTINCT ON (lower(btrim(p.name))) p.id, lower(btrim(p.name)) AS key, p.name, p.retail_price
+    FROM peptides p
+    WHERE p.org_id = p_org_id
+    ORDER BY lower(btrim(p.name)), p.active DESC, p.created_at
+  ),
+  inserted AS (
+    INSERT INTO peptides (org_id, name, retail_price, description, active)
+    SELECT p_org_id, c.name, coalesce(c.price, 0), c.description, true
+    FROM candidates c
+    WHERE NOT EXISTS (SELECT 1 FROM existing x WHERE x.key = c.key)
+    RETURNING peptides.id, lower(btrim(peptides.name)) AS key, peptides.name, peptides.retail_price
+  ),
+  resolved AS (
+    SELECT e.id AS scraped_id, i.id AS peptide_id, i.name, i.retail_price, 'imported'::text AS outcome
+    FROM eligible e JOIN inserted i ON i.key = e.key
+    UNION ALL
+    SELECT e.id, x.id, x.name, x.retail_price, 'duplicate'::text
+    FROM eligible e JOIN existing x ON x.key = e.key
+  ),
+  marked AS (
+    UPDATE scraped_peptides s
+    SET status = 'imported', imported_peptide_id = r.peptide_id
+    FROM resolved r
+    WHERE s.id = r.scraped_id
+    RETURNING s.id
+  )
+  SELECT r.scraped_id, r.peptide_id, r.name, r.retail_price, r.outcome
+  FROM resolved r
+  ORDER BY r.outcome DESC, r.name;
+END;
+$$;
+
+-- Functions are executable by PUBLIC (which includes anon) unless revoked
+REVOKE ALL ON FUNCTION public.import_scraped_peptides(uuid, numeric) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.import_scraped_peptides(uuid, numeric) TO authenticated;
+GRANT EXECUTE ON FUNCTION public.import_scraped_peptides(uuid, numeric) TO service_role;
+
+CREATE INDEX IF NOT EXISTS idx_scraped_peptides_org_status ON scraped_peptides(org_id, status);
+
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,6 @@
+-- Keyset pagination for the onboarding agent's /api/history endpoint.
+-- Cursors are (created_at, id); the id tie-break keeps pages stable when
+-- two messages share a timestamp, and this index serves both scan directions.
+
+CREATE INDEX IF NOT EXISTS idx_onboarding_messages_org_keyset
+  ON onboarding_messages(org_id, created_at, id);